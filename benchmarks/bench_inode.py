@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+INode tree lookups per second and bytes per node for a tree of
+--entries files spread over --dirs directories.
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from ps3mfw.fs import DirEntType, INode
+
+
+def build_tree(entries: int, dirs: int) -> INode:
+    rootfs = INode.root_node()
+    dir_inos = [
+        INode(name=f"dir{d:04d}", type=DirEntType.DIR, parent=rootfs)
+        for d in range(dirs)
+    ]
+    for i in range(entries):
+        INode(
+            name=f"file{i:06d}.sprx",
+            type=DirEntType.REG,
+            size=i,
+            off=i * 512,
+            parent=dir_inos[i % dirs],
+        )
+    return rootfs
+
+
+def run(entries: int = 100_000, dirs: int = 100, lookups: int = 200_000):
+    tracemalloc.start()
+    rootfs = build_tree(entries, dirs)
+    mem, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rng = random.Random(0)
+    paths = [
+        f"/dir{i % dirs:04d}/file{i:06d}.sprx"
+        for i in (rng.randrange(entries) for _ in range(lookups))
+    ]
+    t = time.perf_counter()
+    for path in paths:
+        rootfs.lookup(path)
+    elapsed = time.perf_counter() - t
+    return {
+        "entries": entries,
+        "dirs": dirs,
+        "bytes_per_node": mem / (entries + dirs + 1),
+        "lookups_per_s": lookups / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--dirs", type=int, default=100)
+    args = parser.parse_args()
+    print(json.dumps(run(args.entries, args.dirs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
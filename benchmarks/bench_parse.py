@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+PUP and SCE header parses per second with the interpreted construct Structs
+and with the fast struct-based path.
+
+Without --pup/--spp, a synthetic PUP with --segments segments and a
+synthetic SPKG signed with the test keys are used.
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from ps3mfw.certfile import CertifiedFile
+from ps3mfw.io_extras import FancyRawIOBaseProxy, OffsetRawIOBase
+from ps3mfw.keys import load_keystore
+from ps3mfw.pup import parse_pup
+from ps3mfw.testing import build_test_pup, build_test_spkg
+
+from .synthetic import synthetic_keystore
+
+
+def parses_per_s(parse, min_seconds: float) -> float:
+    n, t = 0, time.perf_counter()
+    while True:
+        parse()
+        n += 1
+        elapsed = time.perf_counter() - t
+        if elapsed >= min_seconds:
+            return n / elapsed
+
+
+def run(pup_path, spp_path, keystore, min_seconds: float = 1.0):
+    pup_fh = FancyRawIOBaseProxy(pup_path)
+    spp_fh = OffsetRawIOBase(FancyRawIOBaseProxy(spp_path))
+    results = {}
+    for fast in (False, True):
+        mode = "fast" if fast else "construct"
+        results[mode] = {
+            "pup_parses_per_s": parses_per_s(
+                lambda: parse_pup(pup_fh, fast=fast), min_seconds
+            ),
+            "sce_parses_per_s": parses_per_s(
+                lambda: CertifiedFile(spp_fh, keystore=keystore, fast_parse=fast),
+                min_seconds,
+            ),
+        }
+    results["pup_speedup"] = (
+        results["fast"]["pup_parses_per_s"] / results["construct"]["pup_parses_per_s"]
+    )
+    results["sce_speedup"] = (
+        results["fast"]["sce_parses_per_s"] / results["construct"]["sce_parses_per_s"]
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pup", help="PUP file, e.g. ps3updat-cex-3.55.pup")
+    parser.add_argument("--spp", help="SCE file, e.g. default.spp (needs keys)")
+    parser.add_argument("--segments", type=int, default=12)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pup_path, spp_path = args.pup, args.spp
+        if pup_path is None:
+            pup_path = str(Path(tmp_dir) / "synthetic.pup")
+            segments = {0x100 + i: bytes(64) for i in range(args.segments)}
+            Path(pup_path).write_bytes(build_test_pup(segments))
+        if spp_path is None:
+            spp_path = str(Path(tmp_dir) / "synthetic.spkg")
+            segments = [(bytes(256), True, False)] * 3
+            Path(spp_path).write_bytes(build_test_spkg(segments))
+            keystore = synthetic_keystore()
+        else:
+            keystore = load_keystore()
+        print(json.dumps(run(pup_path, spp_path, keystore, args.seconds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
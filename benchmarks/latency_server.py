@@ -0,0 +1,54 @@
+"""
+Range server handler with injected per-request latency and a per-connection
+bandwidth cap, for benchmarking against something closer to a real mirror.
+"""
+
+import time
+from typing import Optional, Type
+
+from ps3mfw.testing import RangeHTTPRequestHandler
+
+
+class _ThrottledWriter:
+    def __init__(self, f, bandwidth: float):
+        self.f = f
+        self.bandwidth = bandwidth
+        self.sent = 0
+        self.start = time.perf_counter()
+
+    def write(self, buf) -> int:
+        n = self.f.write(buf)
+        self.sent += len(buf)
+        ahead = self.sent / self.bandwidth - (time.perf_counter() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+        return n
+
+    def flush(self) -> None:
+        self.f.flush()
+
+
+class ThrottledRangeHTTPRequestHandler(RangeHTTPRequestHandler):
+    latency: float = 0.0
+    bandwidth: Optional[float] = None
+
+    def send_head(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().send_head()
+
+    def copyfile(self, infile, outfile):
+        if self.bandwidth:
+            outfile = _ThrottledWriter(outfile, self.bandwidth)
+        super().copyfile(infile, outfile)
+
+
+def throttled_handler(
+    latency: float = 0.0, bandwidth: Optional[float] = None
+) -> Type[ThrottledRangeHTTPRequestHandler]:
+    """Handler class adding latency seconds per request, bandwidth bytes/s."""
+    return type(
+        "ThrottledRangeHTTPRequestHandler",
+        (ThrottledRangeHTTPRequestHandler,),
+        {"latency": latency, "bandwidth": bandwidth},
+    )
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Replay an access trace written with 'ps3mfw-ng --trace' against the local
+range server.
+
+The traced reads of one layer are issued in order, as fast as possible,
+through an HTTPFile on the traced file, served with --latency-ms injected
+per request and an optional per-connection --bandwidth-mib cap.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from ps3mfw.io_extras import HTTPFile
+from ps3mfw.iostats import parse_trace
+from ps3mfw.testing import http_server
+
+from .latency_server import throttled_handler
+
+
+def replay(
+    trace_path: str,
+    path: str,
+    layer: str,
+    latency: float = 0.0,
+    bandwidth=None,
+    blksz: int = 256 * 1024,
+) -> dict:
+    accesses = parse_trace(trace_path, layer)
+    handler = throttled_handler(latency, bandwidth)
+    url = f"http://localhost:38080/{os.path.basename(path)}"
+    with http_server(
+        directory=os.path.dirname(os.path.abspath(path)), handler_class=handler
+    ):
+        fh = HTTPFile(url, blksz=blksz)
+        t = time.perf_counter()
+        nbytes = sum(len(fh.pread(offset, size)) for _, _, offset, size in accesses)
+        seconds = time.perf_counter() - t
+        fh.close()
+    return {
+        "reads": len(accesses),
+        "bytes": nbytes,
+        "seconds": seconds,
+        "traced_seconds": accesses[-1][0] - accesses[0][0] if accesses else 0.0,
+        "cache_hits": fh.stats.hits,
+        "cache_misses": fh.stats.misses,
+        "requests": fh.http_stats.requests,
+        "request_bytes": fh.http_stats.bytes_received,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="Trace file from ps3mfw-ng --trace")
+    parser.add_argument("file", help="Local copy of the traced file")
+    parser.add_argument("--layer", default="in_pup", help="Traced layer to replay")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--bandwidth-mib", type=float, default=None)
+    parser.add_argument("--blksz", type=int, default=256 * 1024)
+    args = parser.parse_args()
+    bandwidth = args.bandwidth_mib * 2**20 if args.bandwidth_mib else None
+    results = replay(
+        args.trace,
+        args.file,
+        args.layer,
+        args.latency_ms / 1000,
+        bandwidth,
+        args.blksz,
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
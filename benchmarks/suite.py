@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+I/O, parsing and filesystem benchmark suite against the local range server.
+
+A synthetic PUP is served with --latency-ms injected per request and an
+optional per-connection --bandwidth-mib cap. Every metric is a rate, so
+higher is better; with --baseline, metrics that fell by more than
+--tolerance are reported and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from ps3mfw.certfile import CertFile, CertifiedFile
+from ps3mfw.io_extras import HTTPFile
+from ps3mfw.pup import PUPFS, PUPFile
+from ps3mfw.testing import http_server
+
+from .latency_server import throttled_handler
+from .synthetic import SPKG_SEG, TAR_SEG, build_synthetic_pup, synthetic_keystore
+
+URL = "http://localhost:38080/synthetic.pup"
+BIG_SEG = "patch_data.pkg"
+
+
+def _rate(fn, min_seconds: float) -> float:
+    n, t = 0, time.perf_counter()
+    while True:
+        fn()
+        n += 1
+        elapsed = time.perf_counter() - t
+        if elapsed >= min_seconds:
+            return n / elapsed
+
+
+def bench_httpfile(blksz: int, nrandom: int) -> dict:
+    fh = HTTPFile(URL, blksz=blksz)
+    t = time.perf_counter()
+    nread = 0
+    buf = memoryview(bytearray(1024 * 1024))
+    while True:
+        n = fh.readinto(buf)
+        if not n:
+            break
+        nread += n
+    seq = nread / (time.perf_counter() - t)
+    fh.close()
+
+    fh = HTTPFile(URL, blksz=blksz)
+    rng = random.Random(0)
+    offsets = [rng.randrange(fh.sz - 4096) for _ in range(nrandom)]
+    t = time.perf_counter()
+    for off in offsets:
+        fh.pread(off, 4096)
+    random_s = time.perf_counter() - t
+    fh.close()
+    return {
+        "httpfile_seq_mib_per_s": seq / 2**20,
+        "httpfile_random_4k_reads_per_s": nrandom / random_s,
+    }
+
+
+def bench_pup(min_seconds: float) -> dict:
+    def open_pup():
+        PUPFile(HTTPFile(URL)).fh.close()
+
+    pupfs = PUPFS(HTTPFile(URL))
+    names = pupfs.listdir("/")
+    results = {
+        "pupfile_opens_per_s": _rate(open_pup, min_seconds),
+        "pupfs_getinfo_per_s": _rate(
+            lambda: [pupfs.getinfo(f"/{name}") for name in names], min_seconds
+        )
+        * len(names),
+        "pupfs_listdir_per_s": _rate(lambda: pupfs.listdir("/"), min_seconds),
+        "pupfs_openbin_per_s": _rate(
+            lambda: pupfs.openbin(f"/{SPKG_SEG}"), min_seconds
+        ),
+    }
+
+    keystore = synthetic_keystore()
+    seg = pupfs.openbin(f"/{SPKG_SEG}")
+    results["certfile_header_parses_per_s"] = _rate(
+        lambda: CertFile.parse(seg.pread(0, 0x20)), min_seconds
+    )
+    results["certifiedfile_opens_per_s"] = _rate(
+        lambda: CertifiedFile(seg, keystore=keystore), min_seconds
+    )
+    pupfs.fh.close()
+    return results
+
+
+def bench_extract(sizes: Dict[str, int], out_dir: Path) -> dict:
+    # cold cache, so this includes every range request
+    pupfs = PUPFS(HTTPFile(URL))
+    t = time.perf_counter()
+    for name in (BIG_SEG, TAR_SEG, SPKG_SEG):
+        with open(out_dir / name, "wb") as f:
+            pupfs.openbin(f"/{name}").copy_to(f)
+    elapsed = time.perf_counter() - t
+    pupfs.fh.close()
+    total = sizes[BIG_SEG] + sizes[TAR_SEG] + sizes[SPKG_SEG]
+    return {"extract_mib_per_s": total / elapsed / 2**20}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    latency: float = 0.0,
+    bandwidth: Optional[float] = None,
+    seg_sz: int = 32 * 2**20,
+    blksz: int = 256 * 1024,
+    nrandom: int = 200,
+    min_seconds: float = 1.0,
+) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        (tmp_dir / "out").mkdir()
+        sizes = build_synthetic_pup(tmp_dir / "synthetic.pup", seg_sz)
+        handler = throttled_handler(latency, bandwidth)
+        with http_server(directory=tmp_dir, handler_class=handler):
+            metrics = {
+                **bench_httpfile(blksz, nrandom),
+                **bench_pup(min_seconds),
+                **bench_extract(sizes, tmp_dir / "out"),
+            }
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "params": {
+            "latency_s": latency,
+            "bandwidth_bytes_per_s": bandwidth,
+            "seg_sz": seg_sz,
+            "blksz": blksz,
+        },
+        "metrics": metrics,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> Dict[str, float]:
+    """Metrics that fell below (1 - tolerance) of the baseline, with ratios."""
+    regressions = {}
+    for name, val in results["metrics"].items():
+        base = baseline["metrics"].get(name)
+        if base and val < base * (1 - tolerance):
+            regressions[name] = val / base
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--bandwidth-mib", type=float, default=None)
+    parser.add_argument("--seg-size", type=int, default=32 * 2**20)
+    parser.add_argument("--blksz", type=int, default=256 * 1024)
+    parser.add_argument("--random-reads", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--out", help="Write results JSON here as well")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    results = run(
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mib * 2**20 if args.bandwidth_mib else None,
+        seg_sz=args.seg_size,
+        blksz=args.blksz,
+        nrandom=args.random_reads,
+        min_seconds=args.seconds,
+    )
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["params"] != results["params"]:
+            print("warning: baseline was run with other params", file=sys.stderr)
+        results["regressions"] = compare(results, baseline, args.tolerance)
+    out = json.dumps(results, indent=2)
+    print(out)
+    if args.out:
+        Path(args.out).write_text(out + "\n")
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
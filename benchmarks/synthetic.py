@@ -0,0 +1,65 @@
+"""Synthetic PUP images built locally, so benchmarks need no network."""
+
+import io
+import os
+import tarfile
+from pathlib import Path
+from typing import Dict
+
+from ps3mfw.keys import KeyStore
+from ps3mfw.pup import get_seg_filename
+from ps3mfw.testing import (
+    TEST_ERK,
+    TEST_HMAC_KEY,
+    TEST_REV,
+    TEST_RIV,
+    build_test_pup,
+    build_test_spkg,
+)
+
+SPKG_SEG = "ps3swu.self"
+TAR_SEG = "update_files.tar"
+
+
+def build_tar(nfiles: int, file_sz: int) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tf:
+        for i in range(nfiles):
+            ti = tarfile.TarInfo(f"dev_flash/vsh/module/file{i:04d}.sprx")
+            ti.size = file_sz
+            tf.addfile(ti, io.BytesIO(os.urandom(file_sz)))
+    return buf.getvalue()
+
+
+def build_synthetic_pup(
+    path: Path, seg_sz: int, tar_files: int = 256, tar_file_sz: int = 4096
+) -> Dict[str, int]:
+    """
+    Write a PUP with small text segments, an SPKG signed with the test keys,
+    a tar of tar_files members and a seg_sz random segment. Returns the
+    segment sizes by name.
+    """
+    segments = {
+        0x100: b"99.99\n",
+        0x101: b"<license/>\n" * 64,
+        0x102: b"0\n",
+        0x200: build_test_spkg([(os.urandom(64 * 1024), True, False)] * 4),
+        0x300: build_tar(tar_files, tar_file_sz),
+        0x203: os.urandom(seg_sz),
+    }
+    path.write_bytes(build_test_pup(segments, TEST_HMAC_KEY))
+    return {get_seg_filename(segid): len(data) for segid, data in segments.items()}
+
+
+def synthetic_keystore() -> KeyStore:
+    return KeyStore.from_entries(
+        [
+            dict(
+                name="spkg-test",
+                category="SPKG",
+                revision=TEST_REV,
+                erk=TEST_ERK.hex(),
+                riv=TEST_RIV.hex(),
+            )
+        ]
+    )
@@ -1,16 +1,45 @@
 #!/usr/bin/env python3
 
+import argparse
+import os
+from functools import partial
 from http.server import ThreadingHTTPServer
 
-from tests.ps3mfw.http_ranges_server import RangeHTTPRequestHandler
+from ps3mfw.httpd import FastRangeHTTPRequestHandler, FastRangeHTTPServer
+from ps3mfw.testing import RangeHTTPRequestHandler
 
 
-def run(server_class=ThreadingHTTPServer, handler_class=RangeHTTPRequestHandler):
-    server_address = ("", 38080)
-    httpd = server_class(server_address, handler_class)
-    httpd.RequestHandlerClass.quiet = False
+def run(
+    server_class=ThreadingHTTPServer,
+    handler_class=RangeHTTPRequestHandler,
+    bind: str = "",
+    port: int = 38080,
+    directory: str = os.getcwd(),
+):
+    server_address = (bind, port)
+    httpd = server_class(server_address, partial(handler_class, directory=directory))
+    handler_class.quiet = False
     httpd.serve_forever()
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Range HTTP server")
+    parser.add_argument("--bind", default="", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=38080)
+    parser.add_argument("--directory", default=os.getcwd(), help="Directory to serve")
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="sendfile, multi-range, keep-alive and ETag server that also "
+        "serves PUP segments as /fw.pup/<segment>",
+    )
+    args = parser.parse_args()
+    if args.production:
+        server_class, handler_class = FastRangeHTTPServer, FastRangeHTTPRequestHandler
+    else:
+        server_class, handler_class = ThreadingHTTPServer, RangeHTTPRequestHandler
+    run(server_class, handler_class, args.bind, args.port, args.directory)
+
+
 if __name__ == "__main__":
-    run()
+    main()
@@ -1 +1,21 @@
-from . import certfile, fs, io_extras, keys, pup, tar, util
+from . import (
+    aio,
+    blobstore,
+    blockpool,
+    catalog,
+    certfile,
+    crypto,
+    delta,
+    diskcache,
+    faststruct,
+    fs,
+    httpd,
+    inflate,
+    io_extras,
+    iostats,
+    keys,
+    mount,
+    pup,
+    tar,
+    util,
+)
@@ -0,0 +1,246 @@
+import asyncio
+import io
+import mmap
+from array import array
+from typing import Dict, Final, Optional, Union
+
+import aiohttp
+from attrs import define, field
+from construct import Container
+
+from .blockpool import CacheStats
+from .faststruct import fast_struct
+from .fs import INode
+from .io_extras import BlockCacheMixin, parse_content_range, range_response_parts
+from .pup import PUPHeader, parse_pup_tables, pup_rootfs, pup_tables_size
+from .util import round_up
+
+# ranges must address the stored bytes, not a re-encoded body
+_IDENTITY = {"Accept-Encoding": "identity"}
+
+
+def client_session(limit: int = 64, limit_per_host: int = 16) -> aiohttp.ClientSession:
+    """
+    Session for many AsyncHTTPFiles to share. Requests beyond the connection
+    limits wait for a pooled connection to be released instead of opening
+    another one, so thousands of files can be read concurrently.
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+        auto_decompress=False,
+    )
+
+
+@define
+class AsyncHTTPFile(BlockCacheMixin):
+    """
+    asyncio counterpart of HTTPFile.
+
+    Blocks are cached in an anonymous mapping and tracked in a bitmap like
+    HTTPFile's, and concurrent reads of a block still being fetched wait for
+    that fetch instead of requesting it again. Use open() to create one.
+    """
+
+    url: Final[str]
+    session: Final[aiohttp.ClientSession]
+    sz: Final[int]
+    blksz: Final[int] = 256 * 1024
+    max_req_sz: Final[int] = 16 * 1024 * 1024
+    stats: Final[CacheStats] = field(init=False, factory=CacheStats)
+    _idx: int = field(init=False, default=0)
+    _cache: Final[mmap.mmap] = field(init=False)
+    _cache_blkmap: Final[array] = field(init=False)
+    _inflight: Final[Dict[int, asyncio.Task]] = field(init=False, factory=dict)
+
+    def __attrs_post_init__(self) -> None:
+        self._cache = mmap.mmap(-1, max(self.sz, 1))
+        self._cache_blkmap = self._new_blkmap(self.sz, self.blksz)
+
+    @classmethod
+    async def open(
+        cls,
+        url: str,
+        session: aiohttp.ClientSession,
+        blksz: int = 256 * 1024,
+        max_req_sz: int = 16 * 1024 * 1024,
+    ) -> "AsyncHTTPFile":
+        """
+        Open url with a ranged GET of its first block instead of a HEAD
+        request, so the size and the start of the file come in one request.
+        """
+        headers = {"Range": f"bytes=0-{blksz - 1}", **_IDENTITY}
+        async with session.get(url, headers=headers) as r:
+            r.raise_for_status()
+            body = await r.read()
+            if r.status == 206:
+                sz = parse_content_range(r.headers.get("Content-Range", ""))[2]
+                if sz is None:
+                    # "bytes 0-N/*", the length has to come from a HEAD
+                    async with session.head(url, headers=_IDENTITY) as head_r:
+                        head_r.raise_for_status()
+                        sz = int(head_r.headers["Content-Length"])
+            else:
+                # server ignored the Range header and sent the whole file
+                sz = len(body)
+            parts = range_response_parts(
+                r.status, r.headers, body, sz, [(0, min(blksz, sz))]
+            )
+        f = cls(url, session, sz, blksz=blksz, max_req_sz=max_req_sz)
+        f.stats.misses += 1
+        for off, buf in parts:
+            f._fill_cache(off, buf)
+        return f
+
+    def _is_pending(self, blk: int) -> bool:
+        return blk in self._inflight
+
+    def _fill_cache(self, byte_off: int, buf: bytes) -> None:
+        byte_end = min(byte_off + len(buf), self.sz)
+        self._cache[byte_off:byte_end] = buf[: byte_end - byte_off]
+        for blk in self._filled_blks(byte_off, byte_end):
+            self._mark_cached(blk * self.blksz)
+
+    async def _fetch_range(self, byte_start: int, byte_end: int) -> None:
+        while True:
+            headers = {"Range": f"bytes={byte_start}-{byte_end - 1}", **_IDENTITY}
+            async with self.session.get(self.url, headers=headers) as r:
+                r.raise_for_status()
+                parts = range_response_parts(
+                    r.status,
+                    r.headers,
+                    await r.read(),
+                    self.sz,
+                    [(byte_start, byte_end)],
+                )
+            for off, buf in parts:
+                self._fill_cache(off, buf)
+            # a server may send less than was asked for, ask again for the rest
+            start = byte_start
+            while byte_start < byte_end and self._is_cached(byte_start):
+                byte_start += self.blksz
+            if byte_start >= byte_end:
+                return
+            if byte_start == start:
+                raise OSError(f"no data for range {byte_start:#x}-{byte_end:#x}")
+
+    async def _fetch_run(self, blk_start: int, blk_end: int) -> None:
+        try:
+            await self._fetch_range(
+                blk_start * self.blksz, min(blk_end * self.blksz, self.sz)
+            )
+        finally:
+            for blk in range(blk_start, blk_end):
+                self._inflight.pop(blk, None)
+
+    async def _fill(self, byte_start: int, byte_end: int) -> None:
+        blk_start = byte_start // self.blksz
+        blk_end = round_up(byte_end, self.blksz) // self.blksz
+        for s, e in list(self._uncached_runs(blk_start, blk_end)):
+            self.stats.misses += e - s
+            task = asyncio.ensure_future(self._fetch_run(s, e))
+            for blk in range(s, e):
+                self._inflight[blk] = task
+        tasks = {
+            self._inflight[blk]
+            for blk in range(blk_start, blk_end)
+            if blk in self._inflight
+        }
+        self.stats.hits += sum(
+            self._is_cached(blk * self.blksz) for blk in range(blk_start, blk_end)
+        )
+        if tasks:
+            # a cancelled reader must not cancel fetches other readers await
+            await asyncio.gather(*(asyncio.shield(task) for task in tasks))
+        if not all(
+            self._is_cached(blk * self.blksz) for blk in range(blk_start, blk_end)
+        ):
+            raise OSError(f"range {byte_start:#x}-{byte_end:#x} still not cached")
+
+    async def pread(self, offset: int, size: int) -> bytes:
+        size = max(0, min(size, self.sz - offset))
+        await self._fill(offset, offset + size)
+        return self._cache[offset : offset + size]
+
+    async def preadinto(self, offset: int, b) -> int:
+        with memoryview(b) as mv, mv.cast("B") as out:
+            size = max(0, min(len(out), self.sz - offset))
+            await self._fill(offset, offset + size)
+            with memoryview(self._cache) as cache:
+                out[:size] = cache[offset : offset + size]
+        return size
+
+    async def read(self, size: int = -1) -> bytes:
+        if size == -1:
+            size = self.sz - self._idx
+        if self._idx + size > self.sz:
+            raise IndexError("out of bounds size")
+        res = await self.pread(self._idx, size)
+        self._idx += size
+        return res
+
+    def tell(self) -> int:
+        return self._idx
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._idx = offset
+        elif whence == io.SEEK_CUR:
+            self._idx += offset
+        elif whence == io.SEEK_END:
+            self._idx = self.sz + offset
+        if not (0 <= self._idx <= self.sz):
+            raise IndexError("out of bounds seek")
+        return self._idx
+
+    async def close(self) -> None:
+        tasks = set(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._cache.close()
+
+
+@define
+class AsyncPUPFile:
+    """
+    PUP header, tables and segment tree read through an AsyncHTTPFile.
+    Opening one usually costs a single range request, see open().
+    """
+
+    fh: Final[AsyncHTTPFile]
+    pup: Final[Container]
+    rootfs: Final[INode] = field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self.rootfs = pup_rootfs(self.pup)
+
+    @classmethod
+    async def open(
+        cls,
+        src: Union[str, AsyncHTTPFile],
+        session: Optional[aiohttp.ClientSession] = None,
+    ) -> "AsyncPUPFile":
+        """
+        The header and tables sit inside the first block, which is fetched
+        when a URL is opened, unless there are thousands of segments; then
+        the rest of the tables is fetched with one more request.
+        """
+        fh = src if isinstance(src, AsyncHTTPFile) else None
+        if fh is None:
+            fh = await AsyncHTTPFile.open(src, session)
+        hdr_st = fast_struct(PUPHeader)
+        hdr = hdr_st.parse(await fh.pread(0, hdr_st.size))
+        tables = await fh.pread(hdr_st.size, pup_tables_size(hdr))
+        return cls(fh, parse_pup_tables(hdr, tables))
+
+    async def read(self, path: str, offset: int = 0, size: int = -1) -> bytes:
+        node = self.rootfs.lookup(path)
+        if node is None or node.is_dir:
+            raise FileNotFoundError(path)
+        if size == -1:
+            size = node.size - offset
+        size = max(0, min(size, node.size - offset))
+        return await self.fh.pread(node.off + offset, size)
+
+    async def close(self) -> None:
+        await self.fh.close()
@@ -0,0 +1,271 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from typing import BinaryIO, Callable, Final, List, Optional, Tuple
+
+from attrs import define, field
+
+from .fs import DirEntType
+from .io_extras import FancyRawIOBase, FancyRawIOBaseProxy, OffsetRawIOBase
+from .pup import VERSION_SEGID, PUPFile, get_seg_filename
+from .tar import TarMember, scan_tar
+
+# ioctl(dst, FICLONE, src) from linux/fs.h
+FICLONE = 0x40049409
+
+LINK_MODES = ("hardlink", "reflink")
+
+
+class _HashingWriter:
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def write(self, b) -> int:
+        self.hash.update(b)
+        return self.f.write(b)
+
+
+@define
+class ExtractStats:
+    written: int = 0
+    reused: int = 0
+
+
+@define
+class BlobStore:
+    """
+    Content-addressed store of file contents under root/blobs, named by
+    their SHA-256.
+
+    Hints map a cheap key, such as a PUP segment digest or tar header
+    metadata, to the blob it was last seen with, so contents that are
+    already stored can be found without reading or hashing them again.
+    """
+
+    root: Final[str]
+    _db: Final[sqlite3.Connection] = field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.root, "hints.sqlite"))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS hints (key TEXT PRIMARY KEY, blob TEXT)"
+        )
+
+    def close(self) -> None:
+        self._db.close()
+
+    def blob_path(self, blob: str) -> str:
+        return os.path.join(self.root, "blobs", blob[:2], blob[2:])
+
+    def lookup(self, key: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT blob FROM hints WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or not os.path.exists(self.blob_path(row[0])):
+            return None
+        return row[0]
+
+    def remember(self, key: str, blob: str) -> None:
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO hints VALUES (?, ?)",
+                (key, blob),
+            )
+
+    def put(
+        self, fh: FancyRawIOBase, offset: int = 0, size: int = -1
+    ) -> Tuple[str, bool]:
+        """
+        Store size bytes of fh at offset, returning the blob name and whether
+        it was new. Blobs are read-only since trees link to them.
+        """
+        return self._put(lambda f: fh.copy_to(f, offset, size))
+
+    def put_bytes(self, data: bytes) -> Tuple[str, bool]:
+        return self._put(lambda f: f.write(data))
+
+    def _put(self, write: Callable[[BinaryIO], object]) -> Tuple[str, bool]:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer = _HashingWriter(f)
+                write(writer)
+            blob = writer.hash.hexdigest()
+            path = self.blob_path(blob)
+            if os.path.exists(path):
+                return blob, False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, path)
+            return blob, True
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def link(self, blob: str, dst: str, mode: str = "hardlink") -> None:
+        """Make dst a hardlink to, or a reflinked copy of, blob."""
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp_dst = f"{dst}.{os.getpid()}.tmp"
+        src = self.blob_path(blob)
+        if mode == "hardlink":
+            # rename() over another link to the same inode does nothing
+            if os.path.lexists(dst) and os.path.samestat(os.lstat(dst), os.stat(src)):
+                return
+            os.link(src, tmp_dst)
+        else:
+            with open(src, "rb") as fsrc, open(tmp_dst, "wb") as fdst:
+                try:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                except OSError:
+                    # no reflink support on this filesystem, copy the data
+                    shutil.copyfileobj(fsrc, fdst)
+        os.replace(tmp_dst, dst)
+
+
+def _member_key(seg_name: str, m: TarMember) -> str:
+    # like rsync's quick check, a member with the same path, size, mtime and
+    # mode is taken to be unchanged
+    return f"tar:{seg_name}:{m.path}:{m.size:x}:{m.mtime:x}:{m.mode:o}"
+
+
+def _inside(tree: str, path: str) -> bool:
+    """Whether path, with every symlink in it resolved, stays within tree."""
+    root = os.path.realpath(tree)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+
+def _store_tar(
+    store: BlobStore, seg_name: str, fh: FancyRawIOBase, stats: ExtractStats
+) -> List[list]:
+    """
+    Store every regular member of the tar in fh and return its manifest,
+    a [type, path, blob or link target] entry per member.
+    """
+    entries = []
+    for m in scan_tar(fh):
+        if m.type == DirEntType.DIR:
+            entries.append([m.type.name, m.path, None])
+        elif m.type == DirEntType.LNK:
+            entries.append([m.type.name, m.path, m.linkname])
+        else:
+            key = _member_key(seg_name, m)
+            blob = store.lookup(key)
+            if blob is None:
+                blob, new = store.put(fh, m.off, m.size)
+                store.remember(key, blob)
+                stats.written += m.size if new else 0
+                stats.reused += 0 if new else m.size
+            else:
+                stats.reused += m.size
+            entries.append([m.type.name, m.path, blob])
+    return entries
+
+
+def _link_tar(store: BlobStore, entries: List[list], tree: str, mode: str) -> None:
+    # symlinks are made last so no member is placed through one from this
+    # tar, and _inside() catches any left in tree by an earlier extraction
+    symlinks = []
+    for type_name, path, value in entries:
+        if ".." in path.split("/"):
+            continue
+        dst = os.path.join(tree, path)
+        if not _inside(tree, os.path.dirname(dst)):
+            continue
+        if type_name == DirEntType.DIR.name:
+            if _inside(tree, dst):
+                os.makedirs(dst, exist_ok=True)
+        elif type_name == DirEntType.LNK.name:
+            symlinks.append((value, dst))
+        else:
+            store.link(value, dst, mode)
+    for linkname, dst in symlinks:
+        # a directory made for other members wins over a symlink in its place
+        if not _inside(tree, os.path.dirname(dst)) or (
+            os.path.isdir(dst) and not os.path.islink(dst)
+        ):
+            continue
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        os.symlink(linkname, dst)
+
+
+def extract_pup(
+    pupf: PUPFile,
+    out_dir: str,
+    version: Optional[str] = None,
+    mode: str = "hardlink",
+    keep_tars: bool = False,
+) -> ExtractStats:
+    """
+    Extract every segment of pupf, and the members of its tar segments, into
+    the tree out_dir/versions/<version> of links into a BlobStore at out_dir.
+
+    A segment whose PUP digest was seen before is not read at all, and a tar
+    member whose header matches one seen before is not read or hashed again,
+    so extracting a version after its predecessor only writes what changed.
+    Tar segments are stored as their members plus a manifest listing them,
+    so a changed tar segment only costs its changed members. keep_tars also
+    stores each tar segment whole and links it into the tree, which writes
+    every changed tar segment in full.
+    """
+    if version is None:
+        version = f"{pupf.pup.header.image_version:#x}"
+        for seg in pupf.pup.segment_table:
+            if seg.id == VERSION_SEGID:
+                version = pupf.fh.pread(seg.offset, seg.size)
+                version = version.decode(errors="replace").strip()
+    version = version.replace("/", "_")
+    if version in ("", ".", ".."):
+        raise ValueError(f"invalid version name '{version}'")
+    tree = os.path.join(out_dir, "versions", version)
+    store = BlobStore(out_dir)
+    digests = {d.segment_index: d.digest for d in pupf.pup.digest_table}
+    stats = ExtractStats()
+    try:
+        for idx, seg in enumerate(pupf.pup.segment_table):
+            name = get_seg_filename(seg.id)
+            key = f"{digests[idx].hex()}:{seg.size:x}"
+            blob = store.lookup(f"seg:{key}")
+            manifest = store.lookup(f"tar:{key}")
+            if manifest is not None:
+                with open(store.blob_path(manifest), "rb") as f:
+                    entries = json.load(f)
+                if not keep_tars:
+                    stats.reused += seg.size
+            else:
+                # a stored copy of the segment is read instead of pupf
+                if blob is None:
+                    src = OffsetRawIOBase(pupf.fh, off=seg.offset, sz=seg.size)
+                else:
+                    src = FancyRawIOBaseProxy(store.blob_path(blob))
+                try:
+                    entries = None
+                    if src.pread(257, 5) == b"ustar":
+                        entries = _store_tar(store, name, src, stats)
+                        manifest, _ = store.put_bytes(json.dumps(entries).encode())
+                        store.remember(f"tar:{key}", manifest)
+                finally:
+                    if blob is not None:
+                        src.close()
+            if entries is None or keep_tars:
+                if blob is None:
+                    blob, new = store.put(pupf.fh, seg.offset, seg.size)
+                    store.remember(f"seg:{key}", blob)
+                    stats.written += seg.size if new else 0
+                    stats.reused += 0 if new else seg.size
+                else:
+                    stats.reused += seg.size
+                store.link(blob, os.path.join(tree, name), mode)
+            if entries is not None:
+                tar_tree = os.path.join(tree, os.path.splitext(name)[0])
+                _link_tar(store, entries, tar_tree, mode)
+    finally:
+        store.close()
+    return stats
@@ -0,0 +1,76 @@
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Final, List
+
+from attrs import define, field
+
+
+@define
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+@define
+class BlockPool:
+    """
+    Fixed-size LRU pool of cache blocks.
+
+    Blocks live in nslots slots of one anonymous mapping and are found through
+    a block -> slot index, so memory use is bounded by nslots * blksz no matter
+    how large the file being cached is.
+    """
+
+    nslots: Final[int]
+    blksz: Final[int]
+    stats: Final[CacheStats] = field(factory=CacheStats)
+    _mem: Final[mmap.mmap] = field(init=False)
+    _slots: Final[OrderedDict] = field(init=False, factory=OrderedDict)
+    _lens: Final[array] = field(init=False)
+    _free: Final[List[int]] = field(init=False)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self) -> None:
+        if self.nslots < 1:
+            raise ValueError("BlockPool needs at least one slot")
+        self._mem = mmap.mmap(-1, self.nslots * self.blksz)
+        self._lens = array("L", [0] * self.nslots)
+        self._free = list(reversed(range(self.nslots)))
+
+    def __contains__(self, blk: int) -> bool:
+        return blk in self._slots
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def readinto(self, blk: int, start: int, out: memoryview) -> bool:
+        with self._lock:
+            slot = self._slots.get(blk)
+            if slot is None:
+                return False
+            self._slots.move_to_end(blk)
+            base = slot * self.blksz + start
+            with memoryview(self._mem) as mem:
+                out[:] = mem[base : base + len(out)]
+            return True
+
+    def put(self, blk: int, buf: bytes) -> None:
+        if len(buf) > self.blksz:
+            raise ValueError("buffer larger than a block")
+        with self._lock:
+            slot = self._slots.get(blk)
+            if slot is not None:
+                self._slots.move_to_end(blk)
+            else:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    _, slot = self._slots.popitem(last=False)
+                    self.stats.evictions += 1
+                self._slots[blk] = slot
+            base = slot * self.blksz
+            self._mem[base : base + len(buf)] = buf
+            self._lens[slot] = len(buf)
@@ -0,0 +1,254 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Final, Iterable, List, Optional, Tuple
+
+from attrs import define, field
+from construct import Container
+
+from .io_extras import (
+    FancyRawIOBase,
+    FancyRawIOBaseProxy,
+    HTTPFile,
+    OffsetRawIOBase,
+    resource_stamp,
+)
+from .pup import VERSION_SEGID, get_seg_filename, parse_pup
+from .tar import scan_tar
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    has_members INTEGER NOT NULL,
+    package_version INTEGER NOT NULL,
+    image_version INTEGER NOT NULL,
+    version TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    segid INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sign_algorithm INTEGER NOT NULL,
+    digest BLOB NOT NULL,
+    PRIMARY KEY (source_id, idx)
+);
+CREATE INDEX IF NOT EXISTS segments_segid ON segments(segid);
+CREATE INDEX IF NOT EXISTS segments_digest ON segments(digest);
+CREATE TABLE IF NOT EXISTS members (
+    source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+    segid INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    type TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (source_id, segid, path)
+);
+CREATE INDEX IF NOT EXISTS members_path ON members(path);
+"""
+
+
+@define
+class SourceRecord:
+    """Everything indexed from one PUP."""
+
+    source: str
+    size: int
+    etag: str
+    has_members: bool
+    pup: Container
+    version: Optional[str]
+    members: List[Tuple[int, str, str, int, int]]
+
+
+@define
+class IndexResult:
+    source: str
+    status: str
+    error: Optional[str] = None
+
+
+def _open_source(source: str, timeout: float) -> Tuple[FancyRawIOBase, Tuple[int, str]]:
+    """Open source, returning it with its size and validator."""
+    if source.startswith(("http://", "https://")):
+        # the header and tables of most PUPs fit in the first 64 KiB, and
+        # the stamp comes from the HEAD request HTTPFile sends when opened
+        fh = HTTPFile(source, blksz=64 * 1024, timeout=timeout)
+        return fh, fh.stamp
+    return FancyRawIOBaseProxy(source), resource_stamp(source)
+
+
+def scan_source(
+    source: str,
+    members: bool = False,
+    known: Optional[Tuple[int, str, bool]] = None,
+    timeout: float = 30.0,
+    wrap: Optional[Callable[[FancyRawIOBase, str], FancyRawIOBase]] = None,
+) -> Optional[SourceRecord]:
+    """
+    Read the header and tables of source and, with members, the member list
+    of every tar segment. Returns None when source still matches known, the
+    (size, etag, has_members) it was last indexed with. HTTP requests give
+    up after timeout seconds. wrap(fh, source), e.g. to instrument the
+    reads, is applied to the opened source before it is parsed.
+    """
+    fh, (size, etag) = _open_source(source, timeout)
+    try:
+        if (
+            known is not None
+            and known[:2] == (size, etag)
+            and (known[2] or not members)
+        ):
+            return None
+        if wrap is not None:
+            fh = wrap(fh, source)
+        pup = parse_pup(fh)
+        version = None
+        tar_members = []
+        for seg in pup.segment_table:
+            if seg.id == VERSION_SEGID:
+                version = fh.pread(seg.offset, seg.size).decode(errors="replace")
+                version = version.strip()
+            if members and fh.pread(seg.offset + 257, 5) == b"ustar":
+                seg_fh = OffsetRawIOBase(fh, off=seg.offset, sz=seg.size)
+                tar_members.extend(
+                    (seg.id, m.path, m.type.name, seg.offset + m.off, m.size)
+                    for m in scan_tar(seg_fh)
+                )
+    finally:
+        fh.close()
+    return SourceRecord(
+        source=source,
+        size=size,
+        etag=etag,
+        has_members=members,
+        pup=pup,
+        version=version,
+        members=tar_members,
+    )
+
+
+@define
+class Catalog:
+    """
+    SQLite catalog of PUP sources, their segments and digests and optionally
+    the members of their tar segments.
+
+    Sources are scanned on a thread pool, since the work is waiting on disk
+    or HTTP round trips, and written from the calling thread. A source whose
+    size and validator are unchanged since it was indexed is skipped.
+    """
+
+    path: Final[str]
+    _db: Final[sqlite3.Connection] = field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _known(self) -> Dict[str, Tuple[int, str, bool]]:
+        rows = self._db.execute("SELECT source, size, etag, has_members FROM sources")
+        return {src: (size, etag, bool(mem)) for src, size, etag, mem in rows}
+
+    def _store(self, rec: SourceRecord) -> None:
+        hdr = rec.pup.header
+        digests = {d.segment_index: d.digest for d in rec.pup.digest_table}
+        with self._db:
+            self._db.execute("DELETE FROM sources WHERE source = ?", (rec.source,))
+            source_id = self._db.execute(
+                "INSERT INTO sources (source, size, etag, has_members, "
+                "package_version, image_version, version, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    rec.source,
+                    rec.size,
+                    rec.etag,
+                    rec.has_members,
+                    hdr.package_version,
+                    hdr.image_version,
+                    rec.version,
+                    time.time(),
+                ),
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        source_id,
+                        idx,
+                        seg.id,
+                        get_seg_filename(seg.id),
+                        seg.offset,
+                        seg.size,
+                        int(seg.sign_algorithm),
+                        digests[idx],
+                    )
+                    for idx, seg in enumerate(rec.pup.segment_table)
+                ),
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?)",
+                ((source_id, *m) for m in rec.members),
+            )
+
+    def index(
+        self,
+        sources: Iterable[str],
+        jobs: Optional[int] = None,
+        members: bool = False,
+        wrap: Optional[Callable[[FancyRawIOBase, str], FancyRawIOBase]] = None,
+    ) -> List[IndexResult]:
+        sources = [
+            s if s.startswith(("http://", "https://")) else os.path.abspath(s)
+            for s in sources
+        ]
+        known = self._known()
+        results = []
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futs = {
+                pool.submit(scan_source, src, members, known.get(src), wrap=wrap): src
+                for src in sources
+            }
+            for fut in as_completed(futs):
+                src = futs[fut]
+                try:
+                    rec = fut.result()
+                except Exception as e:
+                    results.append(IndexResult(src, "failed", f"{e}"))
+                    continue
+                if rec is None:
+                    results.append(IndexResult(src, "unchanged"))
+                    continue
+                self._store(rec)
+                results.append(IndexResult(src, "indexed"))
+        return results
+
+    def find_digest(self, digest: bytes) -> List[Tuple[str, str]]:
+        """(source, segment name) of every segment with this digest."""
+        return self._db.execute(
+            "SELECT source, name FROM segments JOIN sources ON id = source_id "
+            "WHERE digest = ? ORDER BY source",
+            (digest,),
+        ).fetchall()
+
+    def find_member(self, path: str) -> List[Tuple[str, str, int]]:
+        """(source, segment name, size) of every tar member at path."""
+        return self._db.execute(
+            "SELECT source, name, members.size FROM members "
+            "JOIN sources ON id = members.source_id "
+            "JOIN segments ON segments.source_id = members.source_id "
+            "AND segments.segid = members.segid "
+            "WHERE path = ? ORDER BY source",
+            (path,),
+        ).fetchall()
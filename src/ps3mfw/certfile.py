@@ -1,13 +1,20 @@
 import enum
+import hashlib
 import io
-from typing import BinaryIO, Collection, Final, Mapping, Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Collection, Final, List, Mapping, Optional
 
 from attrs import define, field
 from construct import Mapping as ConstructMapping
 from construct import Optional as ConstructOptional
 from construct import *
 
-from .io_extras import FancyRawIOBase
+from .crypto import AESCTRRawIOBase, aes_cbc_decrypt
+from .faststruct import fast_struct
+from .inflate import InflateRawIOBase
+from .io_extras import Advice, FancyRawIOBase, OffsetRawIOBase, as_offset_fh
+from .keys import Key, KeyStore, load_keystore
 
 from typing import Mapping, Optional  # isort:skip
 
@@ -31,6 +38,9 @@ CertFileHeader = Struct(
     "file_size" / Int64ub,
 )
 
+# key revision marking files whose headers are stored unencrypted
+DEBUG_REVISION = 0x8000
+
 EncryptionRootHeader = Struct(
     "key" / Bytes(16),
     "key_pad" / Bytes(16),
@@ -57,6 +67,70 @@ CertificationHeader = Struct(
     "pad" / Padding(8),
 )
 
+
+class EncAlgorithmEnum(enum.IntEnum):
+    NONE = 1
+    AES128CTR = 3
+
+
+EncAlgorithm = Enum(Int32ub, EncAlgorithmEnum)
+
+
+class CompAlgorithmEnum(enum.IntEnum):
+    PLAIN = 1
+    ZLIB = 2
+
+
+CompAlgorithm = Enum(Int32ub, CompAlgorithmEnum)
+
+SegmentCertificationHeader = Struct(
+    "segment_offset" / Int64ub,
+    "segment_size" / Int64ub,
+    "segment_type" / Int32ub,
+    "segment_id" / Int32ub,
+    "sign_algorithm" / Int32ub,
+    "sign_idx" / Int32ub,
+    "enc_algorithm" / EncAlgorithm,
+    "key_idx" / Int32ub,
+    "iv_idx" / Int32ub,
+    "comp_algorithm" / CompAlgorithm,
+)
+
+
+class SelfTypeEnum(enum.IntEnum):
+    LV0 = 1
+    LV1 = 2
+    LV2 = 3
+    APP = 4
+    ISO = 5
+    LDR = 6
+    UNK7 = 7
+    NPDRM = 8
+
+
+SelfType = Enum(Int32ub, SelfTypeEnum)
+
+SelfExtHeader = Struct(
+    "header_type" / Int64ub,
+    "appinfo_offset" / Int64ub,
+    "elf_offset" / Int64ub,
+    "phdr_offset" / Int64ub,
+    "shdr_offset" / Int64ub,
+    "section_info_offset" / Int64ub,
+    "sceversion_offset" / Int64ub,
+    "controlinfo_offset" / Int64ub,
+    "controlinfo_size" / Int64ub,
+    "padding" / Padding(8),
+)
+
+AppInfo = Struct(
+    "auth_id" / Int64ub,
+    "vendor_id" / Int32ub,
+    "self_type" / SelfType,
+    "version" / Int64ub,
+    "padding" / Padding(8),
+)
+
 CertFile = Struct(
     "header" / CertFileHeader,
 )
@@ -64,9 +138,129 @@ CertFile = Struct(
 
 @define
 class CertifiedFile:
-    fh: Final[FancyRawIOBase] = field(converter=FancyRawIOBase)
+    """
+    SCE certified file (SELF, SPKG, ...) with its headers decrypted up front
+    and its segments decrypted lazily as they are read.
+    """
+
+    fh: Final[OffsetRawIOBase] = field(converter=as_offset_fh)
+    keystore: Final[Optional[KeyStore]] = None
+    cache_dir: Final[Optional[str]] = None
+    fast_parse: Final[bool] = True
     cf: Final[Struct] = field(init=False)
+    ext_header: Final[Optional[Struct]] = field(init=False, default=None)
+    app_info: Final[Optional[Struct]] = field(init=False, default=None)
+    root_header: Final[Struct] = field(init=False)
+    cert_header: Final[Struct] = field(init=False)
+    segments: Final[List[Struct]] = field(init=False)
+    attr_entries: Final[List[bytes]] = field(init=False)
+    _cache_key_hex: Optional[str] = field(init=False, default=None)
+
+    def _parse(self, con: Struct, buf: bytes, count: Optional[int] = None):
+        if not self.fast_parse:
+            return con.parse(buf) if count is None else Array(count, con).parse(buf)
+        if count is None:
+            return fast_struct(con).parse(buf)
+        return fast_struct(con).parse_array(buf, count)
 
     def __attrs_post_init__(self):
-        with self.fh.seek_ctx(0):
-            self.cf = CertFile.parse_stream(self.fh)
+        self.cf = Container(
+            header=self._parse(
+                CertFileHeader, self.fh.pread(0, CertFileHeader.sizeof())
+            )
+        )
+        hdr = self.cf.header
+        # everything parsed below lies before the first segment
+        self.fh.advise(0, hdr.file_offset, Advice.WILLNEED)
+        if hdr.category == CategoryEnum.SELF.name:
+            self.ext_header = self._parse(
+                SelfExtHeader,
+                self.fh.pread(CertFileHeader.sizeof(), SelfExtHeader.sizeof()),
+            )
+            self.app_info = self._parse(
+                AppInfo,
+                self.fh.pread(self.ext_header.appinfo_offset, AppInfo.sizeof()),
+            )
+
+        root_off = CertFileHeader.sizeof() + hdr.ext_header_size
+        root_sz = EncryptionRootHeader.sizeof()
+        raw_root = self.fh.pread(root_off, root_sz)
+        meta = self.fh.subfile(root_off + root_sz, hdr.file_offset - root_off - root_sz)
+        if hdr.attribute != DEBUG_REVISION:
+            key = self.key
+            raw_root = aes_cbc_decrypt(key.erk, key.riv, raw_root)
+        self.root_header = self._parse(EncryptionRootHeader, raw_root)
+        if hdr.attribute != DEBUG_REVISION:
+            meta = AESCTRRawIOBase(meta, self.root_header.key, self.root_header.iv)
+
+        self.cert_header = self._parse(
+            CertificationHeader, meta.pread(0, CertificationHeader.sizeof())
+        )
+        seg_off = CertificationHeader.sizeof()
+        seg_sz = SegmentCertificationHeader.sizeof() * self.cert_header.cert_entry_num
+        self.segments = self._parse(
+            SegmentCertificationHeader,
+            meta.pread(seg_off, seg_sz),
+            self.cert_header.cert_entry_num,
+        )
+        attrs_raw = meta.pread(seg_off + seg_sz, 16 * self.cert_header.attr_entry_num)
+        self.attr_entries = [
+            attrs_raw[i : i + 16] for i in range(0, len(attrs_raw), 16)
+        ]
+
+    @property
+    def key(self) -> Key:
+        keystore = self.keystore if self.keystore is not None else load_keystore()
+        self_type = None
+        if self.app_info is not None:
+            self_type = str(self.app_info.self_type)
+        hdr = self.cf.header
+        return keystore.get(str(hdr.category), hdr.attribute, self_type)
+
+    def segment(self, idx: int, decompress: bool = True) -> FancyRawIOBase:
+        """
+        Seekable view of segment idx, decrypted on read if it is encrypted and
+        inflated on read if it is compressed and decompress is set. With a
+        cache_dir, the inflate index of compressed segments is kept there.
+        """
+        seg = self.segments[idx]
+        fh = self.fh.subfile(seg.segment_offset, seg.segment_size)
+        if seg.enc_algorithm == EncAlgorithmEnum.AES128CTR.name:
+            fh = AESCTRRawIOBase(
+                fh, self.attr_entries[seg.key_idx], self.attr_entries[seg.iv_idx]
+            )
+        if decompress and seg.comp_algorithm == CompAlgorithmEnum.ZLIB.name:
+            index_path = None
+            if self.cache_dir is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                index_path = os.path.join(
+                    self.cache_dir, f"{self._cache_key}-{idx}.zidx"
+                )
+            fh = InflateRawIOBase(fh, index_path=index_path)
+        return fh
+
+    @property
+    def _cache_key(self) -> str:
+        # the headers hold the per-file segment keys, so they identify the file
+        if self._cache_key_hex is None:
+            hdr = self.fh.pread(0, self.cf.header.file_offset)
+            self._cache_key_hex = hashlib.sha1(hdr).hexdigest()
+        return self._cache_key_hex
+
+    def extract(self, out_dir: str, jobs: Optional[int] = None) -> List[str]:
+        """
+        Write every decrypted and inflated segment to out_dir/segment-N.bin.
+        Segments are independent, so they are processed in parallel.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+
+        def extract_one(idx: int) -> str:
+            path = os.path.join(out_dir, f"segment-{idx}.bin")
+            seg = self.segment(idx)
+            with open(path, "wb") as f:
+                seg.copy_to(f)
+            seg.close()
+            return path
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(extract_one, range(len(self.segments))))
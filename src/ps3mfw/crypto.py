@@ -0,0 +1,72 @@
+from typing import Final
+
+from attrs import define, field
+from Crypto.Cipher import AES
+
+from .io_extras import Advice, OffsetRawIOBase, PReadRawIOBase, as_offset_fh
+from .util import round_down, round_up
+
+AES_BLKSZ = 16
+
+
+def aes_cbc_decrypt(key: bytes, iv: bytes, buf: bytes) -> bytes:
+    return AES.new(key, AES.MODE_CBC, iv).decrypt(buf)
+
+
+@define
+class AESCTRRawIOBase(PReadRawIOBase):
+    """
+    Decrypting view of an AES-CTR encrypted range.
+
+    CTR blocks are independent, so a read at any offset only fetches and
+    decrypts the 16-byte blocks it overlaps, chunk_sz bytes at a time, with
+    the counter advanced to the first of them.
+    """
+
+    fh: Final[OffsetRawIOBase] = field(converter=as_offset_fh)
+    key: Final[bytes]
+    iv: Final[bytes]
+    chunk_sz: Final[int] = 1024 * 1024
+    _ctr: Final[int] = field(init=False)
+    _idx: int = field(init=False, default=0)
+
+    def __attrs_post_init__(self) -> None:
+        if len(self.iv) != AES_BLKSZ:
+            raise ValueError("AES-CTR IV must be 16 bytes")
+        self._ctr = int.from_bytes(self.iv, "big")
+
+    @property
+    def sz(self) -> int:
+        return self.fh.sz
+
+    def advise(self, offset: int, length: int, hint: Advice = Advice.WILLNEED) -> None:
+        # plaintext and ciphertext offsets match, only whole blocks are read
+        start = round_down(offset, AES_BLKSZ)
+        self.fh.advise(start, round_up(offset + length, AES_BLKSZ) - start, hint)
+
+    def _cipher(self, blk: int):
+        return AES.new(
+            self.key,
+            AES.MODE_CTR,
+            nonce=b"",
+            initial_value=(self._ctr + blk) % (1 << 128),
+        )
+
+    def preadinto(self, offset: int, b) -> int:
+        with memoryview(b) as mv, mv.cast("B") as out:
+            size = max(0, min(len(out), self.sz - offset))
+            start = round_down(offset, AES_BLKSZ)
+            end = min(round_up(offset + size, AES_BLKSZ), self.sz)
+            cipher = self._cipher(start // AES_BLKSZ)
+            buf = memoryview(bytearray(min(self.chunk_sz, end - start)))
+            pos = start
+            while pos < end:
+                chunk = buf[: min(len(buf), end - pos)]
+                n = self.fh.preadinto(pos, chunk)
+                if n != len(chunk):
+                    raise EOFError(f"short read of ciphertext at {pos:#x}")
+                cipher.decrypt(chunk, output=chunk)
+                lo, hi = max(pos, offset), min(pos + n, offset + size)
+                out[lo - offset : hi - offset] = chunk[lo - pos : hi - pos]
+                pos += n
+            return size
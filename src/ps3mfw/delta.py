@@ -0,0 +1,291 @@
+import hashlib
+import os
+from typing import Dict, Final, List, Optional, Tuple
+
+from attrs import define, field
+from construct import (
+    Bytes,
+    Const,
+    Enum,
+    If,
+    Int8ub,
+    Int32ub,
+    Int64ub,
+    PrefixedArray,
+    Struct,
+    this,
+)
+
+from .io_extras import (
+    FancyRawIOBase,
+    FancyRawIOBaseProxy,
+    OffsetRawIOBase,
+    copy_file_range,
+)
+from .pup import PUPFile, parse_pup
+from .tar import TarMember, scan_tar
+
+TAR_MAGIC_OFF = 257
+
+DeltaOpKind = Enum(Int8ub, copy=0, data=1)
+
+PUPDelta = Struct(
+    "magic" / Const(b"PUPD"),
+    "old_sz" / Int64ub,
+    "new_sz" / Int64ub,
+    "old_digest" / Bytes(32),
+    "ops"
+    / PrefixedArray(
+        Int32ub,
+        Struct(
+            "kind" / DeltaOpKind,
+            "new_off" / Int64ub,
+            "size" / Int64ub,
+            "old_off" / If(this.kind == "copy", Int64ub),
+            "data" / If(this.kind == "data", Bytes(this.size)),
+        ),
+    ),
+)
+
+
+@define
+class DeltaOp:
+    """size bytes at new_off, copied from old_off in the old PUP or given."""
+
+    new_off: int
+    size: int
+    old_off: Optional[int] = None
+    data: Optional[bytes] = None
+
+
+@define
+class Delta:
+    old_sz: int
+    new_sz: int
+    # SHA-256 of the old PUP's header and tables, see pup_digest()
+    old_digest: bytes
+    ops: List[DeltaOp] = field(factory=list)
+
+    @property
+    def copied(self) -> int:
+        return sum(op.size for op in self.ops if op.data is None)
+
+    @property
+    def literal(self) -> int:
+        return sum(op.size for op in self.ops if op.data is not None)
+
+    def build(self) -> bytes:
+        return PUPDelta.build(
+            dict(
+                old_sz=self.old_sz,
+                new_sz=self.new_sz,
+                old_digest=self.old_digest,
+                ops=[
+                    dict(
+                        kind="copy" if op.data is None else "data",
+                        new_off=op.new_off,
+                        size=op.size,
+                        old_off=op.old_off,
+                        data=op.data,
+                    )
+                    for op in self.ops
+                ],
+            )
+        )
+
+    @classmethod
+    def parse(cls, buf: bytes) -> "Delta":
+        con = PUPDelta.parse(buf)
+        return cls(
+            old_sz=con.old_sz,
+            new_sz=con.new_sz,
+            old_digest=con.old_digest,
+            ops=[
+                DeltaOp(
+                    new_off=op.new_off, size=op.size, old_off=op.old_off, data=op.data
+                )
+                for op in con.ops
+            ],
+        )
+
+
+@define
+class _DeltaBuilder:
+    """Emits ops in new file order, reading literal data from new as needed."""
+
+    old: Final[FancyRawIOBase]
+    new: Final[FancyRawIOBase]
+    blksz: Final[int]
+    delta: Final[Delta]
+
+    def copy(self, new_off: int, old_off: int, size: int) -> None:
+        if not size:
+            return
+        ops = self.delta.ops
+        if ops and ops[-1].data is None:
+            last = ops[-1]
+            if (
+                last.new_off + last.size == new_off
+                and last.old_off + last.size == old_off
+            ):
+                last.size += size
+                return
+        ops.append(DeltaOp(new_off=new_off, size=size, old_off=old_off))
+
+    def literal(self, new_off: int, size: int, data: Optional[bytes] = None) -> None:
+        if not size:
+            return
+        if data is None:
+            data = self.new.pread(new_off, size)
+        ops = self.delta.ops
+        if (
+            ops
+            and ops[-1].data is not None
+            and ops[-1].new_off + ops[-1].size == new_off
+        ):
+            ops[-1].data += data
+            ops[-1].size += size
+            return
+        ops.append(DeltaOp(new_off=new_off, size=size, data=bytearray(data)))
+
+    def blocks(self, new_off: int, old_off: int, size: int, old_size: int) -> None:
+        """
+        Diff a changed range against the range that held it in the old file,
+        block by block at the same relative offsets, so unchanged blocks of a
+        partially changed file are copied rather than carried in the delta.
+        """
+        done = 0
+        while done < size:
+            n = min(self.blksz, size - done)
+            data = self.new.pread(new_off + done, n)
+            if done + n <= old_size and self.old.pread(old_off + done, n) == data:
+                self.copy(new_off + done, old_off + done, n)
+            else:
+                self.literal(new_off + done, n, data)
+            done += n
+
+
+def _is_tar(fh: FancyRawIOBase, off: int, size: int) -> bool:
+    return size > TAR_MAGIC_OFF + 5 and fh.pread(off + TAR_MAGIC_OFF, 5) == b"ustar"
+
+
+def _member_key(m: TarMember) -> Tuple[str, int, int, int]:
+    return m.path, m.size, m.mtime, m.mode
+
+
+def _diff_tar(
+    b: _DeltaBuilder, new_off: int, new_sz: int, old_off: int, old_sz: int
+) -> None:
+    old_members: Dict[str, TarMember] = {}
+    for m in scan_tar(OffsetRawIOBase(b.old, off=old_off, sz=old_sz)):
+        if m.size:
+            old_members.setdefault(m.path, m)
+    # hard links share their target's data, so visit each data range once
+    new_members = {}
+    for m in scan_tar(OffsetRawIOBase(b.new, off=new_off, sz=new_sz)):
+        if m.size:
+            new_members.setdefault(m.off, m)
+    cur = 0
+    for off in sorted(new_members):
+        m = new_members[off]
+        # the tar headers in between have already been fetched by scan_tar
+        b.literal(new_off + cur, m.off - cur)
+        old = old_members.get(m.path)
+        if old is not None and _member_key(old) == _member_key(m):
+            b.copy(new_off + m.off, old_off + old.off, m.size)
+        elif old is not None:
+            b.blocks(new_off + m.off, old_off + old.off, m.size, old.size)
+        else:
+            b.literal(new_off + m.off, m.size)
+        cur = m.off + m.size
+    b.literal(new_off + cur, new_sz - cur)
+
+
+def pup_digest(fh: FancyRawIOBase, header_length: Optional[int] = None) -> bytes:
+    """
+    SHA-256 of the header and tables of the PUP in fh. The tables hold every
+    segment's digest, so this identifies the whole PUP without reading it.
+    """
+    if header_length is None:
+        header_length = parse_pup(fh).header.header_length
+    return hashlib.sha256(fh.pread(0, header_length)).digest()
+
+
+def diff_pups(old: PUPFile, new: PUPFile, blksz: int = 64 * 1024) -> Delta:
+    """
+    Build a delta that rebuilds new from old.
+
+    Segments whose digest entries match an old segment are copied without
+    reading them. Differing tar segments are compared member by member
+    using their headers, and only members whose path, size, mtime or mode
+    changed are read from new. Other differing segments are compared block
+    by block with the old segment of the same id. When new is an HTTPFile,
+    only its header blocks and the changed ranges are downloaded.
+    """
+    old_digests = {d.segment_index: d.digest for d in old.pup.digest_table}
+    new_digests = {d.segment_index: d.digest for d in new.pup.digest_table}
+    by_digest = {}
+    by_id = {}
+    for idx, seg in enumerate(old.pup.segment_table):
+        by_digest.setdefault((old_digests[idx], seg.size), seg)
+        by_id.setdefault(seg.id, seg)
+    delta = Delta(
+        old_sz=old.fh.sz,
+        new_sz=new.fh.sz,
+        old_digest=pup_digest(old.fh, old.pup.header.header_length),
+    )
+    b = _DeltaBuilder(old.fh, new.fh, blksz, delta)
+    cur = 0
+    new_segs = sorted(enumerate(new.pup.segment_table), key=lambda item: item[1].offset)
+    for idx, seg in new_segs:
+        # the PUP header, tables and any padding come from new
+        b.literal(cur, seg.offset - cur)
+        same = by_digest.get((new_digests[idx], seg.size))
+        prev = by_id.get(seg.id)
+        if same is not None:
+            b.copy(seg.offset, same.offset, seg.size)
+        elif prev is None:
+            b.literal(seg.offset, seg.size)
+        elif _is_tar(new.fh, seg.offset, seg.size) and _is_tar(
+            old.fh, prev.offset, prev.size
+        ):
+            _diff_tar(b, seg.offset, seg.size, prev.offset, prev.size)
+        else:
+            b.blocks(seg.offset, prev.offset, seg.size, prev.size)
+        cur = seg.offset + seg.size
+    b.literal(cur, delta.new_sz - cur)
+    return delta
+
+
+def apply_delta(
+    old: FancyRawIOBase, delta: Delta, out_path: str, hmac_key: bytes
+) -> None:
+    """
+    Write the new PUP described by delta to out_path. The rebuilt PUP is
+    verified with hmac_key before it replaces out_path.
+    """
+    if old.sz != delta.old_sz or pup_digest(old) != delta.old_digest:
+        raise ValueError("delta is for a different old PUP")
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, delta.new_sz)
+            for op in delta.ops:
+                if op.data is None:
+                    copy_file_range(old, op.old_off, fd, op.new_off, op.size)
+                else:
+                    os.pwrite(fd, op.data, op.new_off)
+        finally:
+            os.close(fd)
+        new_fh = FancyRawIOBaseProxy(tmp_path)
+        try:
+            bad = [r.name for r in PUPFile(new_fh).verify(hmac_key) if not r.ok]
+        finally:
+            new_fh.close()
+        if bad:
+            raise ValueError(f"rebuilt PUP fails verification: {', '.join(bad)}")
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
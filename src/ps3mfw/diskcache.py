@@ -0,0 +1,157 @@
+import fcntl
+import hashlib
+import mmap
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Final, Iterator, Optional, Tuple
+
+from attrs import define, field
+
+from .util import round_up
+
+
+def _hexdigest(*parts: object) -> str:
+    return hashlib.sha256("\0".join(map(str, parts)).encode()).hexdigest()[:16]
+
+
+def _entry_usage(bin_path: Path) -> int:
+    try:
+        return bin_path.stat().st_blocks * 512
+    except FileNotFoundError:
+        return 0
+
+
+def _remove_entry(cache_dir: Path, name: str) -> bool:
+    """Delete an entry unless another process currently has it open."""
+    lock_path = cache_dir / f"{name}.lock"
+    try:
+        lock_fd = os.open(lock_path, os.O_RDWR)
+    except FileNotFoundError:
+        return True
+    try:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        for suffix in (".bin", ".blkmap", ".lock"):
+            try:
+                (cache_dir / f"{name}{suffix}").unlink()
+            except FileNotFoundError:
+                pass
+        return True
+    finally:
+        os.close(lock_fd)
+
+
+def evict(cache_dir: str, max_sz: int, keep: Optional[str] = None) -> None:
+    """Remove least recently used entries until the cache fits in max_sz bytes."""
+    cache_dir = Path(cache_dir)
+    entries = []
+    for bin_path in cache_dir.glob("*.bin"):
+        try:
+            entries.append((bin_path.stat().st_mtime, bin_path.stem, bin_path))
+        except FileNotFoundError:
+            continue
+    total = sum(_entry_usage(p) for _, _, p in entries)
+    for _, name, bin_path in sorted(entries):
+        if total <= max_sz:
+            break
+        if name == keep:
+            continue
+        usage = _entry_usage(bin_path)
+        if _remove_entry(cache_dir, name):
+            total -= usage
+
+
+@define
+class DiskCache:
+    """
+    Persistent block cache for one remote file.
+
+    The data lives in a sparse file of the full remote size and the block
+    bitmap in a file of uint64 words, both mapped shared so that several
+    processes can fill the same entry. Entries are keyed by URL and the
+    server's validators; an entry for the same URL with stale validators is
+    dropped when a new one is opened.
+    """
+
+    cache_dir: Final[str]
+    url: Final[str]
+    sz: Final[int]
+    blksz: Final[int]
+    validators: Final[Tuple[str, ...]] = ()
+    max_sz: Final[Optional[int]] = None
+    name: Final[str] = field(init=False)
+    data: Final[mmap.mmap] = field(init=False)
+    blkmap: Final[memoryview] = field(init=False)
+    _blkmap_mm: Final[mmap.mmap] = field(init=False)
+    _lock_fd: int = field(init=False, default=-1)
+    _blkmap_fd: int = field(init=False, default=-1)
+
+    def __attrs_post_init__(self) -> None:
+        cache_dir = Path(self.cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        url_key = _hexdigest(self.url)
+        self.name = f"{url_key}-{_hexdigest(self.sz, self.blksz, *self.validators)}"
+        self._lock_fd = self._open_lock(cache_dir / f"{self.name}.lock")
+        for stale in cache_dir.glob(f"{url_key}-*.bin"):
+            if stale.stem != self.name:
+                _remove_entry(cache_dir, stale.stem)
+
+        bin_path = cache_dir / f"{self.name}.bin"
+        data_fd = os.open(bin_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(data_fd).st_size != self.sz:
+                os.ftruncate(data_fd, self.sz)
+            self.data = mmap.mmap(data_fd, self.sz)
+        finally:
+            os.close(data_fd)
+        os.utime(bin_path)
+
+        blkmap_sz = round_up(round_up(self.sz, self.blksz) // self.blksz, 64) // 8
+        self._blkmap_fd = os.open(
+            cache_dir / f"{self.name}.blkmap", os.O_RDWR | os.O_CREAT, 0o644
+        )
+        if os.fstat(self._blkmap_fd).st_size != blkmap_sz:
+            os.ftruncate(self._blkmap_fd, blkmap_sz)
+        self._blkmap_mm = mmap.mmap(self._blkmap_fd, blkmap_sz)
+        self.blkmap = memoryview(self._blkmap_mm).cast("Q")
+
+        if self.max_sz is not None:
+            evict(self.cache_dir, self.max_sz, keep=self.name)
+
+    @staticmethod
+    def _open_lock(lock_path: Path) -> int:
+        # hold a shared lock for our lifetime so evictors leave the entry alone,
+        # retrying if an evictor unlinked the lock file while we waited on it
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Exclusive lock for read-modify-write updates of the bitmap."""
+        fcntl.flock(self._blkmap_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._blkmap_fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        if self._lock_fd < 0:
+            return
+        if self.max_sz is not None:
+            evict(self.cache_dir, self.max_sz, keep=self.name)
+        self.blkmap.release()
+        self._blkmap_mm.close()
+        self.data.close()
+        os.close(self._blkmap_fd)
+        os.close(self._lock_fd)
+        self._blkmap_fd = self._lock_fd = -1
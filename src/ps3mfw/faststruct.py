@@ -0,0 +1,122 @@
+import functools
+import itertools
+import struct
+from typing import Callable, Final, List, Optional, Tuple
+
+from attrs import define, field
+from construct import (
+    Adapter,
+    Bytes,
+    Const,
+    ConstError,
+    Container,
+    FormatField,
+    Hex,
+    ListContainer,
+    Padded,
+    Pass,
+    Renamed,
+    StreamError,
+    Struct,
+)
+
+
+def _compile_field(
+    sc,
+) -> Tuple[str, Optional[bytes], List[Callable]]:
+    """Return the struct format, expected constant and decoders of a field."""
+    decoders = []
+    while True:
+        if isinstance(sc, Hex):
+            # only changes how the value is printed, it compares equal
+            sc = sc.subcon
+        elif isinstance(sc, Adapter):
+            decoders.insert(0, sc._decode)
+            sc = sc.subcon
+        elif isinstance(sc, FormatField):
+            return sc.fmtstr[1:], None, decoders
+        elif isinstance(sc, Bytes) and isinstance(sc.length, int):
+            return f"{sc.length}s", None, decoders
+        elif isinstance(sc, Padded) and sc.subcon is Pass:
+            return f"{sc.length}x", None, decoders
+        elif isinstance(sc, Const):
+            fmt, _, _ = _compile_field(sc.subcon)
+            return fmt, sc.value, decoders
+        else:
+            raise TypeError(f"{sc} has no fixed struct layout")
+
+
+@define
+class FastStruct:
+    """
+    Decoder for a flat construct Struct of fixed-size fields built on one
+    precomputed struct.Struct and a generated constructor function, like
+    construct's compiler but without its per-field stream reads. Parses to
+    a Container equal to the construct Struct's. Hex fields are left as
+    plain ints.
+    """
+
+    con: Final[Struct]
+    _st: Final[struct.Struct] = field(init=False)
+    _make: Final[Callable[..., Container]] = field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        fmt, args, body, kwargs = ">", [], [], []
+        ns = {"Container": Container, "ConstError": ConstError}
+        for i, sc in enumerate(self.con.subcons):
+            name = sc.name
+            if isinstance(sc, Renamed):
+                sc = sc.subcon
+            sc_fmt, const, decoders = _compile_field(sc)
+            fmt += sc_fmt
+            if sc_fmt.endswith("x"):
+                kwargs.append(f"{name}=None")
+                continue
+            val = f"v{i}"
+            args.append(val)
+            if const is not None:
+                ns[f"const{i}"] = const
+                body.append(
+                    f"    if {val} != const{i}:\n"
+                    f"        raise ConstError("
+                    f"f'parsing expected {{const{i}!r}} but parsed {{{val}!r}}')"
+                )
+            for j, dec in enumerate(decoders):
+                ns[f"dec{i}_{j}"] = dec
+                val = f"dec{i}_{j}({val}, None, None)"
+            kwargs.append(f"{name}={val}")
+        src = "\n".join(
+            [
+                f"def make({', '.join(args)}):",
+                *body,
+                f"    return Container({', '.join(kwargs)})",
+            ]
+        )
+        exec(src, ns)
+        self._st = struct.Struct(fmt)
+        self._make = ns["make"]
+
+    @property
+    def size(self) -> int:
+        return self._st.size
+
+    def parse(self, buf, offset: int = 0) -> Container:
+        try:
+            vals = self._st.unpack_from(buf, offset)
+        except struct.error as e:
+            raise StreamError(str(e)) from e
+        return self._make(*vals)
+
+    def parse_array(self, buf, count: int, offset: int = 0) -> ListContainer:
+        end = offset + count * self._st.size
+        with memoryview(buf)[offset:end] as mv:
+            if len(mv) != end - offset:
+                raise StreamError(f"expected {end - offset} bytes, got {len(mv)}")
+            return ListContainer(
+                itertools.starmap(self._make, self._st.iter_unpack(mv))
+            )
+
+
+@functools.lru_cache(maxsize=None)
+def fast_struct(con: Struct) -> FastStruct:
+    return FastStruct(con)
@@ -1,37 +1,44 @@
 from __future__ import annotations
 
 import enum
-from typing import Final, List, Optional
+from typing import Dict, Final, Iterator, List, Optional, Tuple
 
-from anytree import NodeMixin, RenderTree
-from anytree.resolver import ChildResolverError, Resolver, ResolverError
 from fs.enums import ResourceType
 from rich import print as rprint
 from typing_extensions import Self
 
 
-class InoVendor:
-    _ino: int = 0
-
-    @classmethod
-    def next(cls) -> int:
-        your_ino, cls._ino = cls._ino, cls._ino + 1
-        return your_ino
-
-
 class DirEntType(enum.Enum):
     DIR = 0
     REG = 1
     LNK = 2
 
 
-class INode(NodeMixin):
+class INode:
+    """
+    Compact filesystem tree node. Directories index their children by name
+    and inode numbers are handed out per tree by its root.
+    """
+
+    __slots__ = (
+        "name",
+        "type",
+        "size",
+        "size_comp",
+        "off",
+        "parent",
+        "ino",
+        "_children",
+    )
+
     name: str
     type: Final[DirEntType]
     size: int
     size_comp: Optional[int]
     off: Optional[int]
-    _ino: Final[int]
+    parent: Optional[INode]
+    ino: Final[int]
+    _children: Optional[Dict[str, INode]]
 
     def __init__(
         self,
@@ -43,16 +50,24 @@ class INode(NodeMixin):
         parent: Self = None,
         children: Optional[List[Self]] = None,
     ):
-        super().__init__()
         self.name = name
         self.type = type
         self.size = size
         self.size_comp = size_comp
         self.off = off
         self.parent = parent
-        if type == DirEntType.DIR:
-            self.children = children if children else []
-        self._ino = InoVendor.next()
+        self._children = {} if type == DirEntType.DIR else None
+        if parent is None:
+            self.ino = self._alloc_ino()
+        else:
+            parent._children[name] = self
+            self.ino = parent.root._alloc_ino()
+        for child in children or []:
+            child.parent = self
+            self._children[child.name] = child
+
+    def _alloc_ino(self) -> int:
+        return 0
 
     @property
     def is_dir(self) -> bool:
@@ -66,24 +81,55 @@ class INode(NodeMixin):
             DirEntType.LNK: ResourceType.symlink,
         }[self.type]
 
+    @property
+    def children(self) -> List[INode]:
+        if self._children is None:
+            return []
+        return list(self._children.values())
+
+    @property
+    def root(self) -> INode:
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
+
     @classmethod
     def root_node(cls):
-        return cls(parent=None, name="rootfs", type=DirEntType.DIR)
+        return RootINode(parent=None, name="rootfs", type=DirEntType.DIR)
+
+    def walk(self, depth: int = 0) -> Iterator[Tuple[int, INode]]:
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
 
     def dump(self):
-        for pre, fill, node in RenderTree(self):
-            rprint("[yellow]{}[/]{}".format(pre, node.name))
-
-    @staticmethod
-    def _norm_path(path: str):
-        if path[0] == "/":
-            return "/rootfs" + path
-        return path
-
-    def lookup(self, path: str) -> INode:
-        r = Resolver("name")
-        try:
-            res = r.get(self, self._norm_path(path))
-        except (ResolverError, ChildResolverError):
-            res = None
-        return res
+        for depth, node in self.walk():
+            rprint("[yellow]{}[/]{}".format("    " * depth, node.name))
+
+    def lookup(self, path: str) -> Optional[INode]:
+        node = self.root if path.startswith("/") else self
+        for part in path.split("/"):
+            if not part or part == ".":
+                continue
+            if part == "..":
+                node = node.parent if node.parent is not None else node
+                continue
+            if node._children is None:
+                return None
+            node = node._children.get(part)
+            if node is None:
+                return None
+        return node
+
+
+class RootINode(INode):
+    __slots__ = ("_next_ino",)
+
+    def __init__(self, *args, **kwargs):
+        self._next_ino = 0
+        super().__init__(*args, **kwargs)
+
+    def _alloc_ino(self) -> int:
+        ino, self._next_ino = self._next_ino, self._next_ino + 1
+        return ino
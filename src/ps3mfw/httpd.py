@@ -0,0 +1,316 @@
+import email.utils
+import os
+import posixpath
+import selectors
+import socket
+import threading
+import uuid
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from attrs import define
+from fs.base import FS
+
+from .io_extras import FancyRawIOBase, FancyRawIOBaseProxy, resolve_fd
+from .pup import open_container
+
+
+@define
+class Resource:
+    fh: FancyRawIOBase
+    size: int
+    mtime: float
+    etag: str
+    ctype: str
+    # container handle that fh reads through, closed along with it
+    container: Optional[FS] = None
+
+
+def parse_ranges(spec: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a Range header into inclusive (start, end) pairs clamped to size.
+    Returns None for a malformed or non-bytes header, which is ignored, and
+    an empty list when no range is satisfiable.
+    """
+    unit, _, sets = spec.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for rng in sets.split(","):
+        start, sep, end = rng.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if not start:
+                if not end:
+                    return None
+                n = int(end)
+                if n > 0:
+                    ranges.append((max(0, size - n), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end else None
+        except ValueError:
+            return None
+        if end is not None and end < start:
+            return None
+        if start < size:
+            ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    return ranges
+
+
+class FastRangeHTTPRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Range server for use as a firmware mirror.
+
+    Connections are kept alive (HTTP/1.1), bodies are sent with sendfile,
+    multiple ranges are answered with multipart/byteranges, and ETag and
+    Last-Modified validators are sent and honoured through If-Range and
+    If-None-Match. Below a PUP file, paths name its segments and the members
+    of containers nested in them, e.g. /fw.pup/update_files.tar/CORE_OS.pkg,
+    served from the PUP file without extracting them.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # idle kept-alive connections are closed after this many seconds
+    timeout = 60
+    quiet: bool = True
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _local_resource(self, path: str) -> Optional[Resource]:
+        st = os.stat(path)
+        return Resource(
+            fh=FancyRawIOBaseProxy(path),
+            size=st.st_size,
+            mtime=st.st_mtime,
+            etag=f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"',
+            ctype=self.guess_type(path),
+        )
+
+    def _container_resource(self, path: str, rest: List[str]) -> Optional[Resource]:
+        st = os.stat(path)
+        layers: Tuple[str, ...] = ()
+        while rest:
+            try:
+                fs = open_container(path, layers)
+            except Exception:
+                return None
+            try:
+                for i in range(len(rest), 0, -1):
+                    member = "/".join(rest[:i])
+                    if fs.exists(member) and fs.isfile(member):
+                        break
+                else:
+                    return None
+                if i == len(rest):
+                    fh = fs.openbin(member)
+                    _, off = resolve_fd(fh, 0)
+                    res = Resource(
+                        fh=fh,
+                        size=fh.sz,
+                        mtime=st.st_mtime,
+                        etag=f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{off:x}-{fh.sz:x}"',
+                        ctype=self.guess_type(member),
+                        container=fs,
+                    )
+                    fs = None
+                    return res
+            finally:
+                if fs is not None:
+                    fs.close()
+            layers += (member,)
+            rest = rest[i:]
+        return None
+
+    def _resource(self) -> Optional[Resource]:
+        url_path = unquote(urlsplit(self.path).path)
+        parts = [p for p in posixpath.normpath(url_path).split("/") if p]
+        if ".." in parts:
+            return None
+        path = self.directory
+        for i, part in enumerate(parts):
+            path = os.path.join(path, part)
+            if os.path.isfile(path):
+                if i == len(parts) - 1:
+                    return self._local_resource(path)
+                return self._container_resource(os.path.abspath(path), parts[i + 1 :])
+            if not os.path.isdir(path):
+                return None
+        return None
+
+    def _serve(self, send_body: bool) -> None:
+        url_path = urlsplit(self.path).path
+        if os.path.isdir(self.translate_path(url_path)):
+            # directory listings and index.html are left to the base class
+            f = self.send_head()
+            if f:
+                try:
+                    if send_body:
+                        self.copyfile(f, self.wfile)
+                finally:
+                    f.close()
+            return
+        res = self._resource()
+        if res is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+        try:
+            self._send_resource(res, send_body)
+        finally:
+            res.fh.close()
+            if res.container is not None:
+                res.container.close()
+
+    def _validators_match(self, value: str, res: Resource) -> bool:
+        if value.startswith(('"', "W/")):
+            return value == res.etag
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return False
+        return int(date.timestamp()) == int(res.mtime)
+
+    def _send_resource(self, res: Resource, send_body: bool) -> None:
+        inm = self.headers.get("If-None-Match")
+        if inm is not None and res.etag in (v.strip() for v in inm.split(",")):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._send_validators(res)
+            self.end_headers()
+            return
+
+        ranges = None
+        if "Range" in self.headers:
+            if_range = self.headers.get("If-Range")
+            if if_range is None or self._validators_match(if_range, res):
+                ranges = parse_ranges(self.headers["Range"], res.size)
+        if ranges == []:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{res.size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if not ranges:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", res.ctype)
+            self.send_header("Content-Length", str(res.size))
+            self._send_validators(res)
+            self.end_headers()
+            if send_body:
+                self._send_body(res.fh, 0, res.size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Type", res.ctype)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{res.size}")
+            self.send_header("Content-Length", str(end - start + 1))
+            self._send_validators(res)
+            self.end_headers()
+            if send_body:
+                self._send_body(res.fh, start, end - start + 1)
+        else:
+            boundary = uuid.uuid4().hex
+            parts = [
+                (
+                    (
+                        f"\r\n--{boundary}\r\n"
+                        f"Content-Type: {res.ctype}\r\n"
+                        f"Content-Range: bytes {start}-{end}/{res.size}\r\n\r\n"
+                    ).encode(),
+                    start,
+                    end - start + 1,
+                )
+                for start, end in ranges
+            ]
+            trailer = f"\r\n--{boundary}--\r\n".encode()
+            length = sum(len(hdr) + n for hdr, _, n in parts) + len(trailer)
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header(
+                "Content-Type", f"multipart/byteranges; boundary={boundary}"
+            )
+            self.send_header("Content-Length", str(length))
+            self._send_validators(res)
+            self.end_headers()
+            if send_body:
+                for hdr, start, n in parts:
+                    self.wfile.write(hdr)
+                    self._send_body(res.fh, start, n)
+                self.wfile.write(trailer)
+
+    def _send_validators(self, res: Resource) -> None:
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", res.etag)
+        self.send_header("Last-Modified", self.date_time_string(res.mtime))
+
+    def _send_body(self, fh: FancyRawIOBase, offset: int, size: int) -> None:
+        fd, fd_off = resolve_fd(fh, offset)
+        if fd is not None:
+            sock = self.connection
+            # the handler timeout makes the socket non-blocking, so sendfile
+            # fails with EAGAIN whenever the client is behind on reading
+            with selectors.DefaultSelector() as sel:
+                sel.register(sock, selectors.EVENT_WRITE)
+                while size:
+                    try:
+                        n = os.sendfile(sock.fileno(), fd, fd_off, size)
+                    except BlockingIOError:
+                        if not sel.select(sock.gettimeout()):
+                            raise TimeoutError("client stopped reading")
+                        continue
+                    if not n:
+                        raise EOFError(f"short sendfile at {fd_off:#x}")
+                    fd_off += n
+                    size -= n
+        else:
+            fh.copy_to(self.wfile, offset, size)
+
+    def log_request(self, code="-", size="-") -> None:
+        if self.quiet:
+            return
+        if "Range" in self.headers:
+            size = f"{size} Range: {self.headers['Range']}"
+        super().log_request(code, size)
+
+    def log_message(self, format: str, *args) -> None:
+        if self.quiet:
+            return
+        super().log_message(format, *args)
+
+
+class FastRangeHTTPServer(ThreadingHTTPServer):
+    """Threading server that also drops kept-alive connections when closed."""
+
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        self._conns = set()
+        self._conns_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def get_request(self):
+        conn, addr = super().get_request()
+        with self._conns_lock:
+            self._conns.add(conn)
+        return conn, addr
+
+    def shutdown_request(self, request):
+        with self._conns_lock:
+            self._conns.discard(request)
+        super().shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        with self._conns_lock:
+            conns, self._conns = self._conns, set()
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
@@ -0,0 +1,314 @@
+import bisect
+import ctypes
+import ctypes.util
+import functools
+import hashlib
+import os
+import threading
+import zlib
+from typing import Final, List, Optional
+
+from attrs import define, field
+from construct import (
+    Bytes,
+    Const,
+    ConstructError,
+    GreedyBytes,
+    Int8ub,
+    Int32ub,
+    Int64ub,
+    Prefixed,
+    PrefixedArray,
+    Struct,
+)
+
+from .io_extras import OffsetRawIOBase, PReadRawIOBase, as_offset_fh
+
+WINSZ = 32 * 1024
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BUF_ERROR = -5
+Z_BLOCK = 5
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ("next_in", ctypes.c_void_p),
+        ("avail_in", ctypes.c_uint),
+        ("total_in", ctypes.c_ulong),
+        ("next_out", ctypes.c_void_p),
+        ("avail_out", ctypes.c_uint),
+        ("total_out", ctypes.c_ulong),
+        ("msg", ctypes.c_char_p),
+        ("state", ctypes.c_void_p),
+        ("zalloc", ctypes.c_void_p),
+        ("zfree", ctypes.c_void_p),
+        ("opaque", ctypes.c_void_p),
+        ("data_type", ctypes.c_int),
+        ("adler", ctypes.c_ulong),
+        ("reserved", ctypes.c_ulong),
+    ]
+
+
+@functools.cache
+def _libz() -> ctypes.CDLL:
+    # the zlib module does not expose inflatePrime() or Z_BLOCK, which are
+    # needed to stop at deflate block boundaries and resume mid-byte from them.
+    # Loaded on first use, so importing ps3mfw does not need a shared libz.
+    libz = ctypes.CDLL(ctypes.util.find_library("z") or "libz.so.1")
+    strm_p = ctypes.POINTER(_ZStream)
+    libz.zlibVersion.restype = ctypes.c_char_p
+    libz.inflateInit2_.argtypes = [strm_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+    libz.inflate.argtypes = [strm_p, ctypes.c_int]
+    libz.inflateEnd.argtypes = [strm_p]
+    libz.inflatePrime.argtypes = [strm_p, ctypes.c_int, ctypes.c_int]
+    libz.inflateSetDictionary.argtypes = [strm_p, ctypes.c_char_p, ctypes.c_uint]
+    return libz
+
+
+@define
+class InflatePoint:
+    """State needed to restart inflating at uncompressed offset out."""
+
+    out: int
+    inp: int
+    bits: int
+    window: bytes
+
+
+InflateIndex = Struct(
+    "magic" / Const(b"ZIDX"),
+    "key" / Bytes(20),
+    "span" / Int64ub,
+    "sz" / Int64ub,
+    "points"
+    / PrefixedArray(
+        Int32ub,
+        Struct(
+            "out" / Int64ub,
+            "inp" / Int64ub,
+            "bits" / Int8ub,
+            "window" / Prefixed(Int32ub, GreedyBytes),
+        ),
+    ),
+)
+
+
+class _Inflater:
+    """A zlib inflate stream positioned at an InflatePoint."""
+
+    def __init__(
+        self, fh: OffsetRawIOBase, pt: InflatePoint, wbits: int, chunk_sz: int
+    ):
+        self.fh = fh
+        self.chunk_sz = chunk_sz
+        self.inp = pt.inp
+        self.out = pt.out
+        self.eof = False
+        self.window = bytearray(pt.window)
+        self._in_buf = None
+        self._strm = _ZStream()
+        ret = _libz().inflateInit2_(
+            self._strm,
+            wbits if pt.out == 0 else -15,
+            _libz().zlibVersion(),
+            ctypes.sizeof(_ZStream),
+        )
+        if ret != Z_OK:
+            raise zlib.error(f"inflateInit2 failed: {ret}")
+        if pt.bits:
+            byte = fh.pread(pt.inp - 1, 1)[0]
+            _libz().inflatePrime(self._strm, pt.bits, byte >> (8 - pt.bits))
+        if pt.window:
+            _libz().inflateSetDictionary(self._strm, bytes(pt.window), len(pt.window))
+
+    def close(self) -> None:
+        if self._strm is not None:
+            _libz().inflateEnd(self._strm)
+            self._strm = None
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def at_block_boundary(self) -> bool:
+        # bit 7: stopped at a block boundary, bit 6: that block was the last
+        return self._strm.data_type & 0xC0 == 0x80
+
+    @property
+    def bits(self) -> int:
+        return self._strm.data_type & 7
+
+    def inflate(self, dst: memoryview) -> int:
+        """Inflate into dst, stopping early at the end of a deflate block."""
+        strm = self._strm
+        if not strm.avail_in:
+            self._in_buf = self.fh.pread(self.inp, self.chunk_sz)
+            strm.next_in = ctypes.cast(ctypes.c_char_p(self._in_buf), ctypes.c_void_p)
+            strm.avail_in = len(self._in_buf)
+        out = (ctypes.c_char * len(dst)).from_buffer(dst)
+        strm.next_out = ctypes.addressof(out)
+        strm.avail_out = len(dst)
+        avail_in = strm.avail_in
+        ret = _libz().inflate(strm, Z_BLOCK)
+        n = len(dst) - strm.avail_out
+        del out
+        self.inp += avail_in - strm.avail_in
+        self.out += n
+        if ret == Z_STREAM_END:
+            self.eof = True
+        elif ret == Z_BUF_ERROR and not avail_in:
+            raise EOFError("compressed stream is truncated")
+        elif ret not in (Z_OK, Z_BUF_ERROR):
+            msg = strm.msg.decode() if strm.msg else ret
+            raise zlib.error(f"inflate failed at {self.inp:#x}: {msg}")
+        self.window += dst[:n]
+        if len(self.window) > 2 * WINSZ:
+            del self.window[:-WINSZ]
+        return n
+
+
+@define
+class InflateRawIOBase(PReadRawIOBase):
+    """
+    Random access view of a zlib stream.
+
+    While inflating, the state at a deflate block boundary is recorded every
+    span bytes of output (the offsets, the partial byte and the 32 KiB window,
+    as in zlib's zran example), so a seek resumes from the nearest point
+    before it instead of from the start. Sequential reads continue the current
+    stream. The points can be saved to index_path and are reloaded when it
+    matches the compressed data.
+    """
+
+    fh: Final[OffsetRawIOBase] = field(converter=as_offset_fh)
+    usz: Optional[int] = None
+    span: Final[int] = 1024 * 1024
+    index_path: Final[Optional[str]] = None
+    wbits: Final[int] = zlib.MAX_WBITS
+    chunk_sz: Final[int] = 64 * 1024
+    points: Final[List[InflatePoint]] = field(init=False, factory=list)
+    _key: Final[bytes] = field(init=False)
+    _cursor: Optional[_Inflater] = field(init=False, default=None)
+    _dirty: bool = field(init=False, default=False)
+    _lock: Final[threading.RLock] = field(init=False, factory=threading.RLock)
+    _idx: int = field(init=False, default=0)
+
+    def __attrs_post_init__(self) -> None:
+        self._key = hashlib.sha1(
+            self.fh.sz.to_bytes(8, "big") + self.fh.pread(0, 512)
+        ).digest()
+        if not (self.index_path and self._load_index()):
+            self.points.append(InflatePoint(out=0, inp=0, bits=0, window=b""))
+
+    @property
+    def sz(self) -> int:
+        if self.usz is None:
+            with self._lock:
+                self._cursor_at(self.points[-1].out)
+                scratch = memoryview(bytearray(self.chunk_sz))
+                while not self._cursor.eof:
+                    self._step(scratch)
+        return self.usz
+
+    def _load_index(self) -> bool:
+        try:
+            with open(self.index_path, "rb") as f:
+                index = InflateIndex.parse(f.read())
+        except (OSError, ConstructError):
+            return False
+        if index.key != self._key or index.span != self.span:
+            return False
+        self.usz = index.sz
+        self.points.extend(
+            InflatePoint(
+                out=p.out, inp=p.inp, bits=p.bits, window=zlib.decompress(p.window)
+            )
+            for p in index.points
+        )
+        return True
+
+    def save_index(self) -> None:
+        index = InflateIndex.build(
+            dict(
+                key=self._key,
+                span=self.span,
+                sz=self.sz,
+                points=[
+                    dict(
+                        out=p.out,
+                        inp=p.inp,
+                        bits=p.bits,
+                        window=zlib.compress(p.window),
+                    )
+                    for p in self.points
+                ],
+            )
+        )
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(index)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def close(self) -> None:
+        with self._lock:
+            if self._dirty and self.index_path:
+                self.save_index()
+            if self._cursor is not None:
+                self._cursor.close()
+                self._cursor = None
+        super().close()
+
+    def _step(self, dst: memoryview) -> int:
+        cur = self._cursor
+        n = cur.inflate(dst)
+        if cur.eof:
+            if self.usz is None:
+                self.usz = cur.out
+                self._dirty = True
+        elif cur.at_block_boundary and cur.out - self.points[-1].out >= self.span:
+            self.points.append(
+                InflatePoint(
+                    out=cur.out,
+                    inp=cur.inp,
+                    bits=cur.bits,
+                    window=bytes(cur.window[-WINSZ:]),
+                )
+            )
+            self._dirty = True
+        return n
+
+    def _cursor_at(self, offset: int) -> None:
+        """Position the cursor at or before offset, restarting only if needed."""
+        i = bisect.bisect_right([p.out for p in self.points], offset) - 1
+        pt = self.points[i]
+        cur = self._cursor
+        if cur is None or cur.out > offset or cur.out < pt.out:
+            if cur is not None:
+                cur.close()
+            self._cursor = _Inflater(self.fh, pt, self.wbits, self.chunk_sz)
+
+    def preadinto(self, offset: int, b) -> int:
+        with memoryview(b) as mv, mv.cast("B") as out, self._lock:
+            if self.usz is not None:
+                out = out[: max(0, min(len(out), self.usz - offset))]
+            self._cursor_at(offset)
+            cur = self._cursor
+            scratch = None
+            while cur.out < offset and not cur.eof:
+                if scratch is None:
+                    scratch = memoryview(bytearray(self.chunk_sz))
+                self._step(scratch[: min(len(scratch), offset - cur.out)])
+            nread = 0
+            while nread < len(out) and not cur.eof:
+                nread += self._step(out[nread:])
+            return nread
+
+    def pread(self, offset: int, size: int) -> bytes:
+        if self.usz is not None:
+            size = max(0, min(size, self.usz - offset))
+        buf = bytearray(size)
+        n = self.preadinto(offset, buf)
+        return bytes(buf[:n])
@@ -1,22 +1,79 @@
+import enum
 import io
 import mmap
+import os
+import stat
+import threading
+import time
 from array import array
-from contextlib import contextmanager
-from typing import Final, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Final,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
 import requests
 from attrs import define, field
 from typing_extensions import Self
 from wrapt import ObjectProxy
 
+from .blockpool import BlockPool, CacheStats
+from .diskcache import DiskCache
+from .iostats import AccessTrace, HTTPStats, IOStats
 from .util import round_down, round_up
 
+T = TypeVar("T")
+
+# transient statuses HTTPFile retries, on another mirror if it has any
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# failures HTTPFile retries, including connections dropped mid-body
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+
+
+class Advice(enum.Enum):
+    """How a range is about to be accessed, see FancyRawIOBase.advise()."""
+
+    NORMAL = enum.auto()
+    RANDOM = enum.auto()
+    SEQUENTIAL = enum.auto()
+    WILLNEED = enum.auto()
+
+
+_FADVISE = {
+    Advice.NORMAL: "POSIX_FADV_NORMAL",
+    Advice.RANDOM: "POSIX_FADV_RANDOM",
+    Advice.SEQUENTIAL: "POSIX_FADV_SEQUENTIAL",
+    Advice.WILLNEED: "POSIX_FADV_WILLNEED",
+}
+
+_MADVISE = {
+    Advice.NORMAL: "MADV_NORMAL",
+    Advice.RANDOM: "MADV_RANDOM",
+    Advice.SEQUENTIAL: "MADV_SEQUENTIAL",
+    Advice.WILLNEED: "MADV_WILLNEED",
+}
+
 
 class SubscriptedIOBaseMixin:
     sz: int
     blksz: Optional[int]
 
-    def __getitem__(self, item: slice) -> bytes:
+    def _slice_range(self, item: slice) -> Tuple[int, int]:
         byte_off, num_bytes, step = item.start, item.stop, item.step
         if byte_off is None:
             byte_off = 0
@@ -24,11 +81,10 @@ class SubscriptedIOBaseMixin:
             num_bytes = self.sz
         if step == Ellipsis:
             byte_off, num_bytes = byte_off * self.blksz, num_bytes * self.blksz
-        old_tell = self.tell()
-        self.seek(byte_off, io.SEEK_SET)
-        buf = self.read(num_bytes)
-        self.seek(old_tell, io.SEEK_SET)
-        return buf
+        return byte_off, num_bytes
+
+    def __getitem__(self, item: slice) -> bytes:
+        return self.pread(*self._slice_range(item))
 
 
 class SeekContextIOBaseMixin:
@@ -42,13 +98,81 @@ class SeekContextIOBaseMixin:
 
 
 class FancyRawIOBase(SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
-    pass
+    @property
+    def sz(self) -> int:
+        with self.seek_ctx(0, io.SEEK_END):
+            return self.tell()
+
+    def pread(self, offset: int, size: int) -> bytes:
+        """
+        Read size bytes at offset without using the file position. This
+        fallback goes through seek_ctx, so only backends that override it are
+        safe to share between threads.
+        """
+        with self.seek_ctx(offset):
+            return self.read(size)
+
+    def preadinto(self, offset: int, b) -> int:
+        with self.seek_ctx(offset):
+            return self.readinto(b)
+
+    def advise(self, offset: int, length: int, hint: Advice = Advice.WILLNEED) -> None:
+        """
+        Hint that length bytes at offset are about to be read (WILLNEED) or
+        how they will be accessed. Backends may fetch the range in one batch
+        or pass the hint to the kernel; the default ignores it.
+        """
+
+    def readinto(self, b) -> int:
+        # fallback for backends that only implement read()
+        buf = self.read(len(b))
+        with memoryview(b) as mv, mv.cast("B") as out:
+            out[: len(buf)] = buf
+        return len(buf)
+
+    def view(self, offset: int = 0, size: int = -1) -> memoryview:
+        """
+        Return size bytes at offset as a memoryview. Backends that keep the
+        data in memory return a view of it without copying; the default reads
+        into a fresh buffer.
+        """
+        if size == -1:
+            size = self.sz - offset
+        buf = bytearray(size)
+        n = self.preadinto(offset, buf)
+        return memoryview(buf)[:n]
+
+    def copy_to(
+        self, dst: BinaryIO, offset: int = 0, size: int = -1, bufsz: int = 1024 * 1024
+    ) -> int:
+        """Copy size bytes at offset to dst through a single reused buffer."""
+        buf = memoryview(bytearray(bufsz))
+        ncopied = 0
+        while size < 0 or ncopied < size:
+            chunk = buf if size < 0 else buf[: min(bufsz, size - ncopied)]
+            n = self.preadinto(offset + ncopied, chunk)
+            if not n:
+                break
+            dst.write(buf[:n])
+            ncopied += n
+        return ncopied
+
+
+def _is_mappable(path: str) -> bool:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    # empty files cannot be mapped
+    return stat.S_ISREG(st.st_mode) and st.st_size > 0
 
 
 class FancyRawIOBaseProxy(ObjectProxy, FancyRawIOBase):
     def __new__(cls, wrapped):
         if isinstance(wrapped, FancyRawIOBase):
             return wrapped
+        if isinstance(wrapped, str) and _is_mappable(wrapped):
+            return MmapFile(wrapped)
         return super().__new__(cls)
 
     def __init__(self, wrapped):
@@ -62,6 +186,34 @@ class FancyRawIOBaseProxy(ObjectProxy, FancyRawIOBase):
             super().__init__(io.FileIO(wrapped, "r"))
         else:
             raise NotImplementedError
+        try:
+            self._self_fd = self.__wrapped__.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            self._self_fd = None
+
+    @property
+    def sz(self) -> int:
+        if self._self_fd is None:
+            return FancyRawIOBase.sz.fget(self)
+        return os.fstat(self._self_fd).st_size
+
+    def readinto(self, b) -> int:
+        return self.__wrapped__.readinto(b)
+
+    def pread(self, offset: int, size: int) -> bytes:
+        if self._self_fd is None:
+            return super().pread(offset, size)
+        return os.pread(self._self_fd, size, offset)
+
+    def preadinto(self, offset: int, b) -> int:
+        if self._self_fd is None:
+            return super().preadinto(offset, b)
+        return os.preadv(self._self_fd, [b], offset)
+
+    def advise(self, offset: int, length: int, hint: Advice = Advice.WILLNEED) -> None:
+        if self._self_fd is None or not hasattr(os, "posix_fadvise"):
+            return
+        os.posix_fadvise(self._self_fd, offset, length, getattr(os, _FADVISE[hint]))
 
 
 @define
@@ -73,113 +225,954 @@ class OffsetRawIOBase(io.RawIOBase, FancyRawIOBase):
     _end: Final[int] = field(init=False)
     _parent_end: Final[int] = field(init=False)
     _idx: Final[int] = field(init=False, default=0)
+    io_stats: Final[IOStats] = field(init=False, factory=IOStats)
 
     def __attrs_post_init__(self) -> None:
-        with self.fh.seek_ctx(0, io.SEEK_END):
-            self._parent_end = self.fh.tell()
+        self._parent_end = self.fh.sz
         if self.sz == -1:
             self.sz = self._parent_end - self.off
         self._end = self.off + self.sz
 
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
     def read(self, size: int = -1) -> bytes:
         if size == -1:
             size = self.sz - self._idx
-        size = min(self.sz - self._idx, size)
-        with self.fh.seek_ctx(self.off + self._idx, io.SEEK_SET):
-            buf = self.fh.read(size)
+        buf = self.pread(self._idx, size)
         self._idx += len(buf)
         return buf
 
+    def readinto(self, b) -> int:
+        n = self.preadinto(self._idx, b)
+        self._idx += n
+        return n
+
+    def pread(self, offset: int, size: int) -> bytes:
+        req, size = size, max(0, min(self.sz - offset, size))
+        t = time.perf_counter()
+        buf = self.fh.pread(self.off + offset, size)
+        self.io_stats.record_read(req, len(buf), time.perf_counter() - t)
+        return buf
+
+    def preadinto(self, offset: int, b) -> int:
+        with memoryview(b) as mv, mv.cast("B") as out:
+            size = max(0, min(len(out), self.sz - offset))
+            t = time.perf_counter()
+            n = self.fh.preadinto(self.off + offset, out[:size])
+            self.io_stats.record_read(len(out), n, time.perf_counter() - t)
+            return n
+
+    def view(self, offset: int = 0, size: int = -1) -> memoryview:
+        if size == -1:
+            size = self.sz - offset
+        if not (0 <= offset and offset + size <= self.sz):
+            raise IndexError("out of bounds view")
+        return self.fh.view(self.off + offset, size)
+
+    def advise(self, offset: int, length: int, hint: Advice = Advice.WILLNEED) -> None:
+        length = min(length, self.sz - offset)
+        if offset < 0 or length <= 0:
+            return
+        self.fh.advise(self.off + offset, length, hint)
+
+    def copy_to(
+        self, dst: BinaryIO, offset: int = 0, size: int = -1, bufsz: int = 1024 * 1024
+    ) -> int:
+        # let the backing file pick its fastest way of streaming the range
+        if size < 0:
+            size = self.sz - offset
+        size = max(0, min(size, self.sz - offset))
+        t = time.perf_counter()
+        n = self.fh.copy_to(dst, self.off + offset, size, bufsz)
+        self.io_stats.record_read(size, n, time.perf_counter() - t)
+        return n
+
     def tell(self) -> int:
         return self._idx
 
     def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
-        parent_off = offset
-        if whence == io.SEEK_SET:
-            # add beginning gap
-            parent_off += self.off
+        idx = offset
+        if whence == io.SEEK_CUR:
+            idx += self._idx
         elif whence == io.SEEK_END:
-            # add end gap
-            parent_off += self._parent_end - self._end
-        self._idx = parent_off - self.off
-        if not (0 <= self._idx <= self.sz):
+            idx += self.sz
+        if not (0 <= idx <= self.sz):
             raise IndexError("out of bounds seek")
+        self._idx = idx
+        self.io_stats.seeks += 1
         return self._idx
 
     def subfile(self, offset: int, size: int = -1, blksz: Optional[int] = None) -> Self:
-        suboff = self.off + offset
-        if not (0 <= suboff <= self.sz):
-            raise ValueError("subfile suboff out of range")
+        if not (0 <= offset <= self.sz):
+            raise ValueError("subfile offset out of range")
         if size < 0:
             size = self.sz - offset
+        if offset + size > self.sz:
+            raise ValueError("subfile size out of range")
+        suboff = self.off + offset
         if blksz is None:
             blksz = self.blksz
         return type(self)(self.fh, suboff, size, blksz)
 
 
+def as_offset_fh(fh) -> OffsetRawIOBase:
+    if isinstance(fh, OffsetRawIOBase):
+        return fh
+    return OffsetRawIOBase(fh)
+
+
+class PReadRawIOBase(io.RawIOBase, FancyRawIOBase):
+    """
+    Base for read-only layers that only implement sz, pread and preadinto;
+    the file position and stream reads are derived from them.
+    """
+
+    _idx: int
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size == -1:
+            size = self.sz - self._idx
+        buf = self.pread(self._idx, size)
+        self._idx += len(buf)
+        return buf
+
+    def readinto(self, b) -> int:
+        n = self.preadinto(self._idx, b)
+        self._idx += n
+        return n
+
+    def pread(self, offset: int, size: int) -> bytes:
+        buf = bytearray(max(0, min(size, self.sz - offset)))
+        n = self.preadinto(offset, buf)
+        return bytes(buf[:n])
+
+    def tell(self) -> int:
+        return self._idx
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        idx = offset
+        if whence == io.SEEK_CUR:
+            idx += self._idx
+        elif whence == io.SEEK_END:
+            idx += self.sz
+        if not (0 <= idx <= self.sz):
+            raise IndexError("out of bounds seek")
+        self._idx = idx
+        return self._idx
+
+
+@define
+class MmapFile(PReadRawIOBase):
+    """
+    Read-only memory mapping of a local regular file.
+
+    Positional reads copy out of the mapping without a syscall, and views
+    and slices are memoryviews of it, so they must be released before the
+    mapping can be unmapped. The mapping is advised MADV_RANDOM, since
+    parsers jump between headers, and copy_to() advises the range it
+    streams MADV_SEQUENTIAL.
+    """
+
+    path: Final[str]
+    _fd: int = field(init=False)
+    _mm: mmap.mmap = field(init=False)
+    _idx: int = field(init=False, default=0)
+
+    def __attrs_post_init__(self) -> None:
+        self._fd = os.open(self.path, os.O_RDONLY)
+        try:
+            self._mm = mmap.mmap(self._fd, 0, prot=mmap.PROT_READ)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self.advise(0, self.sz, Advice.RANDOM)
+
+    @property
+    def sz(self) -> int:
+        return len(self._mm)
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def advise(self, offset: int, length: int, hint: Advice = Advice.WILLNEED) -> None:
+        if length <= 0 or not (0 <= offset < self.sz):
+            return
+        advice = getattr(mmap, _MADVISE[hint], None)
+        if advice is None:
+            return
+        start = round_down(offset, mmap.PAGESIZE)
+        self._mm.madvise(advice, start, offset + length - start)
+
+    def pread(self, offset: int, size: int) -> bytes:
+        size = max(0, min(size, self.sz - offset))
+        return self._mm[offset : offset + size]
+
+    def preadinto(self, offset: int, b) -> int:
+        with memoryview(b) as mv, mv.cast("B") as out:
+            size = max(0, min(len(out), self.sz - offset))
+            with memoryview(self._mm) as mm:
+                out[:size] = mm[offset : offset + size]
+        return size
+
+    def view(self, offset: int = 0, size: int = -1) -> memoryview:
+        if size == -1:
+            size = self.sz - offset
+        if not (0 <= offset and offset + size <= self.sz):
+            raise IndexError("out of bounds view")
+        return memoryview(self._mm)[offset : offset + size]
+
+    def __getitem__(self, item: slice) -> memoryview:
+        byte_off, num_bytes = self._slice_range(item)
+        return self.view(byte_off, max(0, min(num_bytes, self.sz - byte_off)))
+
+    def copy_to(
+        self, dst: BinaryIO, offset: int = 0, size: int = -1, bufsz: int = 1024 * 1024
+    ) -> int:
+        if size < 0:
+            size = self.sz - offset
+        size = max(0, min(size, self.sz - offset))
+        self.advise(offset, size, Advice.SEQUENTIAL)
+        try:
+            with memoryview(self._mm) as mm:
+                for off in range(offset, offset + size, bufsz):
+                    dst.write(mm[off : min(off + bufsz, offset + size)])
+        finally:
+            self.advise(offset, size, Advice.RANDOM)
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                self._mm.close()
+            except BufferError:
+                # views are still alive, the mapping goes away with them
+                pass
+            os.close(self._fd)
+        super().close()
+
+
+@define(slots=False)
+class InstrumentedRawIOBase(PReadRawIOBase):
+    """
+    Opt-in wrapper that counts and times the reads and seeks made through it
+    and can log every read to an AccessTrace. It has no fileno(), so reads
+    cannot bypass it through sendfile or copy_file_range.
+    """
+
+    fh: Final[FancyRawIOBase] = field(converter=FancyRawIOBaseProxy)
+    name: Final[str] = "io"
+    trace: Final[Optional[AccessTrace]] = None
+    io_stats: Final[IOStats] = field(init=False, factory=IOStats)
+    _idx: int = field(init=False, default=0)
+
+    @property
+    def sz(self) -> int:
+        return self.fh.sz
+
+    def pread(self, offset: int, size: int) -> bytes:
+        t = time.perf_counter()
+        buf = self.fh.pread(offset, size)
+        self.io_stats.record_read(size, len(buf), time.perf_counter() - t)
+        if self.trace is not None:
+            self.trace.record(self.name, offset, size)
+        return buf
+
+    def preadinto(self, offset: int, b) -> int:
+        with memoryview(b) as mv:
+            t = time.perf_counter()
+            n = self.fh.preadinto(offset, mv)
+            self.io_stats.record_read(mv.nbytes, n, time.perf_counter() - t)
+            if self.trace is not None:
+                self.trace.record(self.name, offset, mv.nbytes)
+            return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self.io_stats.seeks += 1
+        return super().seek(offset, whence)
+
+    def advise(self, offset: int, length: int, hint: Advice = Advice.WILLNEED) -> None:
+        self.fh.advise(offset, length, hint)
+
+    def close(self) -> None:
+        self.fh.close()
+        super().close()
+
+
+def open_path(path: str, mirrors: Tuple[str, ...] = ()) -> FancyRawIOBase:
+    """Open a local path or an http(s) URL, with optional mirrors, for reading."""
+    if path.startswith(("http://", "https://")):
+        return HTTPFile(path, mirrors=mirrors)
+    return FancyRawIOBaseProxy(path)
+
+
+def resource_stamp(path: str, timeout: float = 30.0) -> Tuple[int, str]:
+    """Size and validator of a local path or URL, without reading its data."""
+    if path.startswith(("http://", "https://")):
+        r = requests.head(path, allow_redirects=True, timeout=timeout)
+        r.raise_for_status()
+        etag = r.headers.get("ETag") or r.headers.get("Last-Modified", "")
+        return int(r.headers["Content-Length"]), etag
+    st = os.stat(path)
+    return st.st_size, f"{st.st_ino:x}-{st.st_mtime_ns:x}"
+
+
+def resolve_fd(fh: FancyRawIOBase, offset: int) -> Tuple[Optional[int], int]:
+    while isinstance(fh, OffsetRawIOBase):
+        offset += fh.off
+        fh = fh.fh
+    try:
+        return fh.fileno(), offset
+    except (AttributeError, OSError, ValueError):
+        return None, offset
+
+
+def copy_file_range(
+    src: FancyRawIOBase,
+    src_off: int,
+    dst_fd: int,
+    dst_off: int,
+    size: int,
+    bufsz: int = 1024 * 1024,
+) -> None:
+    """
+    Copy size bytes from src at src_off to dst_fd at dst_off. When src is
+    backed by a local file the copy stays in the kernel (copy_file_range, then
+    sendfile), otherwise it goes through a reused buffer.
+    """
+    src_fd, src_fd_off = resolve_fd(src, src_off)
+    done = 0
+    if src_fd is not None and hasattr(os, "copy_file_range"):
+        try:
+            while done < size:
+                n = os.copy_file_range(
+                    src_fd, dst_fd, size - done, src_fd_off + done, dst_off + done
+                )
+                if not n:
+                    break
+                done += n
+        except OSError:
+            # e.g. EXDEV on older kernels or unsupported filesystems
+            pass
+    if src_fd is not None and done < size and hasattr(os, "sendfile"):
+        try:
+            os.lseek(dst_fd, dst_off + done, os.SEEK_SET)
+            while done < size:
+                n = os.sendfile(dst_fd, src_fd, src_fd_off + done, size - done)
+                if not n:
+                    break
+                done += n
+        except OSError:
+            pass
+    buf = memoryview(bytearray(min(bufsz, max(size - done, 0))))
+    while done < size:
+        n = src.preadinto(src_off + done, buf[: min(len(buf), size - done)])
+        if not n:
+            raise EOFError(f"short read at {src_off + done:#x}")
+        os.pwrite(dst_fd, buf[:n], dst_off + done)
+        done += n
+
+
+def parse_content_range(content_range: str) -> Tuple[int, int, Optional[int]]:
+    # Content-Range: bytes <first>-<last>/<complete-length or *>
+    unit, _, rng = content_range.strip().partition(" ")
+    if unit != "bytes":
+        raise ValueError(f"unsupported Content-Range unit '{unit}'")
+    rng, _, complete = rng.partition("/")
+    first, _, last = rng.partition("-")
+    return int(first), int(last), None if complete == "*" else int(complete)
+
+
+def iter_multipart_byteranges(
+    body: bytes, boundary: str
+) -> Iterator[Tuple[int, bytes]]:
+    """Yield (offset, data) for every part of a multipart/byteranges body."""
+    delim = b"--" + boundary.encode()
+    idx = body.find(delim)
+    while idx != -1:
+        idx += len(delim)
+        if body[idx : idx + 2] == b"--":
+            return
+        hdr_end = body.index(b"\r\n\r\n", idx)
+        hdrs = {}
+        for line in body[idx:hdr_end].decode("latin-1").split("\r\n"):
+            if ":" in line:
+                k, v = line.split(":", 1)
+                hdrs[k.strip().lower()] = v.strip()
+        first, last, _ = parse_content_range(hdrs["content-range"])
+        data_start = hdr_end + 4
+        data_end = data_start + last - first + 1
+        if data_end > len(body):
+            raise ValueError("truncated multipart/byteranges body")
+        yield first, body[data_start:data_end]
+        idx = body.find(delim, data_end)
+
+
+def range_response_parts(
+    status: int,
+    headers: Mapping[str, str],
+    body: bytes,
+    sz: int,
+    byte_ranges: List[Tuple[int, int]],
+) -> List[Tuple[int, bytes]]:
+    """
+    (offset, data) of every part of a response to a request for byte_ranges
+    of a file of sz bytes, raising ValueError for a status, length or range
+    that does not match the request, e.g. a body cut short. A part may still
+    hold less than was requested, as servers are allowed to send less.
+    """
+    if status == 200:
+        # server ignored the Range header and sent the whole file
+        if len(body) != sz:
+            raise ValueError(f"got {len(body)} of {sz} bytes")
+        return [(s, body[s:e]) for s, e in byte_ranges]
+    if status != 206:
+        raise ValueError(f"unexpected status {status}")
+    ctype = headers.get("Content-Type", "")
+    if ctype.startswith("multipart/byteranges"):
+        boundary = ctype.split("boundary=", 1)[1].strip('"')
+        parts = list(iter_multipart_byteranges(body, boundary))
+    else:
+        first, last, complete = parse_content_range(headers["Content-Range"])
+        if complete not in (None, sz):
+            raise ValueError(f"complete length {complete}, expected {sz}")
+        if len(body) != last - first + 1:
+            raise ValueError(f"got {len(body)} bytes for {first}-{last}")
+        parts = [(first, body)]
+    for off, buf in parts:
+        if not any(off < e and off + len(buf) > s for s, e in byte_ranges):
+            raise ValueError(f"unrequested range at {off:#x}")
+    return parts
+
+
+class BlockCacheMixin:
+    """
+    Bitmap of the blocks of a cache mapping that hold data, and the runs of
+    missing blocks to request, shared by HTTPFile and aio.AsyncHTTPFile.
+    """
+
+    __slots__ = ()
+
+    sz: int
+    blksz: int
+    max_req_sz: int
+    _cache_blkmap: array
+
+    @staticmethod
+    def _new_blkmap(sz: int, blksz: int) -> array:
+        blkmap = array("Q")
+        bits = blkmap.itemsize * 8
+        blkmap.extend([0] * (round_up(round_up(sz, blksz) // blksz, bits) // bits))
+        return blkmap
+
+    def _is_cached(self, byte_off: int) -> bool:
+        word_idx = byte_off // self.blksz // self._cache_blkmap.itemsize // 8
+        packed = self._cache_blkmap[word_idx]
+        bit_idx = (byte_off // self.blksz) % (self._cache_blkmap.itemsize * 8)
+        return packed & (1 << bit_idx) != 0
+
+    def _mark_cached(self, byte_off: int) -> None:
+        word_idx = byte_off // self.blksz // self._cache_blkmap.itemsize // 8
+        bit_idx = (byte_off // self.blksz) % (self._cache_blkmap.itemsize * 8)
+        self._cache_blkmap[word_idx] |= 1 << bit_idx
+
+    def _is_pending(self, blk: int) -> bool:
+        """Whether blk is already being fetched, so no run should include it."""
+        return False
+
+    def _filled_blks(self, byte_off: int, byte_end: int) -> range:
+        """Blocks that data at [byte_off, byte_end) fills."""
+        # only whole blocks (or the short tail block) count as cached
+        blk_end = byte_end // self.blksz
+        if byte_end == self.sz:
+            blk_end = round_up(byte_end, self.blksz) // self.blksz
+        return range(round_up(byte_off, self.blksz) // self.blksz, blk_end)
+
+    def _uncached_runs(self, blk_start: int, blk_end: int) -> Iterator[Tuple[int, int]]:
+        """Runs of blocks that are neither cached nor pending, of max_req_sz."""
+        max_blks = max(1, self.max_req_sz // self.blksz)
+        run_start = None
+        for blk in range(blk_start, blk_end):
+            if self._is_pending(blk) or self._is_cached(blk * self.blksz):
+                if run_start is not None:
+                    yield run_start, blk
+                    run_start = None
+            elif run_start is None:
+                run_start = blk
+            elif blk - run_start == max_blks:
+                yield run_start, blk
+                run_start = blk
+        if run_start is not None:
+            yield run_start, blk_end
+
+
 @define(slots=False)
-class HTTPFile(FancyRawIOBase):
+class HTTPFile(BlockCacheMixin, FancyRawIOBase):
+    """
+    Block cached reader of an HTTP resource using range requests.
+
+    mirrors are more URLs of the same content, which must report the same
+    size and, where both send one, the same ETag. Mirrors that fail the HEAD
+    request are dropped. When there are several, the misses of a read are
+    split into block aligned stripes fetched concurrently, one mirror each.
+    Requests that time out, fail to connect, are cut short or get a 5xx or
+    429 response are retried at once on the next mirror, and with an
+    exponential backoff once every mirror has been tried. A mirror that
+    fails is tried last for cooldown seconds, doubling with every further
+    consecutive failure, so it does not slow down requests that start on it.
+    """
+
     url: Final[str]
+    mirrors: Final[Tuple[str, ...]] = field(default=(), converter=tuple)
+    retries: Final[int] = 3
+    timeout: Final[float] = 30.0
+    backoff: Final[float] = 0.25
+    cooldown: Final[float] = 5.0
     blksz: Final[int] = 256 * 1024
-    _ses: Final[requests.Session] = field(init=False, default=requests.Session())
+    max_req_sz: Final[int] = 16 * 1024 * 1024
+    multi_range: Final[bool] = False
+    readahead: Final[int] = 0
+    cache_dir: Final[Optional[str]] = None
+    cache_max_sz: Final[Optional[int]] = None
+    cache_max_mem: Final[Optional[int]] = None
+    stats: Final[CacheStats] = field(init=False, factory=CacheStats)
+    http_stats: Final[HTTPStats] = field(init=False, factory=HTTPStats)
+    _ses: Final[requests.Session] = field(init=False)
+    _urls: Tuple[str, ...] = field(init=False)
+    _validator: str = field(init=False, default="")
+    _failures: Final[Dict[str, int]] = field(init=False, factory=dict)
+    _demoted_until: Final[Dict[str, float]] = field(init=False, factory=dict)
+    _next_url: int = field(init=False, default=0)
+    _stripe_pool: Optional[ThreadPoolExecutor] = field(init=False, default=None)
     _idx: int = field(init=False, default=0)
     _sz: Final[int] = field(init=False)
     _cache: Final[mmap.mmap] = field(init=False)
     _cache_blkmap: Final[array] = field(init=False)
+    _disk_cache: Optional[DiskCache] = field(init=False, default=None)
+    _blkpool: Optional[BlockPool] = field(init=False, default=None)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+    _pool: Optional[ThreadPoolExecutor] = field(init=False, default=None)
+    _inflight: Final[Dict[int, Future]] = field(init=False, factory=dict)
+    _last_read_end: int = field(init=False, default=0)
 
     def __attrs_post_init__(self) -> None:
-        head_r = self._ses.head(self.url, allow_redirects=True)
-        assert (
-            "accept-ranges" in head_r.headers
-            and "bytes" in head_r.headers["Accept-Ranges"]
-        )
+        self._ses = self._new_session()
+        head_r, self._urls = self._probe((self.url, *self.mirrors))
         self._sz = int(head_r.headers["Content-Length"])
+        self._validator = head_r.headers.get("ETag") or head_r.headers.get(
+            "Last-Modified", ""
+        )
+        if self.cache_max_mem is not None:
+            if self.cache_dir is not None:
+                raise ValueError("cache_dir and cache_max_mem are mutually exclusive")
+            self._blkpool = BlockPool(
+                max(1, self.cache_max_mem // self.blksz), self.blksz, self.stats
+            )
+            return
+        if self.cache_dir is not None:
+            self._disk_cache = DiskCache(
+                self.cache_dir,
+                self.url,
+                self._sz,
+                self.blksz,
+                validators=(
+                    head_r.headers.get("ETag", ""),
+                    head_r.headers.get("Last-Modified", ""),
+                ),
+                max_sz=self.cache_max_sz,
+            )
+            self._cache = self._disk_cache.data
+            self._cache_blkmap = self._disk_cache.blkmap
+            return
         self._cache = mmap.mmap(-1, self._sz)
-        self._cache_blkmap = array("Q")
-        blkmap_num_words = (
-            round_up(self._sz, self.blksz)
-            // self.blksz
-            // self._cache_blkmap.itemsize
-            // 8
+        self._cache_blkmap = self._new_blkmap(self._sz, self.blksz)
+
+    def _probe(
+        self, urls: Tuple[str, ...]
+    ) -> Tuple[requests.Response, Tuple[str, ...]]:
+        """HEAD every URL, returning the first response and the usable URLs."""
+        first, usable, err = None, [], None
+        for url in urls:
+            try:
+                r = self._request("HEAD", (url,))
+            except requests.RequestException as e:
+                err = e
+                continue
+            if "bytes" not in r.headers.get("Accept-Ranges", ""):
+                raise ValueError(f"{url} does not support range requests")
+            if first is None:
+                first = r
+            elif r.headers["Content-Length"] != first.headers["Content-Length"]:
+                raise ValueError(f"{url} differs in size from {usable[0]}")
+            elif len({first.headers.get("ETag"), r.headers.get("ETag")} - {None}) > 1:
+                raise ValueError(f"{url} differs in ETag from {usable[0]}")
+            usable.append(url)
+        if first is None:
+            raise err
+        return first, tuple(usable)
+
+    def _new_session(self) -> requests.Session:
+        """
+        Session shared by the reader, read-ahead and stripe threads. urllib3's
+        pools are thread-safe and keep at most pool_maxsize connections per
+        mirror alive, closing any extra ones after use, so threads that come
+        and go, e.g. FUSE's or verify()'s, do not leave sockets behind.
+        """
+        ses = requests.Session()
+        nurls = 1 + len(self.mirrors)
+        # read-ahead workers, a stripe worker per mirror and foreground readers
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=nurls, pool_maxsize=self.readahead + 2 * nurls
         )
-        self._cache_blkmap.extend([0 for i in range(blkmap_num_words)])
+        ses.mount("http://", adapter)
+        ses.mount("https://", adapter)
+        return ses
+
+    def _mirror_failed(self, url: str) -> None:
+        with self._lock:
+            n = self._failures.get(url, 0) + 1
+            self._failures[url] = n
+            self._demoted_until[url] = time.monotonic() + self.cooldown * 2 ** min(
+                n - 1, 6
+            )
+
+    def _mirror_ok(self, url: str) -> None:
+        if url in self._failures:
+            with self._lock:
+                self._failures.pop(url, None)
+                self._demoted_until.pop(url, None)
+
+    def _request(
+        self,
+        method: str,
+        urls: Tuple[str, ...],
+        headers: Optional[Dict[str, str]] = None,
+        parse: Callable[[requests.Response], T] = lambda r: r,
+    ) -> T:
+        """
+        Send one request to urls[0] and return parse() of the response,
+        retrying transient failures, and responses parse() rejects with
+        ValueError, on the following URLs in turn with exponential backoff.
+        """
+        for attempt in range(self.retries + 1):
+            if attempt and attempt % len(urls) == 0:
+                # every mirror has failed once more
+                time.sleep(self.backoff * 2 ** (attempt // len(urls) - 1))
+            url = urls[attempt % len(urls)]
+            t = time.perf_counter()
+            try:
+                r = self._ses.request(
+                    method,
+                    url,
+                    headers=headers,
+                    timeout=self.timeout,
+                    allow_redirects=True,
+                )
+            except RETRY_ERRORS as e:
+                err = e
+                self._mirror_failed(url)
+                continue
+            self.http_stats.record_request(len(r.content), time.perf_counter() - t)
+            if r.status_code in RETRY_STATUSES:
+                err = requests.HTTPError(f"{r.status_code} from {url}", response=r)
+                self._mirror_failed(url)
+                continue
+            r.raise_for_status()
+            try:
+                res = parse(r)
+            except ValueError as e:
+                err = OSError(f"bad response from {url}: {e}")
+                self._mirror_failed(url)
+                continue
+            self._mirror_ok(url)
+            return res
+        raise err
+
+    def _next_urls(self) -> Tuple[str, ...]:
+        """
+        Mirrors rotated so successive requests start on different ones, with
+        mirrors still cooling down after a failure moved to the end.
+        """
+        now = time.monotonic()
+        with self._lock:
+            i = self._next_url % len(self._urls)
+            self._next_url += 1
+            urls = self._urls[i:] + self._urls[:i]
+            return tuple(
+                sorted(urls, key=lambda url: self._demoted_until.get(url, 0) > now)
+            )
 
     def _is_cached(self, byte_off: int) -> bool:
-        word_idx = byte_off // self.blksz // self._cache_blkmap.itemsize // 8
-        packed = self._cache_blkmap[word_idx]
-        bit_idx = (byte_off // self.blksz) % (self._cache_blkmap.itemsize * 8)
-        return packed & (1 << bit_idx) != 0
+        if self._blkpool is not None:
+            return byte_off // self.blksz in self._blkpool
+        return super()._is_cached(byte_off)
 
-    def _mark_cached(self, byte_off: int) -> None:
-        word_idx = byte_off // self.blksz // self._cache_blkmap.itemsize // 8
-        bit_idx = (byte_off // self.blksz) % (self._cache_blkmap.itemsize * 8)
-        self._cache_blkmap[word_idx] |= 1 << bit_idx
+    def _fill_cache(self, byte_off: int, buf: bytes) -> None:
+        byte_end = min(byte_off + len(buf), self._sz)
+        blks = self._filled_blks(byte_off, byte_end)
+        if self._blkpool is not None:
+            for blk in blks:
+                blk_off = blk * self.blksz - byte_off
+                self._blkpool.put(blk, buf[blk_off : blk_off + self.blksz])
+            return
+        self._cache[byte_off:byte_end] = buf[: byte_end - byte_off]
+        with self._lock, (
+            self._disk_cache.locked() if self._disk_cache else nullcontext()
+        ):
+            for blk in blks:
+                self._mark_cached(blk * self.blksz)
+
+    def _response_parts(
+        self, r: requests.Response, byte_ranges: List[Tuple[int, int]]
+    ) -> List[Tuple[int, bytes]]:
+        return range_response_parts(
+            r.status_code, r.headers, r.content, self._sz, byte_ranges
+        )
+
+    def _fetch_ranges(self, byte_ranges: List[Tuple[int, int]]) -> None:
+        range_str = "bytes=" + ",".join(f"{s}-{e - 1}" for s, e in byte_ranges)
+        parts = self._request(
+            "GET",
+            self._next_urls(),
+            headers={"Range": range_str},
+            parse=lambda r: self._response_parts(r, byte_ranges),
+        )
+        for off, buf in parts:
+            self._fill_cache(off, buf)
+        if len(byte_ranges) == 1:
+            return
+        # fetch whatever the server chose not to send, one range at a time
+        for s, e in byte_ranges:
+            for byte_range in self._uncached_byte_ranges(s, e):
+                self._fetch_ranges([byte_range])
+
+    def _uncached_byte_ranges(
+        self, byte_start: int, byte_end: int
+    ) -> List[Tuple[int, int]]:
+        return [
+            (s * self.blksz, min(e * self.blksz, self._sz))
+            for s, e in self._uncached_runs(
+                byte_start // self.blksz, round_up(byte_end, self.blksz) // self.blksz
+            )
+        ]
+
+    def _fill(self, byte_start: int, byte_end: int) -> None:
+        # wait on read-ahead already in flight instead of fetching it again
+        with self._lock:
+            inflight = [
+                self._inflight[blk]
+                for blk in range(
+                    byte_start // self.blksz,
+                    round_up(byte_end, self.blksz) // self.blksz,
+                )
+                if blk in self._inflight
+            ]
+        for fut in inflight:
+            try:
+                fut.result()
+            except Exception:
+                # failed read-ahead is only a missed hint, the blocks it left
+                # uncached are fetched below like any other
+                pass
+        byte_ranges = self._uncached_byte_ranges(byte_start, byte_end)
+        num_blks = (
+            round_up(byte_end, self.blksz) // self.blksz - byte_start // self.blksz
+        )
+        num_misses = sum(
+            round_up(e - s, self.blksz) // self.blksz for s, e in byte_ranges
+        )
+        self.stats.hits += num_blks - num_misses
+        self.stats.misses += num_misses
+        if not self.multi_range:
+            batches = [[byte_range] for byte_range in self._stripe(byte_ranges)]
+        else:
+            # batch runs into multipart/byteranges requests of at most max_req_sz
+            batches, batch, batch_sz = [], [], 0
+            for s, e in byte_ranges:
+                if batch and batch_sz + e - s > self.max_req_sz:
+                    batches.append(batch)
+                    batch, batch_sz = [], 0
+                batch.append((s, e))
+                batch_sz += e - s
+            if batch:
+                batches.append(batch)
+        if len(self._urls) == 1 or len(batches) < 2:
+            for batch in batches:
+                self._fetch_ranges(batch)
+        else:
+            with self._lock:
+                if self._stripe_pool is None:
+                    self._stripe_pool = ThreadPoolExecutor(
+                        max_workers=len(self._urls),
+                        thread_name_prefix="HTTPFile-stripe",
+                    )
+            futs = [self._stripe_pool.submit(self._fetch_ranges, b) for b in batches]
+            for fut in futs:
+                fut.result()
+        # a bounded pool may already have evicted blocks again, see
+        # _readinto_pooled, but the cache mapping must hold the whole range
+        if self._blkpool is None and self._uncached_byte_ranges(byte_start, byte_end):
+            raise OSError(f"range {byte_start:#x}-{byte_end:#x} still not cached")
+
+    def _stripe(self, byte_ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Split each range into block aligned pieces, one per mirror."""
+        if len(self._urls) == 1:
+            return byte_ranges
+        stripes = []
+        for s, e in byte_ranges:
+            stripe_sz = round_up(-(-(e - s) // len(self._urls)), self.blksz)
+            stripes.extend(
+                (off, min(off + stripe_sz, e)) for off in range(s, e, stripe_sz)
+            )
+        return stripes
 
     def read(self, size: int = -1) -> bytes:
         if size == -1:
             size = self._sz - self._idx
         if self._idx + size > self._sz:
             raise IndexError("out of bounds size")
-        blk_byte_start, blk_byte_end = round_down(self._idx, self.blksz), round_up(
-            self._idx + size, self.blksz
-        )
-        blk_byte_sz = blk_byte_end - blk_byte_start
-        blk_start, blk_end = blk_byte_start // self.blksz, blk_byte_end // self.blksz
-        # FIXME: coalesce uncached regions and fetch in a single request
-        for blk in range(blk_start, blk_end):
-            if self._is_cached(blk * self.blksz):
-                continue
-            range_str = f"bytes={blk * self.blksz}-{(blk + 1) * self.blksz - 1}"
-            cache_fill_buf = self._ses.get(
-                self.url, headers={"Range": range_str}
-            ).content
-            assert len(cache_fill_buf) == self.blksz
-            self._cache[blk * self.blksz : (blk + 1) * self.blksz] = cache_fill_buf
-            self._mark_cached(blk * self.blksz)
-        res = self._cache[self._idx : self._idx + size]
+        res = self.pread(self._idx, size)
         self._idx += size
         return res
 
+    def readinto(self, b) -> int:
+        n = self.preadinto(self._idx, b)
+        self._idx += n
+        return n
+
+    def pread(self, offset: int, size: int) -> bytes:
+        size = max(0, min(size, self._sz - offset))
+        if self._blkpool is None:
+            self._fill(offset, offset + size)
+            res = self._cache[offset : offset + size]
+        else:
+            res = bytearray(size)
+            self._readinto_pooled(offset, memoryview(res))
+            res = bytes(res)
+        self._note_read(offset, size)
+        return res
+
+    def preadinto(self, offset: int, b) -> int:
+        with memoryview(b) as mv, mv.cast("B") as out:
+            size = max(0, min(len(out), self._sz - offset))
+            if self._blkpool is None:
+                self._fill(offset, offset + size)
+                with memoryview(self._cache) as cache:
+                    out[:size] = cache[offset : offset + size]
+            else:
+                self._readinto_pooled(offset, out[:size])
+        self._note_read(offset, size)
+        return size
+
+    def advise(self, offset: int, length: int, hint: Advice = Advice.WILLNEED) -> None:
+        """
+        WILLNEED fetches every missing block of the range now, batched like a
+        read of it, so the reads that follow are cache hits. Other hints are
+        ignored.
+        """
+        if hint != Advice.WILLNEED:
+            return
+        end = min(offset + length, self._sz)
+        if 0 <= offset < end:
+            self._fill(offset, end)
+
+    def view(self, offset: int = 0, size: int = -1) -> memoryview:
+        """
+        Without a bounded pool the returned view aliases the cache mapping, so
+        it must be released before close().
+        """
+        if size == -1:
+            size = self._sz - offset
+        if not (0 <= offset and offset + size <= self._sz):
+            raise IndexError("out of bounds view")
+        if self._blkpool is not None:
+            buf = memoryview(bytearray(size))
+            self._readinto_pooled(offset, buf)
+            return buf
+        self._fill(offset, offset + size)
+        return memoryview(self._cache)[offset : offset + size]
+
+    @property
+    def sz(self) -> int:
+        return self._sz
+
+    @property
+    def stamp(self) -> Tuple[int, str]:
+        """Size and validator from the HEAD request, like resource_stamp()."""
+        return self._sz, self._validator
+
+    def _note_read(self, offset: int, size: int) -> None:
+        sequential = offset == self._last_read_end
+        self._last_read_end = offset + size
+        if self.readahead and sequential:
+            self._schedule_readahead(offset + size)
+
+    def _readinto_pooled(self, byte_off: int, out: memoryview) -> None:
+        # fill and copy out at most half the pool at a time so a large read
+        # does not evict its own blocks before they are copied
+        window = max(1, self._blkpool.nslots // 2) * self.blksz
+        byte_end = byte_off + len(out)
+        out_off = 0
+        while byte_off < byte_end:
+            win_end = min(round_down(byte_off, self.blksz) + window, byte_end)
+            self._fill(byte_off, win_end)
+            while byte_off < win_end:
+                blk = byte_off // self.blksz
+                blk_off = byte_off - blk * self.blksz
+                n = min(win_end - byte_off, self.blksz - blk_off)
+                if not self._blkpool.readinto(blk, blk_off, out[out_off : out_off + n]):
+                    # evicted by read-ahead before we got to it
+                    self._fill(byte_off, byte_off + n)
+                    continue
+                byte_off += n
+                out_off += n
+
+    def _prefetch_blk(self, blk: int) -> None:
+        try:
+            self._fetch_ranges(
+                [(blk * self.blksz, min((blk + 1) * self.blksz, self._sz))]
+            )
+        finally:
+            with self._lock:
+                del self._inflight[blk]
+
+    def _schedule_readahead(self, byte_off: int) -> None:
+        blk_start = byte_off // self.blksz
+        blk_end = min(
+            blk_start + self.readahead, round_up(self._sz, self.blksz) // self.blksz
+        )
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.readahead, thread_name_prefix="HTTPFile-readahead"
+                )
+            for blk in range(blk_start, blk_end):
+                if blk in self._inflight or self._is_cached(blk * self.blksz):
+                    continue
+                self._inflight[blk] = self._pool.submit(self._prefetch_blk, blk)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._inflight.clear()
+        if self._stripe_pool is not None:
+            self._stripe_pool.shutdown(wait=True)
+            self._stripe_pool = None
+        if self._disk_cache is not None:
+            self._disk_cache.close()
+            self._disk_cache = None
+        self._ses.close()
+
     def tell(self) -> int:
         return self._idx
 
@@ -189,7 +1182,7 @@ class HTTPFile(FancyRawIOBase):
         elif whence == io.SEEK_CUR:
             self._idx += offset
         elif whence == io.SEEK_END:
-            self._idx = self._sz
+            self._idx = self._sz + offset
         if not (0 <= self._idx <= self._sz):
             raise IndexError("out of bounds seek")
         return self._idx
@@ -0,0 +1,125 @@
+import threading
+import time
+from typing import Final, List, Optional, TextIO
+
+from attrs import define, field
+
+# bucket i holds latencies in [2**(i-1), 2**i) microseconds
+NUM_BUCKETS = 32
+
+
+@define
+class LatencyHistogram:
+    """Log2-bucketed latency histogram in microseconds."""
+
+    buckets: Final[List[int]] = field(factory=lambda: [0] * NUM_BUCKETS)
+    count: int = 0
+    total: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        usec = int(seconds * 1e6)
+        self.buckets[min(usec.bit_length(), NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound in seconds of the bucket holding the pct percentile."""
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return (1 << i) / 1e6
+        return (1 << (NUM_BUCKETS - 1)) / 1e6
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"n={self.count} mean={self.mean * 1e3:.3f}ms "
+            f"p50<{self.percentile(50) * 1e3:.3f}ms "
+            f"p99<{self.percentile(99) * 1e3:.3f}ms"
+        )
+
+
+@define
+class IOStats:
+    """Counters for one I/O layer."""
+
+    reads: int = 0
+    bytes_requested: int = 0
+    bytes_delivered: int = 0
+    seeks: int = 0
+    latency: Final[LatencyHistogram] = field(factory=LatencyHistogram)
+
+    def record_read(self, requested: int, delivered: int, seconds: float) -> None:
+        self.reads += 1
+        self.bytes_requested += requested
+        self.bytes_delivered += delivered
+        self.latency.record(seconds)
+
+    def summary(self) -> str:
+        return (
+            f"reads={self.reads} seeks={self.seeks} "
+            f"requested={self.bytes_requested} delivered={self.bytes_delivered} "
+            f"latency: {self.latency.summary()}"
+        )
+
+
+@define
+class HTTPStats:
+    """Requests sent by an HTTPFile, counting HEAD requests too."""
+
+    requests: int = 0
+    bytes_received: int = 0
+    latency: Final[LatencyHistogram] = field(factory=LatencyHistogram)
+
+    def record_request(self, nbytes: int, seconds: float) -> None:
+        self.requests += 1
+        self.bytes_received += nbytes
+        self.latency.record(seconds)
+
+    def summary(self) -> str:
+        return (
+            f"requests={self.requests} received={self.bytes_received} "
+            f"latency: {self.latency.summary()}"
+        )
+
+
+@define
+class AccessTrace:
+    """
+    Writes one "<seconds> <layer> <offset> <size>" line per read, with
+    seconds relative to when the trace was opened, for benchmarks/replay.py.
+    """
+
+    f: Final[TextIO]
+    _t0: Final[float] = field(init=False, factory=time.perf_counter)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    @classmethod
+    def open(cls, path: str) -> "AccessTrace":
+        return cls(open(path, "w"))
+
+    def record(self, layer: str, offset: int, size: int) -> None:
+        t = time.perf_counter() - self._t0
+        with self._lock:
+            self.f.write(f"{t:.6f} {layer} {offset} {size}\n")
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def parse_trace(path: str, layer: Optional[str] = None) -> List[tuple]:
+    """(seconds, layer, offset, size) of every traced read, optionally of one layer."""
+    accesses = []
+    with open(path) as f:
+        for line in f:
+            t, name, offset, size = line.split()
+            if layer is None or name == layer:
+                accesses.append((float(t), name, int(offset), int(size)))
+    return accesses
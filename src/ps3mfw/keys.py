@@ -0,0 +1,80 @@
+import functools
+import os
+from pathlib import Path
+from typing import Dict, Final, Iterable, Optional, Tuple
+
+import yaml
+from attrs import define, field
+
+
+def key_dir() -> Path:
+    """Directory holding key files, $PS3_KEYS or ~/.ps3 like ps3tools."""
+    return Path(os.environ.get("PS3_KEYS", Path.home() / ".ps3"))
+
+
+def load_simple_key(name: str, size: Optional[int] = None) -> bytes:
+    key = (key_dir() / name).read_bytes()
+    if size is not None and len(key) != size:
+        raise ValueError(f"key '{name}' is {len(key)} bytes, expected {size}")
+    return key
+
+
+def pup_hmac_key() -> bytes:
+    return load_simple_key("pup-hmac", 0x40)
+
+
+def _hex_bytes(val: Optional[str]) -> Optional[bytes]:
+    if val is None:
+        return None
+    return bytes.fromhex(str(val))
+
+
+@define(frozen=True)
+class Key:
+    name: str
+    category: str
+    revision: int
+    erk: bytes = field(converter=_hex_bytes)
+    riv: bytes = field(converter=_hex_bytes)
+    type: Optional[str] = None
+    pub: Optional[bytes] = field(default=None, converter=_hex_bytes)
+    priv: Optional[bytes] = field(default=None, converter=_hex_bytes)
+    ctype: Optional[int] = None
+
+
+@define
+class KeyStore:
+    """
+    Keys indexed by (category, revision, type). Keys without a type match any
+    type of their category and revision.
+    """
+
+    keys: Final[Tuple[Key, ...]] = field(converter=tuple)
+    _index: Final[Dict[Tuple[str, int, Optional[str]], Key]] = field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self._index = {(k.category, k.revision, k.type): k for k in self.keys}
+
+    def get(self, category: str, revision: int, type: Optional[str] = None) -> Key:
+        key = self._index.get((category, revision, type))
+        if key is None and type is not None:
+            key = self._index.get((category, revision, None))
+        if key is None:
+            raise KeyError(f"no key for {category} revision {revision:#x} type {type}")
+        return key
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[dict]) -> "KeyStore":
+        return cls(Key(**e) for e in entries)
+
+
+@functools.lru_cache
+def load_keystore(path: Optional[str] = None) -> KeyStore:
+    """
+    Load and index keys.yaml from key_dir() (or path) once per process. The
+    file is a list of mappings with Key's fields, binary values in hex.
+    """
+    if path is None:
+        path = key_dir() / "keys.yaml"
+    with open(path) as f:
+        return KeyStore.from_entries(yaml.safe_load(f) or [])
@@ -0,0 +1,137 @@
+import errno
+import itertools
+import os
+import stat
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fs.base import FS
+from fs.enums import ResourceType
+from fs.errors import FSError, ResourceNotFound
+
+from .io_extras import FancyRawIOBase
+
+# the image never changes under the mount, so the kernel may cache freely
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+class PUPFuseOps:
+    """
+    Read-only FUSE operations over a PUPFS (or any nested container FS).
+
+    Reads are positional on the opened member, so they can be served from
+    several FUSE threads at once. Files are opened with keep_cache set, so
+    the kernel page cache survives between opens of the same file.
+    """
+
+    def __init__(self, fs: FS, mtime: Optional[float] = None):
+        self.fs = fs
+        self.mtime = time.time() if mtime is None else mtime
+        self._files: Dict[int, FancyRawIOBase] = {}
+        self._fhs = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self, op: str, *args):
+        method = getattr(self, op, None)
+        if method is None:
+            raise OSError(errno.ENOSYS, op)
+        return method(*args)
+
+    def _info(self, path: str, namespaces: Tuple[str, ...] = ("details",)):
+        try:
+            return self.fs.getinfo(path, namespaces=namespaces)
+        except ResourceNotFound:
+            raise OSError(errno.ENOENT, path)
+
+    def getattr(self, path: str, fh: Optional[int] = None) -> dict:
+        info = self._info(path)
+        if info.is_dir:
+            mode, nlink = stat.S_IFDIR | 0o555, 2
+        elif info.type == ResourceType.symlink:
+            mode, nlink = stat.S_IFLNK | 0o777, 1
+        else:
+            mode, nlink = stat.S_IFREG | 0o444, 1
+        size = info.size or 0
+        return {
+            "st_mode": mode,
+            "st_nlink": nlink,
+            "st_size": size,
+            "st_blocks": (size + 511) // 512,
+            "st_atime": self.mtime,
+            "st_mtime": self.mtime,
+            "st_ctime": self.mtime,
+        }
+
+    def readlink(self, path: str) -> str:
+        target = self._info(path, ("link",)).target
+        if target is None:
+            raise OSError(errno.EINVAL, path)
+        return target
+
+    def readdir(self, path: str, fh: int) -> List[str]:
+        try:
+            return [".", "..", *self.fs.listdir(path)]
+        except ResourceNotFound:
+            raise OSError(errno.ENOENT, path)
+
+    def open(self, path: str, fi) -> int:
+        if fi.flags & os.O_ACCMODE != os.O_RDONLY:
+            raise OSError(errno.EROFS, path)
+        try:
+            f = self.fs.openbin(path)
+        except ResourceNotFound:
+            raise OSError(errno.ENOENT, path)
+        except FSError:
+            raise OSError(errno.EISDIR, path)
+        with self._lock:
+            fi.fh = next(self._fhs)
+            self._files[fi.fh] = f
+        fi.keep_cache = 1
+        return 0
+
+    def read(self, path: str, size: int, offset: int, fi) -> bytes:
+        return self._files[fi.fh].pread(offset, size)
+
+    def release(self, path: str, fi) -> int:
+        with self._lock:
+            f = self._files.pop(fi.fh, None)
+        if f is not None:
+            f.close()
+        return 0
+
+    def statfs(self, path: str) -> dict:
+        return {"f_bsize": 4096, "f_frsize": 4096, "f_namemax": 255}
+
+
+def mount(
+    fs: FS,
+    mountpoint: str,
+    foreground: bool = True,
+    max_read: int = 1024 * 1024,
+    max_readahead: int = 4 * 1024 * 1024,
+    allow_other: bool = False,
+) -> None:
+    """
+    Mount fs read-only at mountpoint, serving requests from multiple threads
+    with kernel caching of data, attributes and directory entries enabled.
+    """
+    from fuse import FUSE
+
+    kwargs = {"allow_other": True} if allow_other else {}
+    FUSE(
+        PUPFuseOps(fs),
+        mountpoint,
+        foreground=foreground,
+        nothreads=False,
+        raw_fi=True,
+        ro=True,
+        fsname="ps3mfw",
+        kernel_cache=True,
+        max_read=max_read,
+        max_readahead=max_readahead,
+        attr_timeout=CACHE_TIMEOUT,
+        entry_timeout=CACHE_TIMEOUT,
+        negative_timeout=CACHE_TIMEOUT,
+        **kwargs,
+    )
@@ -1,6 +1,13 @@
 import enum
+import hashlib
+import hmac
 import io
-from typing import BinaryIO, Collection, Final, Mapping, Optional
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Collection, Dict, Final, List, Mapping, Optional, Tuple
 
 import fs.opener.registry
 from attrs import define, field
@@ -14,11 +21,22 @@ from fs.opener.errors import *
 from fs.opener.parse import ParseResult
 from fs.permissions import Permissions
 from fs.subfs import SubFS
+from fs.wrapfs import WrapFS
 
+from .faststruct import fast_struct
 from .fs import DirEntType, INode
-from .io_extras import FancyRawIOBase, FancyRawIOBaseProxy, OffsetRawIOBase
+from .io_extras import (
+    Advice,
+    FancyRawIOBase,
+    FancyRawIOBaseProxy,
+    OffsetRawIOBase,
+    copy_file_range,
+    open_path,
+    resource_stamp,
+)
+from .tar import TarFS
 
-from typing import Mapping, Optional  # isort:skip
+from typing import Mapping, Optional, Union  # isort:skip
 
 
 segid2filename = {
@@ -36,6 +54,10 @@ segid2filename = {
     0x601: "ps3swu2.self",
 }
 
+VERSION_SEGID = 0x100
+
+PUP_HEADER_HINT_SZ = 4096
+
 
 def get_seg_filename(segid):
     if segid in segid2filename:
@@ -43,6 +65,15 @@ def get_seg_filename(segid):
     return f"seg_{segid:#x}.bin"
 
 
+def get_seg_id(name: str) -> int:
+    for segid, filename in segid2filename.items():
+        if filename == name:
+            return segid
+    if name.startswith("seg_") and name.endswith(".bin"):
+        name = name[4:-4]
+    return int(name, 0)
+
+
 class SignAlgorithmEnum(enum.IntEnum):
     HMAC_SHA1 = 0
     HMAC_SHA256 = 1
@@ -86,24 +117,262 @@ PUP = Struct(
 )
 
 
+def pup_tables_size(hdr: Container) -> int:
+    """Size of the segment, digest and header digest tables following hdr."""
+    nsegs = hdr.segment_num
+    return (
+        nsegs * (PUPSegmentEntry.sizeof() + PUPDigestEntry.sizeof())
+        + PUPHeaderDigest.sizeof()
+    )
+
+
+def parse_pup_tables(hdr: Container, tables) -> Container:
+    """Decode the tables read from just after hdr into a PUP Container."""
+    seg_st, digest_st = fast_struct(PUPSegmentEntry), fast_struct(PUPDigestEntry)
+    hdr_digest_st = fast_struct(PUPHeaderDigest)
+    nsegs = hdr.segment_num
+    digests_off = nsegs * seg_st.size
+    return Container(
+        header=hdr,
+        segment_table=seg_st.parse_array(tables, nsegs),
+        digest_table=digest_st.parse_array(tables, nsegs, digests_off),
+        header_digest=hdr_digest_st.parse(tables, digests_off + nsegs * digest_st.size),
+    )
+
+
+def parse_pup(fh: FancyRawIOBase, fast: bool = True) -> Container:
+    """
+    Parse the PUP header and tables of fh. The fast path decodes the tables
+    with precomputed struct layouts and returns an equal Container.
+    """
+    # the first page holds the header and the tables of up to 63 segments,
+    # so a remote PUP is usually fetched in one batch before parsing
+    fh.advise(0, PUP_HEADER_HINT_SZ, Advice.WILLNEED)
+    if not fast:
+        with fh.seek_ctx(0):
+            return PUP.parse_stream(fh)
+    hdr_st = fast_struct(PUPHeader)
+    hdr = hdr_st.parse(fh.pread(0, hdr_st.size))
+    tables_sz = pup_tables_size(hdr)
+    fh.advise(hdr_st.size, tables_sz, Advice.WILLNEED)
+    return parse_pup_tables(hdr, fh.pread(hdr_st.size, tables_sz))
+
+
+def pup_rootfs(pup: Container) -> INode:
+    """Build the tree of segment files of a parsed PUP."""
+    rootfs = INode.root_node()
+    for seg in pup.segment_table:
+        INode(
+            name=get_seg_filename(seg.id),
+            size=seg.size,
+            type=DirEntType.REG,
+            off=seg.offset,
+            parent=rootfs,
+        )
+    return rootfs
+
+
+@define
+class PUPVerifyResult:
+    name: str
+    ok: bool
+    size: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        return self.size / self.seconds if self.seconds else float("inf")
+
+
 @define
 class PUPFile:
     fh: Final[FancyRawIOBase] = field(converter=FancyRawIOBaseProxy)
+    fast_parse: Final[bool] = True
     pup: Final[Struct] = field(init=False)
     rootfs: Final[INode] = field(init=False)
 
     def __attrs_post_init__(self):
-        with self.fh.seek_ctx(0):
-            self.pup = PUP.parse_stream(self.fh)
-        self.rootfs = INode.root_node()
-        for seg in self.pup.segment_table:
-            INode(
-                name=get_seg_filename(seg.id),
-                size=seg.size,
-                type=DirEntType.REG,
-                off=seg.offset,
-                parent=self.rootfs,
+        self.pup = parse_pup(self.fh, self.fast_parse)
+        self.rootfs = pup_rootfs(self.pup)
+
+    @property
+    def header_digest_offset(self) -> int:
+        return PUPHeader.sizeof() + (
+            PUPSegmentEntry.sizeof() + PUPDigestEntry.sizeof()
+        ) * len(self.pup.segment_table)
+
+    def _hmac(
+        self,
+        key: bytes,
+        algo: SignAlgorithmEnum,
+        offset: int,
+        size: int,
+        chunk_sz: int,
+    ) -> bytes:
+        digestmod = {
+            SignAlgorithmEnum.HMAC_SHA1: hashlib.sha1,
+            SignAlgorithmEnum.HMAC_SHA256: hashlib.sha256,
+        }[algo]
+        mac = hmac.new(key, digestmod=digestmod)
+        self.fh.advise(offset, size, Advice.SEQUENTIAL)
+        buf = memoryview(bytearray(chunk_sz))
+        done = 0
+        while done < size:
+            n = self.fh.preadinto(offset + done, buf[: min(chunk_sz, size - done)])
+            if not n:
+                raise EOFError(f"short read at {offset + done:#x}")
+            mac.update(buf[:n])
+            done += n
+        return mac.digest()
+
+    def _verify_range(
+        self,
+        name: str,
+        key: bytes,
+        algo: SignAlgorithmEnum,
+        offset: int,
+        size: int,
+        digest: bytes,
+        chunk_sz: int,
+    ) -> PUPVerifyResult:
+        t = time.perf_counter()
+        mac = self._hmac(key, algo, offset, size, chunk_sz)
+        return PUPVerifyResult(
+            name=name,
+            ok=hmac.compare_digest(mac[: len(digest)], digest),
+            size=size,
+            seconds=time.perf_counter() - t,
+        )
+
+    def verify(
+        self,
+        hmac_key: bytes,
+        jobs: Optional[int] = None,
+        chunk_sz: int = 4 * 1024 * 1024,
+    ) -> List[PUPVerifyResult]:
+        """
+        Check the header digest and every segment digest. Segments are streamed
+        chunk_sz bytes at a time and hashed in parallel on jobs threads.
+        Returns the header result followed by one result per segment.
+        """
+        digests = {d.segment_index: d.digest for d in self.pup.digest_table}
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futs = [
+                pool.submit(
+                    self._verify_range,
+                    "header",
+                    hmac_key,
+                    SignAlgorithmEnum.HMAC_SHA1,
+                    0,
+                    self.header_digest_offset,
+                    self.pup.header_digest.digest,
+                    chunk_sz,
+                )
+            ]
+            for idx, seg in enumerate(self.pup.segment_table):
+                futs.append(
+                    pool.submit(
+                        self._verify_range,
+                        get_seg_filename(seg.id),
+                        hmac_key,
+                        SignAlgorithmEnum(int(seg.sign_algorithm)),
+                        seg.offset,
+                        seg.size,
+                        digests[idx],
+                        chunk_sz,
+                    )
+                )
+            return [fut.result() for fut in futs]
+
+
+@define
+class PUPWriter:
+    """
+    Writes a PUP with the segment list of src, optionally replacing segments.
+
+    Unchanged segments keep their source digests and are copied inside the
+    kernel when src is a local file; replacement segments are HMACed while
+    they stream out. The header is written last.
+    """
+
+    src: Final[PUPFile]
+    hmac_key: Final[bytes]
+    replacements: Final[Dict[int, FancyRawIOBase]] = field(factory=dict)
+    chunk_sz: Final[int] = 4 * 1024 * 1024
+
+    def replace(self, segid: int, fh: Union[str, FancyRawIOBase]) -> None:
+        if segid not in {seg.id for seg in self.src.pup.segment_table}:
+            raise KeyError(f"no segment {segid:#x} in source PUP")
+        self.replacements[segid] = FancyRawIOBaseProxy(fh)
+
+    def _stream_replacement(
+        self, fh: FancyRawIOBase, algo: SignAlgorithmEnum, out_fd: int, out_off: int
+    ) -> bytes:
+        digestmod = {
+            SignAlgorithmEnum.HMAC_SHA1: hashlib.sha1,
+            SignAlgorithmEnum.HMAC_SHA256: hashlib.sha256,
+        }[algo]
+        mac = hmac.new(self.hmac_key, digestmod=digestmod)
+        buf = memoryview(bytearray(self.chunk_sz))
+        size = fh.sz
+        done = 0
+        while done < size:
+            n = fh.preadinto(done, buf[: min(self.chunk_sz, size - done)])
+            if not n:
+                raise EOFError(f"short read at {done:#x}")
+            mac.update(buf[:n])
+            os.pwrite(out_fd, buf[:n], out_off + done)
+            done += n
+        return mac.digest()[:20]
+
+    def write(self, out_path: str) -> Container:
+        src_pup = self.src.pup
+        nsegs = len(src_pup.segment_table)
+        header_length = (
+            PUPHeader.sizeof()
+            + (PUPSegmentEntry.sizeof() + PUPDigestEntry.sizeof()) * nsegs
+            + PUPHeaderDigest.sizeof()
+            + 12  # header digest is padded to 0x20
+        )
+        src_digests = {d.segment_index: d.digest for d in src_pup.digest_table}
+        seg_table, digest_table = [], []
+        out_fd = os.open(out_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            off = header_length
+            for idx, seg in enumerate(src_pup.segment_table):
+                algo = SignAlgorithmEnum(int(seg.sign_algorithm))
+                repl = self.replacements.get(seg.id)
+                if repl is None:
+                    size = seg.size
+                    copy_file_range(self.src.fh, seg.offset, out_fd, off, size)
+                    digest = src_digests[idx]
+                else:
+                    size = repl.sz
+                    digest = self._stream_replacement(repl, algo, out_fd, off)
+                seg_table.append(
+                    dict(id=seg.id, offset=off, size=size, sign_algorithm=int(algo))
+                )
+                digest_table.append(dict(segment_index=idx, digest=digest))
+                off += size
+            pup = dict(
+                header=dict(
+                    format_flag=src_pup.header.format_flag,
+                    package_version=src_pup.header.package_version,
+                    image_version=src_pup.header.image_version,
+                    segment_num=nsegs,
+                    header_length=header_length,
+                    data_length=off - header_length,
+                ),
+                segment_table=seg_table,
+                digest_table=digest_table,
+                header_digest=dict(digest=bytes(20)),
             )
+            signed = PUP.build(pup)[: header_length - 0x20]
+            hdr = signed + hmac.new(self.hmac_key, signed, hashlib.sha1).digest()
+            os.pwrite(out_fd, hdr + bytes(12), 0)
+        finally:
+            os.close(out_fd)
+        return PUP.parse(hdr)
 
 
 @define
@@ -112,6 +381,7 @@ class PUPFS(fs.base.FS):
     pup: Final[PUPFile] = field(init=False)
 
     def __attrs_post_init__(self):
+        super().__init__()
         self.pup = PUPFile(self.fh)
 
     def getinfo(self, path: str, namespaces: Optional[Collection[str]] = None) -> Info:
@@ -159,6 +429,175 @@ class PUPFS(fs.base.FS):
         raise NotWriteable("PUP supports only reading")
 
 
+def container_fs(fh: FancyRawIOBase) -> FS:
+    """Open fh as the read-only FS matching its magic."""
+    if fh.pread(0, 5) == b"SCEUF":
+        return PUPFS(fh)
+    if fh.pread(257, 5) == b"ustar":
+        return TarFS(fh)
+    raise CreateFailed("unknown container format")
+
+
+@define
+class _Container:
+    fs: FS
+    # the opened resource, owned by the outermost layer
+    fh: Optional[FancyRawIOBase]
+    parent: Optional["_Container"]
+    refs: int = 0
+
+    def close(self) -> None:
+        self.fs.close()
+        if self.fh is not None:
+            self.fh.close()
+
+
+class ContainerFS(WrapFS):
+    """
+    One caller's handle on a cached container. Closing it releases the
+    handle but leaves the shared layers open for other callers.
+    """
+
+    def __init__(self, cache: "ContainerCache", entry: _Container):
+        super().__init__(entry.fs)
+        self._cache = cache
+        self._entry = entry
+
+    def close(self) -> None:
+        if not self.isclosed():
+            self._cache.release(self._entry)
+        super().close()
+
+
+@define
+class ContainerCache:
+    """
+    LRU cache of opened containers, keyed by resource, its size and
+    validator, and the layers followed from it, so a replaced resource is
+    opened afresh. Every layer holds a reference on the one below it, and
+    unreferenced layers are closed when they are evicted or go stale.
+    """
+
+    maxsize: Final[int] = 64
+    misses: int = field(init=False, default=0)
+    _entries: Final[OrderedDict] = field(init=False, factory=OrderedDict)
+    _stamps: Final[Dict[str, Tuple[int, str]]] = field(init=False, factory=dict)
+    _opening: Final[Dict[tuple, Future]] = field(init=False, factory=dict)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    def open(self, resource: str, layers: Tuple[str, ...] = ()) -> ContainerFS:
+        stamp = resource_stamp(resource)
+        with self._lock:
+            self._stamps[resource] = stamp
+        entry = self._acquire((resource, stamp), layers)
+        with self._lock:
+            self._evict()
+        return ContainerFS(self, entry)
+
+    def release(self, entry: _Container) -> None:
+        with self._lock:
+            entry.refs -= 1
+            self._evict()
+
+    def clear(self) -> None:
+        """Close every container that is not in use."""
+        with self._lock:
+            self._stamps.clear()
+            self._evict()
+
+    def _acquire(self, source: Tuple[str, Tuple[int, str]], layers) -> _Container:
+        # containers are opened outside the lock, which would otherwise block
+        # every other caller on the requests and parsing; callers that want
+        # one already being opened wait for that instead
+        key = (*source, layers)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry.refs += 1
+                    return entry
+                opening = self._opening.get(key)
+                if opening is None:
+                    opening = self._opening[key] = Future()
+                    self.misses += 1
+                    break
+            # look again once it is opened, it may have been evicted since
+            opening.result()
+        try:
+            entry = self._open(source, layers)
+        except BaseException as e:
+            with self._lock:
+                del self._opening[key]
+            opening.set_exception(e)
+            raise
+        with self._lock:
+            entry.refs += 1
+            self._entries[key] = entry
+            del self._opening[key]
+        opening.set_result(None)
+        return entry
+
+    def _open(self, source: Tuple[str, Tuple[int, str]], layers) -> _Container:
+        if layers:
+            parent = self._acquire(source, layers[:-1])
+            try:
+                return _Container(
+                    container_fs(parent.fs.openbin(layers[-1])), None, parent
+                )
+            except BaseException:
+                self.release(parent)
+                raise
+        fh = open_path(source[0])
+        try:
+            return _Container(container_fs(fh), fh, None)
+        except BaseException:
+            fh.close()
+            raise
+
+    def _evict(self) -> None:
+        while True:
+            over = len(self._entries) - self.maxsize
+            for key, entry in self._entries.items():
+                if entry.refs == 0 and (over > 0 or self._stamps.get(key[0]) != key[1]):
+                    break
+            else:
+                return
+            del self._entries[key]
+            entry.close()
+            if entry.parent is not None:
+                entry.parent.refs -= 1
+
+
+container_cache = ContainerCache()
+
+
+def open_container(resource: str, layers: Tuple[str, ...] = ()) -> ContainerFS:
+    """
+    Open the container reached by following layers, a list of member paths,
+    from resource. Every layer is a view over the one below it and opened
+    layers are cached so outer containers are parsed only once. The caller
+    must close the returned handle.
+    """
+    return container_cache.open(resource, tuple(layers))
+
+
+def open_nested(fs_url: str, cwd: str = "") -> Tuple[FS, str]:
+    """
+    Split a layered URL such as
+    pup://http://host/fw.pup!/update_files.tar!/CORE_OS_PACKAGE.pkg
+    and return the innermost container and the path left inside it.
+    """
+    if fs_url.startswith("pup://"):
+        fs_url = fs_url[len("pup://") :]
+    resource, *layers = fs_url.split("!")
+    if not resource.startswith(("http://", "https://")):
+        resource = os.path.abspath(os.path.join(cwd, resource))
+    if not layers:
+        return open_container(resource), "/"
+    return open_container(resource, tuple(layers[:-1])), layers[-1]
+
+
 class PUPFSOpener(fs.opener.Opener):
     protocols = ["pup"]
 
@@ -173,4 +612,4 @@ class PUPFSOpener(fs.opener.Opener):
         if create or writeable:
             # FIXME
             raise NotWriteable("PUP supports only reading")
-        return PUPFS(parse_result.resource)
+        return open_nested(fs_url, cwd)[0]
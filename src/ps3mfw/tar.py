@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+from typing import BinaryIO, Collection, Dict, Final, List, Mapping, Optional
+
+import fs.base
+from attrs import define, field
+from construct import Mapping as ConstructMapping
+from construct import Optional as ConstructOptional
+from construct import *
+from fs.base import FS
+from fs.errors import *
+from fs.info import Info
+from fs.permissions import Permissions
+from fs.subfs import SubFS
+
+from .fs import DirEntType, INode
+from .io_extras import Advice, FancyRawIOBase, OffsetRawIOBase, as_offset_fh
+from .util import round_up
+
+from typing import Mapping, Optional  # isort:skip
+
+TAR_BLKSZ = 512
+
+TarHeader = Struct(
+    "name" / Bytes(100),
+    "mode" / Bytes(8),
+    "uid" / Bytes(8),
+    "gid" / Bytes(8),
+    "size" / Bytes(12),
+    "mtime" / Bytes(12),
+    "chksum" / Bytes(8),
+    "typeflag" / Bytes(1),
+    "linkname" / Bytes(100),
+    "magic" / Bytes(6),
+    "version" / Bytes(2),
+    "uname" / Bytes(32),
+    "gname" / Bytes(32),
+    "devmajor" / Bytes(8),
+    "devminor" / Bytes(8),
+    "prefix" / Bytes(155),
+    "pad" / Padding(12),
+)
+
+typeflag2dirent = {
+    b"\0": DirEntType.REG,
+    b"0": DirEntType.REG,
+    b"1": DirEntType.REG,  # hard link, resolved to its target's data
+    b"2": DirEntType.LNK,
+    b"5": DirEntType.DIR,
+    b"7": DirEntType.REG,
+}
+
+
+def _tar_str(buf: bytes) -> str:
+    return buf.split(b"\0", 1)[0].decode("utf-8", "surrogateescape")
+
+
+def _norm_member_path(path: str) -> str:
+    return "/".join(p for p in path.split("/") if p and p != ".")
+
+
+def _tar_int(buf: bytes) -> int:
+    if buf[0] & 0x80:
+        # GNU base-256 encoding for values that do not fit in octal
+        return int.from_bytes(buf[1:], "big")
+    buf = buf.split(b"\0", 1)[0].strip(b" ")
+    return int(buf, 8) if buf else 0
+
+
+def _parse_pax(buf: bytes) -> Dict[str, str]:
+    records = {}
+    while buf:
+        length, _, rest = buf.partition(b" ")
+        rec = rest[: int(length) - len(length) - 2]
+        key, _, val = rec.partition(b"=")
+        records[key.decode()] = val.decode("utf-8", "surrogateescape")
+        buf = buf[int(length) :]
+    return records
+
+
+@define
+class TarMember:
+    path: str
+    type: DirEntType
+    size: int
+    off: int
+    mode: int
+    mtime: int
+    linkname: str = ""
+
+
+def scan_tar(fh: FancyRawIOBase) -> List[TarMember]:
+    """
+    Walk the 512-byte headers of a tar archive, skipping over member data, so
+    only header blocks are ever read.
+    """
+    members: List[TarMember] = []
+    by_path: Dict[str, TarMember] = {}
+    size = fh.sz
+    off = 0
+    long_name = long_link = None
+    pax: Dict[str, str] = {}
+    # the walk jumps over member data, kernel readahead would only waste I/O
+    fh.advise(0, size, Advice.RANDOM)
+    try:
+        while off + TAR_BLKSZ <= size:
+            raw = fh.pread(off, TAR_BLKSZ)
+            if raw == bytes(TAR_BLKSZ):
+                break
+            hdr = TarHeader.parse(raw)
+            data_off = off + TAR_BLKSZ
+            data_sz = _tar_int(hdr.size)
+            off = data_off + round_up(data_sz, TAR_BLKSZ)
+            if hdr.typeflag in (b"L", b"K", b"x"):
+                # the record and the header it applies to are read back to back
+                fh.advise(data_off, off + TAR_BLKSZ - data_off, Advice.WILLNEED)
+            if hdr.typeflag in (b"L", b"K"):
+                val = _tar_str(fh.pread(data_off, data_sz))
+                if hdr.typeflag == b"L":
+                    long_name = val
+                else:
+                    long_link = val
+                continue
+            if hdr.typeflag == b"x":
+                pax = _parse_pax(fh.pread(data_off, data_sz))
+                continue
+            if hdr.typeflag == b"g" or hdr.typeflag not in typeflag2dirent:
+                continue
+            path = _tar_str(hdr.name)
+            if hdr.magic.startswith(b"ustar") and hdr.prefix[0]:
+                path = _tar_str(hdr.prefix) + "/" + path
+            path = pax.get("path", long_name or path)
+            linkname = pax.get("linkpath", long_link or _tar_str(hdr.linkname))
+            if "size" in pax:
+                data_sz = int(pax["size"])
+                off = data_off + round_up(data_sz, TAR_BLKSZ)
+            long_name = long_link = None
+            pax = {}
+            path = _norm_member_path(path)
+            if not path:
+                continue
+            member = TarMember(
+                path=path,
+                type=typeflag2dirent[hdr.typeflag],
+                size=data_sz,
+                off=data_off,
+                mode=_tar_int(hdr.mode),
+                mtime=_tar_int(hdr.mtime),
+                linkname=linkname,
+            )
+            if hdr.typeflag == b"1":
+                target = by_path.get(_norm_member_path(linkname))
+                if target is None:
+                    continue
+                member.size, member.off = target.size, target.off
+            members.append(member)
+            by_path[path] = member
+    finally:
+        # the member data read after the walk gets the default readahead back
+        fh.advise(0, size, Advice.NORMAL)
+    return members
+
+
+def build_tree(members: List[TarMember]) -> INode:
+    rootfs = INode.root_node()
+    dirs: Dict[str, INode] = {"": rootfs}
+
+    def get_dir(path: str) -> INode:
+        if path in dirs:
+            return dirs[path]
+        parent_path, _, name = path.rpartition("/")
+        dirs[path] = INode(name=name, type=DirEntType.DIR, parent=get_dir(parent_path))
+        return dirs[path]
+
+    for m in members:
+        parent_path, _, name = m.path.rpartition("/")
+        if m.type == DirEntType.DIR:
+            get_dir(m.path)
+        else:
+            INode(
+                name=name,
+                type=m.type,
+                size=m.size,
+                off=m.off,
+                parent=get_dir(parent_path),
+            )
+    return rootfs
+
+
+def _index_key(fh: FancyRawIOBase) -> str:
+    return f"{fh.sz}-{hashlib.sha1(fh.pread(0, TAR_BLKSZ)).hexdigest()}"
+
+
+def load_members(
+    fh: FancyRawIOBase, index_path: Optional[str] = None
+) -> List[TarMember]:
+    """
+    Scan fh, or load the member list saved at index_path if it was written
+    for the same archive (same size and first header).
+    """
+    if index_path is None:
+        return scan_tar(fh)
+    key = _index_key(fh)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["key"] == key:
+            return [
+                TarMember(**{**m, "type": DirEntType[m["type"]]})
+                for m in index["members"]
+            ]
+    except (OSError, ValueError, KeyError):
+        pass
+    members = scan_tar(fh)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "key": key,
+                "members": [
+                    {
+                        "path": m.path,
+                        "type": m.type.name,
+                        "size": m.size,
+                        "off": m.off,
+                        "mode": m.mode,
+                        "mtime": m.mtime,
+                        "linkname": m.linkname,
+                    }
+                    for m in members
+                ],
+            },
+            f,
+        )
+    os.replace(tmp_path, index_path)
+    return members
+
+
+@define
+class TarFS(fs.base.FS):
+    fh: Final[OffsetRawIOBase] = field(converter=as_offset_fh)
+    index_path: Final[Optional[str]] = None
+    members: Final[List[TarMember]] = field(init=False)
+    rootfs: Final[INode] = field(init=False)
+    # symlink targets by inode number
+    links: Final[Dict[int, str]] = field(init=False)
+
+    def __attrs_post_init__(self):
+        super().__init__()
+        self.members = load_members(self.fh, self.index_path)
+        self.rootfs = build_tree(self.members)
+        self.links = {
+            self.rootfs.lookup(m.path).ino: m.linkname
+            for m in self.members
+            if m.type == DirEntType.LNK
+        }
+
+    def getinfo(self, path: str, namespaces: Optional[Collection[str]] = None) -> Info:
+        ino = self.rootfs.lookup(path)
+        if ino is None:
+            raise ResourceNotFound(path)
+        raw_info = {
+            "basic": {"name": ino.name, "is_dir": ino.is_dir},
+            "details": {"type": ino.pyfs_type, "size": ino.size},
+        }
+        if namespaces and "link" in namespaces:
+            raw_info["link"] = {"target": self.links.get(ino.ino)}
+        return Info(raw_info)
+
+    def listdir(self, path: str) -> [str]:
+        ino = self.rootfs.lookup(path)
+        if ino is None:
+            raise ResourceNotFound(path)
+        if not ino.is_dir:
+            raise DirectoryExpected(path)
+        return [ino.name for ino in ino.children]
+
+    def makedir(
+        self,
+        path: str,
+        permissions: Optional[Permissions] = None,
+        recreate: bool = False,
+    ) -> SubFS[FS]:
+        raise NotWriteable("tar supports only reading")
+
+    def openbin(
+        self, path: str, mode: str = "r", buffering: int = -1, **kwargs
+    ) -> BinaryIO:
+        if "r" not in mode:
+            raise NotWriteable("tar only supports reading")
+        ino = self.rootfs.lookup(path)
+        if ino is None:
+            raise ResourceNotFound(path)
+        if ino.is_dir:
+            raise FileExpected(path)
+        return self.fh.subfile(ino.off, ino.size)
+
+    def remove(self, path: str) -> None:
+        raise NotWriteable("tar supports only reading")
+
+    def removedir(self, path: str) -> None:
+        raise NotWriteable("tar supports only reading")
+
+    def setinfo(self, path: str, info: Mapping[str, Mapping[str, object]]) -> None:
+        raise NotWriteable("tar supports only reading")
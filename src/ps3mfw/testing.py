@@ -0,0 +1,308 @@
+"""
+Builders for small signed PUP and SPKG images and tars and range-capable
+HTTP servers, shared by the tests and the benchmarks.
+"""
+
+import hashlib
+import hmac
+import io
+import os
+import tarfile
+import threading
+import zlib
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Mapping, Optional, Tuple
+
+from Crypto.Cipher import AES
+
+from .certfile import CertFileHeader, CertificationHeader, SegmentCertificationHeader
+from .httpd import FastRangeHTTPRequestHandler
+from .pup import PUP
+from .util import round_up
+
+TEST_HMAC_KEY = bytes(range(0x40))
+
+
+def build_test_pup(segments, key=TEST_HMAC_KEY) -> bytes:
+    nsegs = len(segments)
+    header_length = 0x30 + 0x40 * nsegs + 0x20
+    seg_table, digest_table, data = [], [], b""
+    for idx, (segid, seg_data) in enumerate(segments.items()):
+        seg_table.append(
+            dict(
+                id=segid,
+                offset=header_length + len(data),
+                size=len(seg_data),
+                sign_algorithm="HMAC_SHA1",
+            )
+        )
+        digest = hmac.new(key, seg_data, hashlib.sha1).digest()
+        digest_table.append(dict(segment_index=idx, digest=digest))
+        data += seg_data
+    hdr = dict(
+        format_flag=0,
+        package_version=1,
+        image_version=0x8000,
+        segment_num=nsegs,
+        header_length=header_length,
+        data_length=len(data),
+    )
+    raw = PUP.build(
+        dict(
+            header=hdr,
+            segment_table=seg_table,
+            digest_table=digest_table,
+            header_digest=dict(digest=bytes(20)),
+        )
+    )
+    signed = raw[: header_length - 0x20]
+    hdr_digest = hmac.new(key, signed, hashlib.sha1).digest()
+    return signed + hdr_digest + bytes(12) + data
+
+
+def build_tar(
+    files: Mapping[str, bytes],
+    mtimes: Mapping[str, int] = {},
+    symlinks: Mapping[str, str] = {},
+) -> bytes:
+    """GNU tar of files, with optional mtimes, followed by symlinks to targets."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tf:
+        for name, data in files.items():
+            ti = tarfile.TarInfo(name)
+            ti.size, ti.mtime = len(data), mtimes.get(name, 0)
+            tf.addfile(ti, io.BytesIO(data))
+        for name, target in symlinks.items():
+            ti = tarfile.TarInfo(name)
+            ti.type, ti.linkname = tarfile.SYMTYPE, target
+            tf.addfile(ti)
+    return buf.getvalue()
+
+
+TEST_ERK = bytes(range(0x20))
+TEST_RIV = bytes(range(0x10, 0x20))
+TEST_REV = 0x1C
+
+
+def _ctr(key, iv, buf, blk=0):
+    ctr0 = int.from_bytes(iv, "big") + blk
+    return AES.new(key, AES.MODE_CTR, nonce=b"", initial_value=ctr0).encrypt(buf)
+
+
+def build_test_spkg(segments):
+    """segments is a list of (data, encrypted, compressed) tuples"""
+    ext_sz = 0x40
+    root_off = 0x20 + ext_sz
+    meta_sz = 0x20 + 0x30 * len(segments) + 0x10 * 2 * len(segments)
+    file_offset = round_up(root_off + 0x40 + meta_sz, 0x80)
+    seg_keys, seg_hdrs, body = [], b"", b""
+    for i, (data, encrypted, compressed) in enumerate(segments):
+        if compressed:
+            data = zlib.compress(data)
+        key, iv = os.urandom(16), os.urandom(16)
+        seg_keys += [key, iv]
+        seg_hdrs += SegmentCertificationHeader.build(
+            dict(
+                segment_offset=file_offset + len(body),
+                segment_size=len(data),
+                segment_type=2,
+                segment_id=i,
+                sign_algorithm=2,
+                sign_idx=0,
+                enc_algorithm="AES128CTR" if encrypted else "NONE",
+                key_idx=2 * i,
+                iv_idx=2 * i + 1,
+                comp_algorithm="ZLIB" if compressed else "PLAIN",
+            )
+        )
+        body += _ctr(key, iv, data) if encrypted else data
+    meta_key, meta_iv = os.urandom(16), os.urandom(16)
+    root = AES.new(TEST_ERK, AES.MODE_CBC, TEST_RIV).encrypt(
+        meta_key + bytes(16) + meta_iv + bytes(16)
+    )
+    meta = (
+        CertificationHeader.build(
+            dict(
+                sign_offset=0,
+                sign_algorithm="ECDSA160",
+                cert_entry_num=len(segments),
+                attr_entry_num=len(seg_keys),
+                optional_header_size=0,
+            )
+        )
+        + seg_hdrs
+        + b"".join(seg_keys)
+    )
+    hdr = CertFileHeader.build(
+        dict(
+            version=2,
+            attribute=TEST_REV,
+            category="SPKG",
+            ext_header_size=ext_sz,
+            file_offset=file_offset,
+            file_size=len(body),
+        )
+    )
+    buf = hdr + bytes(ext_sz) + root + _ctr(meta_key, meta_iv, meta)
+    return buf + bytes(file_offset - len(buf)) + body
+
+
+# https://gist.github.com/shivakar/82ac5c9cb17c95500db1906600e5e1ea
+
+
+class RangeHTTPRequestHandler(SimpleHTTPRequestHandler):
+    """RangeHTTPRequestHandler is a SimpleHTTPRequestHandler
+    with HTTP 'Range' support"""
+
+    quiet: bool = True
+
+    def send_head(self):
+        """Common code for GET and HEAD commands.
+        Return value is either a file object or None
+        """
+
+        path = self.translate_path(self.path)
+        ctype = self.guess_type(path)
+
+        # Handling file location
+        ## If directory, let SimpleHTTPRequestHandler handle the request
+        if os.path.isdir(path):
+            return SimpleHTTPRequestHandler.send_head(self)
+
+        ## Handle file not found
+        if not os.path.exists(path):
+            return self.send_error(404, self.responses.get(404)[0])
+
+        ## Handle file request
+        f = open(path, "rb")
+        fs = os.fstat(f.fileno())
+        size = fs[6]
+
+        # Parse range header
+        # Range headers look like 'bytes=500-1000'
+        start, end = 0, size - 1
+        if "Range" in self.headers:
+            start, end = self.headers.get("Range").strip().strip("bytes=").split("-")
+        if start == "":
+            ## If no start, then the request is for last N bytes
+            ## e.g. bytes=-500
+            try:
+                end = int(end)
+            except ValueError as e:
+                self.send_error(400, "invalid range")
+            start = size - end
+        else:
+            try:
+                start = int(start)
+            except ValueError as e:
+                self.send_error(400, "invalid range")
+            if start >= size:
+                # If requested start is greater than filesize
+                self.send_error(416, self.responses.get(416)[0])
+            if end == "":
+                ## If only start is provided then serve till end
+                end = size - 1
+            else:
+                try:
+                    end = int(end)
+                except ValueError as e:
+                    self.send_error(400, "invalid range")
+
+        ## Correct the values of start and end
+        start = max(start, 0)
+        end = min(end, size - 1)
+        self.range = (start, end)
+        ## Setup headers and response
+        l = end - start + 1
+        if "Range" in self.headers:
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-type", ctype)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Range", "bytes %s-%s/%s" % (start, end, size))
+        self.send_header("Content-Length", str(l))
+        self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+        self.end_headers()
+
+        return f
+
+    def copyfile(self, infile, outfile):
+        """Copies data between two file objects
+        If the current request is a 'Range' request then only the requested
+        bytes are copied.
+        Otherwise, the entire file is copied using SimpleHTTPServer.copyfile
+        """
+        if not "Range" in self.headers:
+            SimpleHTTPRequestHandler.copyfile(self, infile, outfile)
+            return
+
+        start, end = self.range
+        infile.seek(start)
+        bufsize = 64 * 1024  ## 64KB
+        nbytes_left = end - start + 1
+        while nbytes_left:
+            buf = infile.read(min(bufsize, nbytes_left))
+            if not buf:
+                break
+            outfile.write(buf)
+            nbytes_left -= len(buf)
+
+    def log_request(self, code="-", size="-") -> None:
+        if self.quiet:
+            return
+        if "Range" in self.headers:
+            size += f" Range: {self.headers['Range']}"
+        super().log_request(code, size)
+
+    def log_message(self, format: str, *args) -> None:
+        if self.quiet:
+            return
+        super().log_message(format, *args)
+
+
+class _RequestLogMixin:
+    """Records the method and Range header of every request in requests."""
+
+    requests: List[Tuple[str, Optional[str]]]
+
+    def do_GET(self):
+        type(self).requests.append(("GET", self.headers.get("Range")))
+        super().do_GET()
+
+    def do_HEAD(self):
+        type(self).requests.append(("HEAD", self.headers.get("Range")))
+        super().do_HEAD()
+
+    @classmethod
+    def gets(cls) -> List[Optional[str]]:
+        """Range headers of the GET requests, None for a whole file."""
+        return [rng for command, rng in cls.requests if command == "GET"]
+
+
+class CountingRangeHTTPRequestHandler(_RequestLogMixin, RangeHTTPRequestHandler):
+    requests = []
+
+
+class CountingFastRangeHTTPRequestHandler(
+    _RequestLogMixin, FastRangeHTTPRequestHandler
+):
+    requests = []
+
+
+@contextmanager
+def http_server(
+    directory=os.getcwd(),
+    server_class=ThreadingHTTPServer,
+    handler_class=RangeHTTPRequestHandler,
+):
+    server_address = ("", 38080)
+    httpd = server_class(server_address, partial(handler_class, directory=directory))
+    try:
+        threading.Thread(target=lambda: httpd.serve_forever()).start()
+        yield
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -1,20 +1,271 @@
 import argparse
+from typing import List
 
+from rich import print as rprint
 
-def real_main(args):
-    print(f"args: {args}")
+from ..blobstore import LINK_MODES, extract_pup
+from ..catalog import Catalog
+from ..delta import Delta, apply_delta, diff_pups
+from ..io_extras import HTTPFile, InstrumentedRawIOBase, open_path
+from ..iostats import AccessTrace
+from ..keys import pup_hmac_key
+from ..pup import PUPFile, PUPWriter, get_seg_id, open_nested
+
+
+def verify_pup(pupf: PUPFile, jobs: int) -> bool:
+    results = pupf.verify(pup_hmac_key(), jobs=jobs)
+    for res in results:
+        status = "[green]OK  [/]" if res.ok else "[red]FAIL[/]"
+        rprint(
+            f"{status} {res.name:<20} {res.size:#12x} "
+            f"{res.throughput / 2**20:8.1f} MiB/s"
+        )
+    return all(res.ok for res in results)
+
+
+def write_pup(pupf: PUPFile, out_pup: str, replacements: List[str]) -> None:
+    writer = PUPWriter(pupf, pup_hmac_key())
+    for spec in replacements:
+        seg_name, _, path = spec.partition("=")
+        writer.replace(get_seg_id(seg_name), path)
+    writer.write(out_pup)
+
+
+def mount_pup(args) -> int:
+    from ..mount import mount
+
+    if args.stats or args.trace:
+        # the containers are shared through container_cache and read by
+        # FUSE after this returns, so there is no single input to instrument
+        raise SystemExit("--stats and --trace are not supported by mount")
+    container, path = open_nested(args.source)
+    try:
+        if container.isfile(path):
+            raise SystemExit(f"{path} is a file, append '!/' to mount its contents")
+        mount(
+            container.opendir(path),
+            args.mountpoint,
+            foreground=not args.background,
+            max_read=args.max_read,
+            max_readahead=args.max_readahead,
+            allow_other=args.allow_other,
+        )
+    finally:
+        container.close()
+    return 0
+
+
+def index_pups(args, instrument) -> int:
+    catalog = Catalog(args.db)
+    try:
+        results = catalog.index(
+            args.sources, jobs=args.jobs, members=args.members, wrap=instrument
+        )
+    finally:
+        catalog.close()
+    for res in results:
+        color = {"indexed": "green", "unchanged": "blue", "failed": "red"}[res.status]
+        msg = f" {res.error}" if res.error else ""
+        rprint(f"[{color}]{res.status:<9}[/] {res.source}{msg}")
+    return int(any(res.status == "failed" for res in results))
+
+
+def print_io_stats(fhs: List[InstrumentedRawIOBase]) -> None:
+    for fh in fhs:
+        rprint(f"[bold]{fh.name}[/] {fh.io_stats.summary()}")
+        if isinstance(fh.fh, HTTPFile):
+            cache = fh.fh.stats
+            rprint(
+                f"  cache hits={cache.hits} misses={cache.misses} "
+                f"evictions={cache.evictions}"
+            )
+            rprint(f"  http {fh.fh.http_stats.summary()}")
+
+
+def diff_cmd(args, open_input) -> int:
+    old_fh = open_input(args.old, "old")
+    delta = diff_pups(PUPFile(old_fh), PUPFile(open_input(args.new, "new")))
+    rprint(
+        f"copied {delta.copied / 2**20:.1f} MiB from old, "
+        f"{delta.literal / 2**20:.1f} MiB new in {len(delta.ops)} ops"
+    )
+    if args.out:
+        with open(args.out, "wb") as f:
+            f.write(delta.build())
+    if args.rebuild:
+        apply_delta(old_fh, delta, args.rebuild, pup_hmac_key())
+    return 0
+
+
+def patch_cmd(args, open_input) -> int:
+    with open(args.delta, "rb") as f:
+        delta = Delta.parse(f.read())
+    apply_delta(open_input(args.old, "old"), delta, args.out_pup, pup_hmac_key())
+    return 0
+
+
+def real_main(args) -> int:
+    trace = AccessTrace.open(args.trace) if args.trace else None
+    instrumented = []
+
+    def instrument(fh, name: str):
+        if args.stats or trace is not None:
+            fh = InstrumentedRawIOBase(fh, name=name, trace=trace)
+            instrumented.append(fh)
+        return fh
+
+    def open_input(path: str, name: str, mirrors=()):
+        return instrument(open_path(path, mirrors), name)
+
+    try:
+        return run_command(args, open_input, instrument)
+    finally:
+        if args.stats:
+            print_io_stats(instrumented)
+        if trace is not None:
+            trace.close()
+
+
+def run_command(args, open_input, instrument) -> int:
+    if args.command == "mount":
+        return mount_pup(args)
+    if args.command == "index":
+        return index_pups(args, instrument)
+    if args.command == "diff":
+        return diff_cmd(args, open_input)
+    if args.command == "patch":
+        return patch_cmd(args, open_input)
+    if args.in_pup is None:
+        if args.verify or args.out_pup or args.out_dir:
+            raise SystemExit("--verify, --out-pup and --out-dir need --in-pup")
+        return 0
+    pupf = PUPFile(open_input(args.in_pup, "in_pup", args.mirror))
+    if args.verify and not verify_pup(pupf, args.jobs):
+        return 1
+    if args.out_pup:
+        write_pup(pupf, args.out_pup, args.replace)
+    if args.out_dir:
+        stats = extract_pup(
+            pupf, args.out_dir, mode=args.link, keep_tars=args.keep_tars
+        )
+        rprint(
+            f"wrote {stats.written / 2**20:.1f} MiB, "
+            f"reused {stats.reused / 2**20:.1f} MiB"
+        )
+    return 0
 
 
 def main():
     parser = argparse.ArgumentParser(description="ps3mfw")
     parser.add_argument(
-        "--in-pup", type=str, help="Input PUP FW file", metavar="IN_PUP"
+        "--in-pup", type=str, help="Input PUP FW file or URL", metavar="IN_PUP"
+    )
+    parser.add_argument(
+        "--mirror",
+        action="append",
+        default=[],
+        help="Another URL of the --in-pup URL's content, may be repeated",
+        metavar="URL",
     )
     parser.add_argument(
         "--out-pup", type=str, help="Output PUP FW file", metavar="OUT_PUP"
     )
     parser.add_argument(
-        "--out-dir", type=str, help="Output directory", metavar="OUT_DIR"
+        "--out-dir",
+        type=str,
+        help="Extract into a content-addressed store with a tree per version",
+        metavar="OUT_DIR",
     )
-    real_main(parser.parse_args())
-    return 0
+    parser.add_argument(
+        "--link",
+        choices=LINK_MODES,
+        default="hardlink",
+        help="How --out-dir trees refer to stored contents",
+    )
+    parser.add_argument(
+        "--keep-tars",
+        action="store_true",
+        help="Also store tar segments whole in --out-dir, not only their members",
+    )
+    parser.add_argument(
+        "--replace",
+        action="append",
+        default=[],
+        help="Replace a segment in --out-pup, e.g. vsh.tar=./vsh.tar",
+        metavar="SEG=FILE",
+    )
+    parser.add_argument(
+        "--verify", action="store_true", help="Verify input PUP header and digests"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="Worker threads", metavar="N"
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print read, seek, cache and HTTP request statistics",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write every read of the input PUPs to this file, "
+        "for benchmarks/replay.py",
+        metavar="TRACE",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    mount_parser = subparsers.add_parser(
+        "mount", help="Mount a PUP or a container nested in it with FUSE"
+    )
+    mount_parser.add_argument(
+        "source",
+        help="PUP file or URL, optionally with nested containers and a "
+        "directory in the innermost, e.g. fw.pup!/update_files.tar!/dev_flash",
+    )
+    mount_parser.add_argument("mountpoint")
+    mount_parser.add_argument(
+        "--background", action="store_true", help="Daemonize after mounting"
+    )
+    mount_parser.add_argument(
+        "--max-read", type=int, default=1024 * 1024, help="FUSE max_read in bytes"
+    )
+    mount_parser.add_argument(
+        "--max-readahead",
+        type=int,
+        default=4 * 1024 * 1024,
+        help="Kernel readahead in bytes",
+    )
+    mount_parser.add_argument(
+        "--allow-other", action="store_true", help="Let other users see the mount"
+    )
+    index_parser = subparsers.add_parser(
+        "index", help="Index PUP headers and tables into a SQLite catalog"
+    )
+    index_parser.add_argument("sources", nargs="+", help="PUP files or URLs")
+    index_parser.add_argument(
+        "--db", default="ps3mfw-catalog.sqlite", help="Catalog database path"
+    )
+    index_parser.add_argument(
+        "--members", action="store_true", help="Also list the members of tar segments"
+    )
+    index_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=argparse.SUPPRESS,
+        help="Sources scanned in parallel",
+        metavar="N",
+    )
+    diff_parser = subparsers.add_parser(
+        "diff", help="Build a delta that rebuilds NEW from a local OLD PUP"
+    )
+    diff_parser.add_argument("old", help="Old PUP file")
+    diff_parser.add_argument("new", help="New PUP file or URL")
+    diff_parser.add_argument("-o", "--out", help="Write the delta to this file")
+    diff_parser.add_argument(
+        "--rebuild", help="Also write the new PUP to this file", metavar="OUT_PUP"
+    )
+    patch_parser = subparsers.add_parser(
+        "patch", help="Apply a delta from 'diff' to the old PUP"
+    )
+    patch_parser.add_argument("old", help="Old PUP file")
+    patch_parser.add_argument("delta", help="Delta file")
+    patch_parser.add_argument("out_pup", help="New PUP to write")
+    return real_main(parser.parse_args())
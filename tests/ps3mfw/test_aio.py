@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+
+from ps3mfw.aio import AsyncHTTPFile, AsyncPUPFile, client_session
+from ps3mfw.httpd import FastRangeHTTPServer
+from ps3mfw.io_extras import FancyRawIOBaseProxy
+from ps3mfw.pup import parse_pup
+from ps3mfw.testing import (
+    CountingFastRangeHTTPRequestHandler,
+    CountingRangeHTTPRequestHandler,
+    build_test_pup,
+    http_server,
+)
+
+from .test_httpd import fast_server
+
+URL = "http://localhost:38080"
+
+
+class SlowHandler(CountingFastRangeHTTPRequestHandler):
+    def do_GET(self):
+        if not self.headers.get("Range", "").startswith("bytes=0-"):
+            time.sleep(0.3)
+        super().do_GET()
+
+
+class OneBlockHandler(CountingRangeHTTPRequestHandler):
+    """Answers every range request with at most its first 4096 bytes."""
+
+    star = False
+
+    def send_head(self):
+        first, _, last = self.headers.get("Range", "").partition("=")[2].partition("-")
+        if first and last and int(last) - int(first) >= 4096:
+            self.headers.replace_header("Range", f"bytes={first}-{int(first) + 4095}")
+        return super().send_head()
+
+    def send_header(self, keyword, value):
+        if keyword == "Content-Range" and self.star:
+            # complete length unknown
+            value = value.rpartition("/")[0] + "/*"
+        super().send_header(keyword, value)
+
+
+def test_async_http_file(tmp_path):
+    blob = os.urandom(10 * 4096 + 123)
+    (tmp_path / "blob.bin").write_bytes(blob)
+
+    async def run():
+        async with client_session(limit=4) as ses:
+            f = await AsyncHTTPFile.open(f"{URL}/blob.bin", ses, blksz=4096)
+            assert f.sz == len(blob)
+            # overlapping concurrent reads share their block fetches
+            reads = [f.pread(off, 5000) for off in range(0, len(blob), 1000)]
+            for off, buf in zip(
+                range(0, len(blob), 1000), await asyncio.gather(*reads)
+            ):
+                assert buf == blob[off : off + 5000]
+            assert f.stats.misses == 11
+            f.seek(-200, os.SEEK_END)
+            assert await f.read() == blob[-200:]
+            await f.close()
+
+    with fast_server(tmp_path):
+        asyncio.run(run())
+
+
+def test_async_pup_open(tmp_path):
+    segments = {0x100: b"4.89\n", 0x300: os.urandom(300 * 1024)}
+    (tmp_path / "test.pup").write_bytes(build_test_pup(segments))
+    pup = parse_pup(FancyRawIOBaseProxy(str(tmp_path / "test.pup")))
+
+    async def run():
+        async with client_session(limit=8) as ses:
+            pups = await asyncio.gather(
+                *(AsyncPUPFile.open(f"{URL}/test.pup", ses) for _ in range(200))
+            )
+            for p in pups:
+                assert p.pup == pup
+            assert await pups[0].read("version.txt") == b"4.89\n"
+            assert await pups[0].read("update_files.tar", 290 * 1024, 10) == (
+                segments[0x300][290 * 1024 : 290 * 1024 + 10]
+            )
+            for p in pups:
+                await p.close()
+
+    CountingFastRangeHTTPRequestHandler.requests = []
+    with http_server(
+        directory=tmp_path,
+        server_class=FastRangeHTTPServer,
+        handler_class=CountingFastRangeHTTPRequestHandler,
+    ):
+        asyncio.run(run())
+    # one request per PUP for the header and tables, one past the first block
+    assert len(CountingFastRangeHTTPRequestHandler.gets()) == 200 + 1
+
+
+def test_async_cancelled_reader(tmp_path):
+    blob = os.urandom(4 * 4096)
+    (tmp_path / "blob.bin").write_bytes(blob)
+
+    async def run():
+        async with client_session() as ses:
+            f = await AsyncHTTPFile.open(f"{URL}/blob.bin", ses, blksz=4096)
+            other = asyncio.ensure_future(f.pread(8192, 100))
+            # the first reader gives up while the shared fetch is in flight
+            try:
+                await asyncio.wait_for(f.pread(8192, 10), 0.05)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                raise AssertionError("read did not time out")
+            assert await other == blob[8192 : 8192 + 100]
+            await f.close()
+
+    SlowHandler.requests = []
+    with http_server(
+        directory=tmp_path,
+        server_class=FastRangeHTTPServer,
+        handler_class=SlowHandler,
+    ):
+        asyncio.run(run())
+    assert len(SlowHandler.gets()) == 2
+
+
+def test_async_short_ranges(tmp_path):
+    blob = os.urandom(6 * 4096 + 5)
+    (tmp_path / "blob.bin").write_bytes(blob)
+
+    async def run():
+        async with client_session() as ses:
+            f = await AsyncHTTPFile.open(f"{URL}/blob.bin", ses, blksz=4096)
+            assert f.sz == len(blob)
+            # the rest of a short 206 is requested again, not left as zeros
+            assert await f.pread(4096, 3 * 4096) == blob[4096 : 4 * 4096]
+            await f.close()
+
+    with http_server(directory=tmp_path, handler_class=OneBlockHandler):
+        OneBlockHandler.requests = []
+        asyncio.run(run())
+        assert len(OneBlockHandler.gets()) == 4
+        OneBlockHandler.star = True
+        try:
+            asyncio.run(run())
+        finally:
+            OneBlockHandler.star = False
@@ -0,0 +1,113 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from ps3mfw.blobstore import extract_pup
+from ps3mfw.io_extras import FancyRawIOBaseProxy
+from ps3mfw.pup import PUPFile
+from ps3mfw.testing import build_tar, build_test_pup
+
+SYMLINKS = {"dev_flash/sym": "vsh"}
+
+
+def test_extract_pup_dedup(tmp_path):
+    a, b, swu = os.urandom(8192), os.urandom(4096), os.urandom(10000)
+    files = {"dev_flash/vsh/a.sprx": a, "dev_flash/vsh/b.sprx": b}
+    old = {0x100: b"4.88\n", 0x200: swu, 0x300: build_tar(files, symlinks=SYMLINKS)}
+    new_b = os.urandom(4096)
+    new = {
+        0x100: b"4.89\n",
+        0x200: swu,
+        0x300: build_tar(
+            {**files, "dev_flash/vsh/b.sprx": new_b},
+            {"dev_flash/vsh/b.sprx": 5678},
+            SYMLINKS,
+        ),
+    }
+    for name, segs in (("old.pup", old), ("new.pup", new)):
+        (tmp_path / name).write_bytes(build_test_pup(segs))
+    out = tmp_path / "out"
+
+    stats = extract_pup(
+        PUPFile(FancyRawIOBaseProxy(str(tmp_path / "old.pup"))), str(out)
+    )
+    assert stats.reused == 0
+    stats = extract_pup(
+        PUPFile(FancyRawIOBaseProxy(str(tmp_path / "new.pup"))), str(out)
+    )
+    # only version.txt and the changed member, the tar segment is not stored
+    assert stats.written == len(b"4.89\n") + len(new_b)
+
+    old_tree, new_tree = out / "versions" / "4.88", out / "versions" / "4.89"
+    assert (new_tree / "update_files" / "dev_flash/vsh/b.sprx").read_bytes() == new_b
+    assert (old_tree / "update_files" / "dev_flash/vsh/b.sprx").read_bytes() == b
+    assert os.readlink(new_tree / "update_files" / "dev_flash/sym") == "vsh"
+    assert (new_tree / "ps3swu.self").stat().st_ino == (
+        old_tree / "ps3swu.self"
+    ).stat().st_ino
+    assert (new_tree / "update_files" / "dev_flash/vsh/a.sprx").stat().st_ino == (
+        old_tree / "update_files" / "dev_flash/vsh/a.sprx"
+    ).stat().st_ino
+
+    # a repeated extraction reuses everything
+    stats = extract_pup(
+        PUPFile(FancyRawIOBaseProxy(str(tmp_path / "new.pup"))), str(out)
+    )
+    assert stats.written == 0
+    assert not (new_tree / "update_files.tar").exists()
+
+    # whole tar segments are only stored when asked for
+    stats = extract_pup(
+        PUPFile(FancyRawIOBaseProxy(str(tmp_path / "new.pup"))),
+        str(out),
+        keep_tars=True,
+    )
+    assert stats.written == len(new[0x300])
+    assert (new_tree / "update_files.tar").read_bytes() == new[0x300]
+    assert (new_tree / "update_files" / "dev_flash/vsh/b.sprx").read_bytes() == new_b
+
+
+@pytest.mark.parametrize("version", [".", "..", ""])
+def test_extract_pup_bad_version(tmp_path, version):
+    (tmp_path / "a.pup").write_bytes(build_test_pup({0x100: f"{version}\n".encode()}))
+    with pytest.raises(ValueError):
+        extract_pup(
+            PUPFile(FancyRawIOBaseProxy(str(tmp_path / "a.pup"))), str(tmp_path / "out")
+        )
+    assert not (tmp_path / "out" / "versions").exists()
+
+
+def _evil_pup(members) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tf:
+        for name, target in members:
+            ti = tarfile.TarInfo(name)
+            if target is not None:
+                ti.type, ti.linkname = tarfile.SYMTYPE, target
+                tf.addfile(ti)
+            else:
+                ti.size = 4
+                tf.addfile(ti, io.BytesIO(b"evil"))
+    return build_test_pup({0x100: b"1\n", 0x300: buf.getvalue()})
+
+
+def test_extract_pup_symlink_escape(tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    out = tmp_path / "out"
+    tree = out / "versions" / "1" / "update_files"
+    link = ("x", str(outside))
+    # a symlink followed by members beneath it in the same tar
+    (tmp_path / "a.pup").write_bytes(_evil_pup([link, ("x/evil", None)]))
+    extract_pup(PUPFile(FancyRawIOBaseProxy(str(tmp_path / "a.pup"))), str(out))
+    assert (tree / "x" / "evil").read_bytes() == b"evil"
+    assert not (tree / "x").is_symlink()
+    # a symlink left in the tree by an earlier extraction of the version
+    (tmp_path / "b.pup").write_bytes(_evil_pup([("y", str(outside))]))
+    extract_pup(PUPFile(FancyRawIOBaseProxy(str(tmp_path / "b.pup"))), str(out))
+    assert os.readlink(tree / "y") == str(outside)
+    (tmp_path / "c.pup").write_bytes(_evil_pup([("y/evil", None), ("y/d/e", None)]))
+    extract_pup(PUPFile(FancyRawIOBaseProxy(str(tmp_path / "c.pup"))), str(out))
+    assert list(outside.iterdir()) == []
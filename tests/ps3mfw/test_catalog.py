@@ -0,0 +1,75 @@
+import hashlib
+import hmac
+import os
+
+from ps3mfw.catalog import Catalog
+from ps3mfw.httpd import FastRangeHTTPServer
+from ps3mfw.io_extras import InstrumentedRawIOBase
+from ps3mfw.testing import (
+    TEST_HMAC_KEY,
+    CountingFastRangeHTTPRequestHandler,
+    build_tar,
+    build_test_pup,
+    http_server,
+)
+
+from .test_httpd import fast_server
+
+
+def test_catalog_index(tmp_path):
+    shared = os.urandom(4096)
+    tar = build_tar({"dev_flash/vsh/module/a.sprx": shared})
+    for i, version in enumerate(("4.88", "4.89")):
+        segments = {0x100: f"{version}\n".encode(), 0x300: tar, 0x200 + i: shared}
+        (tmp_path / f"{version}.pup").write_bytes(build_test_pup(segments))
+    db = str(tmp_path / "catalog.sqlite")
+    sources = [str(tmp_path / "4.88.pup"), "http://localhost:38080/4.89.pup"]
+
+    catalog = Catalog(db)
+    with fast_server(tmp_path):
+        results = catalog.index(sources, jobs=2, members=True)
+    assert sorted(r.status for r in results) == ["indexed", "indexed"]
+    digest = hmac.new(TEST_HMAC_KEY, shared, hashlib.sha1).digest()
+    assert catalog.find_digest(digest) == [
+        (sources[0], "ps3swu.self"),
+        (sources[1], "vsh.tar"),
+    ]
+    hits = catalog.find_member("dev_flash/vsh/module/a.sprx")
+    assert sorted(hits) == sorted(
+        (src, "update_files.tar", len(shared)) for src in sources
+    )
+    versions = dict(catalog._db.execute("SELECT source, version FROM sources"))
+    assert versions == {sources[0]: "4.88", sources[1]: "4.89"}
+    catalog.close()
+
+    # the reads of a scan can be instrumented, as for --stats and --trace
+    wrapped = []
+
+    def wrap(fh, source):
+        wrapped.append(InstrumentedRawIOBase(fh, name=source))
+        return wrapped[-1]
+
+    catalog = Catalog(str(tmp_path / "wrapped.sqlite"))
+    catalog.index(sources[:1], wrap=wrap)
+    catalog.close()
+    assert [fh.name for fh in wrapped] == sources[:1]
+    assert wrapped[0].io_stats.reads > 0
+
+    # re-runs only rescan what changed
+    (tmp_path / "4.88.pup").write_bytes(build_test_pup({0x100: b"4.90\n"}))
+    catalog = Catalog(db)
+    CountingFastRangeHTTPRequestHandler.requests = []
+    with http_server(
+        directory=tmp_path,
+        server_class=FastRangeHTTPServer,
+        handler_class=CountingFastRangeHTTPRequestHandler,
+    ):
+        results = catalog.index(sources, members=True)
+    # an unchanged URL costs a single HEAD
+    assert CountingFastRangeHTTPRequestHandler.requests == [("HEAD", None)]
+    status = {r.source: r.status for r in results}
+    assert status == {sources[0]: "indexed", sources[1]: "unchanged"}
+    assert catalog.find_member("dev_flash/vsh/module/a.sprx") == [
+        (sources[1], "update_files.tar", len(shared))
+    ]
+    catalog.close()
@@ -1,14 +1,23 @@
 import importlib.resources
+import io
+import os
 from contextlib import nullcontext
 from pathlib import Path
 
 import pytest
+import yaml
 
-from ps3mfw.certfile import CertFile
-from ps3mfw.io_extras import HTTPFile
+from ps3mfw.certfile import CertFile, CertifiedFile
+from ps3mfw.io_extras import FancyRawIOBase, HTTPFile
+from ps3mfw.keys import load_keystore
 from ps3mfw.pup import PUPFS
-
-from .http_ranges_server import http_server
+from ps3mfw.testing import (
+    TEST_ERK,
+    TEST_REV,
+    TEST_RIV,
+    build_test_spkg,
+    http_server,
+)
 
 CWD = Path(__file__).parent
 
@@ -35,3 +44,55 @@ def test_certfile_default_spp():
     sppfh = open(spp_path, "rb")
     spp = CertFile.parse_stream(sppfh)
     print(spp)
+
+
+class CountingBytesIO(io.BytesIO, FancyRawIOBase):
+    nread = 0
+
+    def preadinto(self, offset, b):
+        n = super().preadinto(offset, b)
+        self.nread += n
+        return n
+
+
+def test_certfile_spkg_decrypt(tmp_path):
+    (tmp_path / "keys.yaml").write_text(
+        yaml.safe_dump(
+            [
+                dict(
+                    name="spkg-test",
+                    category="SPKG",
+                    revision=TEST_REV,
+                    erk=TEST_ERK.hex(),
+                    riv=TEST_RIV.hex(),
+                )
+            ]
+        )
+    )
+    keystore = load_keystore(str(tmp_path / "keys.yaml"))
+    big = os.urandom(4 * 1024 * 1024 + 7)
+    plain = os.urandom(1000)
+    text = b"".join(b"line %d\n" % i for i in range(200_000))
+    fh = CountingBytesIO(
+        build_test_spkg([(big, True, False), (plain, False, False), (text, True, True)])
+    )
+    cf = CertifiedFile(fh, keystore=keystore, cache_dir=str(tmp_path / "cache"))
+    assert [str(s.enc_algorithm) for s in cf.segments] == [
+        "AES128CTR",
+        "NONE",
+        "AES128CTR",
+    ]
+
+    # random access only decrypts the blocks it touches
+    seg = cf.segment(0)
+    fh.nread = 0
+    assert seg.pread(2 * 1024 * 1024 + 5, 20) == big[2 * 1024 * 1024 + 5 :][:20]
+    assert fh.nread <= 48
+    seg.seek(-3, io.SEEK_END)
+    assert seg.read() == big[-3:]
+    assert cf.segment(1).read() == plain
+    assert cf.segment(2).pread(len(text) - 12, 12) == text[-12:]
+
+    paths = cf.extract(str(tmp_path / "out"), jobs=2)
+    assert [Path(p).read_bytes() for p in paths] == [big, plain, text]
+    assert len(list((tmp_path / "cache").glob("*.zidx"))) == 1
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from ps3mfw.delta import Delta, apply_delta, diff_pups
+from ps3mfw.io_extras import FancyRawIOBaseProxy, HTTPFile
+from ps3mfw.pup import PUPFile
+from ps3mfw.testing import TEST_HMAC_KEY, build_tar, build_test_pup, http_server
+
+
+def test_diff_pups(tmp_path):
+    a, b, swu = os.urandom(512 * 1024), os.urandom(4096), os.urandom(300 * 1024)
+    flags = bytearray(os.urandom(256 * 1024))
+    old_files = {"dev_flash/a.sprx": a, "dev_flash/b.sprx": b}
+    new_b = os.urandom(4096)
+    new_tar = build_tar(
+        {**old_files, "dev_flash/b.sprx": new_b}, {"dev_flash/b.sprx": 2}
+    )
+    old = {
+        0x100: b"4.88\n",
+        0x103: bytes(flags),
+        0x200: swu,
+        0x300: build_tar(old_files),
+    }
+    flags[1000:1004] = b"\0\1\2\3"
+    new = {0x100: b"4.89\n", 0x103: bytes(flags), 0x200: swu, 0x300: new_tar}
+    new_pup = build_test_pup(new)
+    (tmp_path / "old.pup").write_bytes(build_test_pup(old))
+    (tmp_path / "new.pup").write_bytes(new_pup)
+
+    old_fh = FancyRawIOBaseProxy(str(tmp_path / "old.pup"))
+    with http_server(tmp_path):
+        new_fh = HTTPFile("http://localhost:38080/new.pup", blksz=16 * 1024)
+        delta = diff_pups(PUPFile(old_fh), PUPFile(new_fh), blksz=16 * 1024)
+        # neither the unchanged segment nor the unchanged member was fetched
+        assert new_fh.stats.misses * new_fh.blksz < len(a)
+    assert delta.copied >= len(swu) + len(a) + len(flags) - 16 * 1024
+    assert delta.literal < 64 * 1024
+
+    delta = Delta.parse(delta.build())
+    apply_delta(old_fh, delta, str(tmp_path / "rebuilt.pup"), TEST_HMAC_KEY)
+    assert (tmp_path / "rebuilt.pup").read_bytes() == new_pup
+
+    # an old PUP of the same size with other contents is refused
+    (tmp_path / "other.pup").write_bytes(build_test_pup({**old, 0x100: b"4.87\n"}))
+    other_fh = FancyRawIOBaseProxy(str(tmp_path / "other.pup"))
+    assert other_fh.sz == old_fh.sz
+    with pytest.raises(ValueError):
+        apply_delta(other_fh, delta, str(tmp_path / "bad.pup"), TEST_HMAC_KEY)
+    # a rebuilt PUP that fails verification is not left behind
+    op = next(op for op in delta.ops if op.data is not None and op.new_off > 0x1000)
+    op.data = bytes(len(op.data))
+    with pytest.raises(ValueError, match="verification"):
+        apply_delta(old_fh, delta, str(tmp_path / "bad.pup"), TEST_HMAC_KEY)
+    assert sorted(os.listdir(tmp_path)) == [
+        "new.pup",
+        "old.pup",
+        "other.pup",
+        "rebuilt.pup",
+    ]
@@ -0,0 +1,52 @@
+import pytest
+from construct import ConstError, StreamError
+
+from ps3mfw.certfile import CertFileHeader, SegmentCertificationHeader
+from ps3mfw.faststruct import fast_struct
+from ps3mfw.io_extras import FancyRawIOBaseProxy
+from ps3mfw.pup import PUPFile, parse_pup
+from ps3mfw.testing import build_test_pup
+
+
+def test_fast_parse_pup_matches(tmp_path):
+    segments = {0x100 + i: bytes([i]) * (i + 1) for i in range(12)}
+    (tmp_path / "test.pup").write_bytes(build_test_pup(segments))
+    fh = FancyRawIOBaseProxy(str(tmp_path / "test.pup"))
+    assert parse_pup(fh, fast=True) == parse_pup(fh, fast=False)
+    pupf = PUPFile(fh)
+    assert pupf.pup.segment_table[3].sign_algorithm == "HMAC_SHA1"
+    assert pupf.pup.segment_table[3].sign_algorithm.intvalue == 0
+
+
+def test_fast_parse_certfile_structs():
+    hdr = CertFileHeader.build(
+        dict(
+            version=2,
+            attribute=0x1C,
+            category="SELF",
+            ext_header_size=0x40,
+            file_offset=0x400,
+            file_size=0x1234,
+        )
+    )
+    assert fast_struct(CertFileHeader).parse(hdr) == CertFileHeader.parse(hdr)
+    with pytest.raises(ConstError):
+        fast_struct(CertFileHeader).parse(b"ELF\0" + hdr[4:])
+    with pytest.raises(StreamError):
+        fast_struct(CertFileHeader).parse(hdr[:-1])
+
+    seg = dict(
+        segment_offset=0x400,
+        segment_size=0x100,
+        segment_type=2,
+        segment_id=0,
+        sign_algorithm=2,
+        sign_idx=0,
+        enc_algorithm="AES128CTR",
+        key_idx=0,
+        iv_idx=1,
+        comp_algorithm="ZLIB",
+    )
+    segs = SegmentCertificationHeader.build(seg) * 3
+    fast = fast_struct(SegmentCertificationHeader).parse_array(segs, 3)
+    assert fast == [SegmentCertificationHeader.parse(segs)] * 3
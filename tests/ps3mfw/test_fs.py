@@ -0,0 +1,49 @@
+from ps3mfw.fs import DirEntType, INode
+from ps3mfw.io_extras import FancyRawIOBaseProxy, OffsetRawIOBase
+from ps3mfw.tar import build_tree, scan_tar
+
+from .test_tar import FILES, PAD, build_test_tar
+
+
+def _tree():
+    root = INode.root_node()
+    dev_flash = INode(name="dev_flash", type=DirEntType.DIR, parent=root)
+    vsh = INode(name="vsh", type=DirEntType.DIR, parent=dev_flash)
+    sprx = INode(name="a.sprx", type=DirEntType.REG, size=3, parent=vsh)
+    return root, dev_flash, vsh, sprx
+
+
+def test_inode_lookup():
+    root, dev_flash, vsh, sprx = _tree()
+    assert root.lookup("/dev_flash/vsh/a.sprx") is sprx
+    assert root.lookup("dev_flash/vsh/a.sprx") is sprx
+    assert vsh.lookup("a.sprx") is sprx
+    # absolute paths start at the root wherever they are looked up from
+    assert sprx.lookup("/dev_flash") is dev_flash
+    assert vsh.lookup("../vsh/./a.sprx") is sprx
+    assert root.lookup("..") is root
+    assert root.lookup("/") is root and root.lookup("") is root
+
+    # trailing and repeated slashes are ignored
+    assert root.lookup("/dev_flash/vsh/") is vsh
+    assert root.lookup("//dev_flash//vsh") is vsh
+
+    assert root.lookup("/dev_flash/missing") is None
+    assert root.lookup("/missing/vsh") is None
+    # files have no children
+    assert root.lookup("/dev_flash/vsh/a.sprx/x") is None
+
+
+def test_inode_ino_unique(tmp_path):
+    tar_sz = build_test_tar(tmp_path / "seg.bin", FILES)
+    seg = OffsetRawIOBase(
+        FancyRawIOBaseProxy(str(tmp_path / "seg.bin")), off=PAD, sz=tar_sz
+    )
+    root = build_tree(scan_tar(seg))
+    inos = [node.ino for _, node in root.walk()]
+    assert len(inos) == len(set(inos))
+    assert root.ino == 0 and root.lookup("/dev_flash/vsh/module/a.sprx").ino > 0
+
+    # inode numbers are per tree
+    other = _tree()[0]
+    assert sorted(node.ino for _, node in other.walk()) == [0, 1, 2, 3]
@@ -0,0 +1,113 @@
+import http.client
+import io
+import os
+import tarfile
+import time
+
+from ps3mfw.httpd import FastRangeHTTPRequestHandler, FastRangeHTTPServer, parse_ranges
+from ps3mfw.io_extras import HTTPFile
+from ps3mfw.testing import build_test_pup, http_server
+
+
+def fast_server(directory):
+    return http_server(
+        directory=directory,
+        server_class=FastRangeHTTPServer,
+        handler_class=FastRangeHTTPRequestHandler,
+    )
+
+
+def test_parse_ranges():
+    assert parse_ranges("bytes=0-9,20-,-5", 100) == [(0, 9), (20, 99), (95, 99)]
+    assert parse_ranges("bytes=200-300", 100) == []
+    assert parse_ranges("bytes=9-0", 100) is None
+    assert parse_ranges("lines=1-2", 100) is None
+
+
+def test_fast_range_server(tmp_path):
+    blob = os.urandom(300 * 1024 + 17)
+    (tmp_path / "blob.bin").write_bytes(blob)
+    with fast_server(tmp_path):
+        conn = http.client.HTTPConnection("localhost", 38080)
+        conn.request("GET", "/blob.bin", headers={"Range": "bytes=10-19"})
+        r = conn.getresponse()
+        assert r.status == 206 and r.read() == blob[10:20]
+        etag = r.headers["ETag"]
+        sock = conn.sock
+
+        # same connection, multiple ranges
+        conn.request("GET", "/blob.bin", headers={"Range": "bytes=0-3,-4"})
+        r = conn.getresponse()
+        assert r.status == 206
+        assert r.headers["Content-Type"].startswith("multipart/byteranges")
+        body = r.read()
+        assert blob[:4] in body and blob[-4:] in body
+        assert conn.sock is sock
+
+        conn.request("GET", "/blob.bin", headers={"If-None-Match": etag})
+        r = conn.getresponse()
+        assert r.status == 304 and r.read() == b""
+
+        # a stale If-Range gets the whole file
+        headers = {"Range": "bytes=0-3", "If-Range": '"stale"'}
+        conn.request("GET", "/blob.bin", headers=headers)
+        r = conn.getresponse()
+        assert r.status == 200 and r.read() == blob
+        conn.request("GET", "/blob.bin", headers={**headers, "If-Range": etag})
+        r = conn.getresponse()
+        assert r.status == 206 and r.read() == blob[:4]
+
+        conn.request("GET", "/blob.bin", headers={"Range": "bytes=999999-"})
+        r = conn.getresponse()
+        assert r.status == 416
+        r.read()
+        conn.close()
+
+        fh = HTTPFile("http://localhost:38080/blob.bin", blksz=4096, multi_range=True)
+        assert fh.pread(5000, 100) == blob[5000:5100]
+        assert fh.pread(200 * 1024, 64 * 1024) == blob[200 * 1024 : 264 * 1024]
+        # block 1 is cached, blocks 0 and 2 come in one multipart/byteranges
+        nreqs = fh.http_stats.requests
+        assert fh.pread(0, 3 * 4096) == blob[: 3 * 4096]
+        assert fh.http_stats.requests == nreqs + 1
+
+
+def test_fast_range_server_slow_reader(tmp_path):
+    blob = os.urandom(64 * 2**20)
+    (tmp_path / "big.bin").write_bytes(blob)
+    with fast_server(tmp_path):
+        conn = http.client.HTTPConnection("localhost", 38080)
+        conn.request("GET", "/big.bin")
+        r = conn.getresponse()
+        # let the socket buffers fill so sendfile has to wait for the reader
+        time.sleep(0.5)
+        body = b""
+        while chunk := r.read(2**20):
+            body += chunk
+        assert body == blob
+        conn.close()
+
+
+def test_fast_range_server_pup_segments(tmp_path):
+    member = os.urandom(10_000)
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tf:
+        ti = tarfile.TarInfo("dev_flash/vsh/module/a.sprx")
+        ti.size = len(member)
+        tf.addfile(ti, io.BytesIO(member))
+    vsh = os.urandom(50_000)
+    segments = {0x100: b"4.90\n", 0x201: vsh, 0x300: buf.getvalue()}
+    (tmp_path / "fw.pup").write_bytes(build_test_pup(segments))
+    with fast_server(tmp_path):
+        fh = HTTPFile("http://localhost:38080/fw.pup/vsh.tar", blksz=4096)
+        assert fh.sz == len(vsh)
+        assert fh.pread(1000, 5000) == vsh[1000:6000]
+        url = (
+            "http://localhost:38080/fw.pup/update_files.tar/dev_flash/vsh/module/a.sprx"
+        )
+        assert HTTPFile(url).read() == member
+
+        conn = http.client.HTTPConnection("localhost", 38080)
+        conn.request("GET", "/fw.pup/missing.bin")
+        assert conn.getresponse().status == 404
+        conn.close()
@@ -0,0 +1,57 @@
+import os
+import random
+import subprocess
+import sys
+import zlib
+
+from ps3mfw.inflate import InflateRawIOBase
+
+
+def make_text(nwords):
+    rnd = random.Random(0)
+    words = [rnd.randbytes(4).hex().encode() for _ in range(1000)]
+    return b" ".join(rnd.choice(words) for _ in range(nwords))
+
+
+def test_inflate_random_access(tmp_path):
+    data = make_text(300_000)
+    (tmp_path / "data.z").write_bytes(zlib.compress(data, 9))
+    index_path = str(tmp_path / "data.zidx")
+
+    f = InflateRawIOBase(
+        str(tmp_path / "data.z"), span=64 * 1024, index_path=index_path
+    )
+    assert f.sz == len(data)
+    assert len(f.points) > 10
+    rnd = random.Random(1)
+    for _ in range(50):
+        off, n = rnd.randrange(len(data)), rnd.randrange(4096)
+        assert f.pread(off, n) == data[off : off + n]
+    f.seek(0)
+    assert f.read() == data
+    f.close()
+
+    # reopening with the saved index starts near the end instead of at 0
+    g = InflateRawIOBase(
+        str(tmp_path / "data.z"), span=64 * 1024, index_path=index_path
+    )
+    assert g.usz == len(data)
+    assert g.points[-1].out > len(data) - 2 * 64 * 1024
+    assert g.pread(len(data) - 100, 200) == data[-100:]
+
+
+def test_import_without_libz():
+    # libz is only loaded once something is inflated
+    code = (
+        "import ctypes, ctypes.util\n"
+        "CDLL, find_library = ctypes.CDLL, ctypes.util.find_library\n"
+        "def no_libz(name, *args, **kwargs):\n"
+        "    if name and 'libz' in name:\n"
+        "        raise OSError(f'{name}: cannot open shared object file')\n"
+        "    return CDLL(name, *args, **kwargs)\n"
+        "ctypes.CDLL = no_libz\n"
+        "ctypes.util.find_library = lambda n: None if n == 'z' else find_library(n)\n"
+        "import ps3mfw\n"
+    )
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
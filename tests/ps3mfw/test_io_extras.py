@@ -0,0 +1,372 @@
+import io
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from ps3mfw.httpd import FastRangeHTTPRequestHandler, FastRangeHTTPServer
+from ps3mfw.io_extras import (
+    FancyRawIOBaseProxy,
+    HTTPFile,
+    InstrumentedRawIOBase,
+    MmapFile,
+    OffsetRawIOBase,
+    iter_multipart_byteranges,
+)
+from ps3mfw.iostats import AccessTrace, parse_trace
+from ps3mfw.testing import (
+    CountingRangeHTTPRequestHandler,
+    RangeHTTPRequestHandler,
+    http_server,
+)
+
+URL = "http://localhost:38080/blob.bin"
+BLKSZ = 64 * 1024
+
+
+def make_blob(directory: Path, size: int) -> bytes:
+    buf = os.urandom(size)
+    (directory / "blob.bin").write_bytes(buf)
+    return buf
+
+
+def test_httpfile_coalesced_read(tmp_path):
+    buf = make_blob(tmp_path, 16 * BLKSZ + 123)
+    CountingRangeHTTPRequestHandler.requests = []
+    with http_server(directory=tmp_path, handler_class=CountingRangeHTTPRequestHandler):
+        fh = HTTPFile(URL, blksz=BLKSZ, max_req_sz=4 * BLKSZ)
+        assert fh.read() == buf
+        # 17 blocks capped at 4 blocks per request
+        assert len(CountingRangeHTTPRequestHandler.gets()) == 5
+        fh.seek(0)
+        assert fh.read() == buf
+        assert len(CountingRangeHTTPRequestHandler.gets()) == 5
+
+
+def test_httpfile_coalesced_read_around_cached(tmp_path):
+    buf = make_blob(tmp_path, 8 * BLKSZ)
+    CountingRangeHTTPRequestHandler.requests = []
+    with http_server(directory=tmp_path, handler_class=CountingRangeHTTPRequestHandler):
+        fh = HTTPFile(URL, blksz=BLKSZ)
+        fh.seek(3 * BLKSZ + 10)
+        assert fh.read(10) == buf[3 * BLKSZ + 10 : 3 * BLKSZ + 20]
+        fh.seek(0)
+        assert fh.read() == buf
+        assert CountingRangeHTTPRequestHandler.gets() == [
+            f"bytes={3 * BLKSZ}-{4 * BLKSZ - 1}",
+            f"bytes=0-{3 * BLKSZ - 1}",
+            f"bytes={4 * BLKSZ}-{8 * BLKSZ - 1}",
+        ]
+
+
+def test_iter_multipart_byteranges():
+    body = (
+        b"--XYZ\r\nContent-Type: application/octet-stream\r\n"
+        b"Content-Range: bytes 0-3/100\r\n\r\nabcd\r\n"
+        b"--XYZ\r\nContent-Range: bytes 50-51/100\r\n\r\nef\r\n"
+        b"--XYZ--\r\n"
+    )
+    assert list(iter_multipart_byteranges(body, "XYZ")) == [(0, b"abcd"), (50, b"ef")]
+
+
+def test_httpfile_readahead(tmp_path):
+    buf = make_blob(tmp_path, 32 * BLKSZ + 5)
+    CountingRangeHTTPRequestHandler.requests = []
+    with http_server(directory=tmp_path, handler_class=CountingRangeHTTPRequestHandler):
+        fh = HTTPFile(URL, blksz=BLKSZ, readahead=4)
+        chunks = []
+        while fh.tell() < len(buf):
+            chunks.append(fh.read(min(BLKSZ // 3, len(buf) - fh.tell())))
+        fh.close()
+        assert b"".join(chunks) == buf
+        # every block fetched exactly once, whether by read() or read-ahead
+        ranges = CountingRangeHTTPRequestHandler.gets()
+        assert len(ranges) == len(set(ranges)) == 33
+
+
+class FailOnceHTTPRequestHandler(RangeHTTPRequestHandler):
+    fail = set()
+
+    def send_head(self):
+        if self.headers.get("Range") in type(self).fail:
+            type(self).fail.discard(self.headers["Range"])
+            self.send_error(404)
+            return None
+        return super().send_head()
+
+
+def test_httpfile_readahead_failure(tmp_path):
+    buf = make_blob(tmp_path, 8 * BLKSZ)
+    FailOnceHTTPRequestHandler.fail = {f"bytes={BLKSZ}-{2 * BLKSZ - 1}"}
+    with http_server(directory=tmp_path, handler_class=FailOnceHTTPRequestHandler):
+        fh = HTTPFile(URL, blksz=BLKSZ, readahead=4)
+        assert fh.read(BLKSZ) == buf[:BLKSZ]
+        # the read-ahead of the next block failed, the read fetches it itself
+        assert fh.read(BLKSZ) == buf[BLKSZ : 2 * BLKSZ]
+        assert not FailOnceHTTPRequestHandler.fail
+        fh.close()
+
+
+def test_httpfile_disk_cache(tmp_path):
+    srv_dir, cache_dir = tmp_path / "srv", tmp_path / "cache"
+    srv_dir.mkdir()
+    buf = make_blob(srv_dir, 4 * BLKSZ + 7)
+    CountingRangeHTTPRequestHandler.requests = []
+    with http_server(directory=srv_dir, handler_class=CountingRangeHTTPRequestHandler):
+        fh = HTTPFile(URL, blksz=BLKSZ, cache_dir=str(cache_dir))
+        assert fh.read() == buf
+        fh.close()
+        assert len(CountingRangeHTTPRequestHandler.gets()) == 1
+
+        # warm cache: no data requests at all
+        fh = HTTPFile(URL, blksz=BLKSZ, cache_dir=str(cache_dir))
+        assert fh.read() == buf
+        fh.close()
+        assert len(CountingRangeHTTPRequestHandler.gets()) == 1
+
+        # changed validators invalidate the old entry
+        buf = make_blob(srv_dir, 4 * BLKSZ + 7)
+        os.utime(srv_dir / "blob.bin", (0, 0))
+        fh = HTTPFile(URL, blksz=BLKSZ, cache_dir=str(cache_dir))
+        assert fh.read() == buf
+        fh.close()
+        assert len(CountingRangeHTTPRequestHandler.gets()) == 2
+        assert len(list(cache_dir.glob("*.bin"))) == 1
+
+
+def test_httpfile_disk_cache_eviction(tmp_path):
+    srv_dir, cache_dir = tmp_path / "srv", tmp_path / "cache"
+    srv_dir.mkdir()
+    make_blob(srv_dir, 4 * BLKSZ)
+    (srv_dir / "blob2.bin").write_bytes(os.urandom(4 * BLKSZ))
+    with http_server(directory=srv_dir):
+        fh = HTTPFile(URL, blksz=BLKSZ, cache_dir=str(cache_dir))
+        fh.read()
+        fh.close()
+        os.utime(next(cache_dir.glob("*.bin")), (0, 0))
+        fh = HTTPFile(
+            URL.replace("blob", "blob2"),
+            blksz=BLKSZ,
+            cache_dir=str(cache_dir),
+            cache_max_sz=5 * BLKSZ,
+        )
+        fh.read()
+        fh.close()
+        # opening the second entry evicted the least recently used first one
+        assert len(list(cache_dir.glob("*.bin"))) == 1
+
+
+def test_httpfile_bounded_cache(tmp_path):
+    buf = make_blob(tmp_path, 16 * BLKSZ + 9)
+    CountingRangeHTTPRequestHandler.requests = []
+    with http_server(directory=tmp_path, handler_class=CountingRangeHTTPRequestHandler):
+        fh = HTTPFile(URL, blksz=BLKSZ, cache_max_mem=4 * BLKSZ)
+        assert fh.read() == buf
+        assert len(fh._blkpool) == 4
+        assert fh.stats.misses == 17 and fh.stats.evictions == 13
+        # the tail is still resident, the head was evicted
+        fh.seek(16 * BLKSZ)
+        assert fh.read() == buf[16 * BLKSZ :]
+        fh.seek(0)
+        assert fh.read(10) == buf[:10]
+        assert fh.stats.hits == 1 and fh.stats.misses == 18
+
+
+def test_readinto_view_stack(tmp_path):
+    buf = make_blob(tmp_path, 8 * BLKSZ + 3)
+    with http_server(directory=tmp_path):
+        for kwargs in ({}, {"cache_max_mem": 2 * BLKSZ}):
+            fh = HTTPFile(URL, blksz=BLKSZ, **kwargs)
+            sub = OffsetRawIOBase(fh, off=100, sz=5 * BLKSZ).subfile(10, 3 * BLKSZ)
+            seg = buf[110 : 110 + 3 * BLKSZ]
+            out = bytearray(BLKSZ)
+            assert sub.readinto(out) == BLKSZ and out == seg[:BLKSZ]
+            with sub.view(5, 20) as v:
+                assert v == seg[5:25]
+            dst = io.BytesIO()
+            assert sub.copy_to(dst, bufsz=1000) == len(seg)
+            assert dst.getvalue() == seg
+            sub.seek(0)
+            assert io.BufferedReader(sub, 4096).read() == seg
+
+
+def _read_segments_concurrently(fh, buf, nsegs):
+    segsz = len(buf) // nsegs
+
+    def read_seg(i):
+        sub = OffsetRawIOBase(fh, off=i * segsz, sz=segsz)
+        chunks = []
+        while chunk := sub.read(4097):
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    with ThreadPoolExecutor(max_workers=nsegs) as pool:
+        segs = list(pool.map(read_seg, range(nsegs)))
+    assert segs == [buf[i * segsz : (i + 1) * segsz] for i in range(nsegs)]
+
+
+def test_concurrent_segment_reads(tmp_path):
+    buf = make_blob(tmp_path, 8 * BLKSZ)
+    _read_segments_concurrently(FancyRawIOBaseProxy(str(tmp_path / "blob.bin")), buf, 8)
+    with http_server(directory=tmp_path):
+        _read_segments_concurrently(HTTPFile(URL, blksz=BLKSZ // 4), buf, 8)
+
+
+def test_httpfile_threads_share_connections(tmp_path):
+    buf = make_blob(tmp_path, 64 * BLKSZ)
+    with http_server(
+        directory=tmp_path,
+        server_class=FastRangeHTTPServer,
+        handler_class=FastRangeHTTPRequestHandler,
+    ):
+        fh = HTTPFile(URL, blksz=BLKSZ)
+        nfds = len(os.listdir("/proc/self/fd"))
+        # short-lived reader threads, as FUSE and verify() start
+        for blk in range(64):
+            t = threading.Thread(target=fh.pread, args=(blk * BLKSZ, BLKSZ))
+            t.start()
+            t.join()
+        assert fh.read() == buf
+        # a kept-alive connection, counting the server's end, not one per thread
+        assert len(os.listdir("/proc/self/fd")) - nfds <= 4
+        fh.close()
+
+
+class ShortRangeHTTPRequestHandler(RangeHTTPRequestHandler):
+    num_short = 0
+
+    def copyfile(self, infile, outfile):
+        if type(self).num_short:
+            # claims the requested range but stops halfway through
+            type(self).num_short -= 1
+            start, end = self.range
+            infile.seek(start)
+            outfile.write(infile.read((end - start + 1) // 2))
+            return
+        super().copyfile(infile, outfile)
+
+    def send_header(self, keyword, value):
+        if (
+            keyword == "Content-Length"
+            and self.command == "GET"
+            and type(self).num_short
+        ):
+            value = str(int(value) // 2)
+        super().send_header(keyword, value)
+
+
+def test_httpfile_short_response(tmp_path):
+    buf = make_blob(tmp_path, 4 * BLKSZ)
+    with http_server(directory=tmp_path, handler_class=ShortRangeHTTPRequestHandler):
+        ShortRangeHTTPRequestHandler.num_short = 1
+        fh = HTTPFile(URL, blksz=BLKSZ, backoff=0)
+        assert fh.read() == buf
+        assert fh.http_stats.requests == 3
+        ShortRangeHTTPRequestHandler.num_short = 10
+        fh = HTTPFile(URL, blksz=BLKSZ, backoff=0, retries=1)
+        with pytest.raises(OSError):
+            fh.pread(0, 10)
+
+
+class MirrorRangeHTTPRequestHandler(RangeHTTPRequestHandler):
+    paths = []
+
+    def do_GET(self):
+        type(self).paths.append(self.path)
+        if self.path.startswith("/flaky/"):
+            self.send_error(503)
+            return
+        super().do_GET()
+
+
+def test_httpfile_mirrors(tmp_path):
+    buf = os.urandom(8 * BLKSZ + 5)
+    for mirror in ("a", "b", "flaky"):
+        (tmp_path / mirror).mkdir()
+        (tmp_path / mirror / "blob.bin").write_bytes(buf)
+    (tmp_path / "short.bin").write_bytes(buf[:-1])
+    base = "http://localhost:38080"
+    MirrorRangeHTTPRequestHandler.paths = []
+    with http_server(directory=tmp_path, handler_class=MirrorRangeHTTPRequestHandler):
+        fh = HTTPFile(f"{base}/a/blob.bin", mirrors=[f"{base}/b/blob.bin"], blksz=BLKSZ)
+        assert fh.read() == buf
+        # one stripe of 5 blocks and one of the other 4, fetched concurrently
+        assert sorted(MirrorRangeHTTPRequestHandler.paths) == [
+            "/a/blob.bin",
+            "/b/blob.bin",
+        ]
+        fh.close()
+        MirrorRangeHTTPRequestHandler.paths = []
+        fh = HTTPFile(
+            f"{base}/flaky/blob.bin",
+            mirrors=[f"{base}/a/blob.bin", f"{base}/missing.bin"],
+            blksz=BLKSZ,
+            backoff=60,
+        )
+        for blk in range(4):
+            assert fh.pread(blk * BLKSZ, 10) == buf[blk * BLKSZ : blk * BLKSZ + 10]
+        # the missing mirror is dropped and the 503 retried at once on the
+        # next one, after which the flaky mirror cools down
+        assert MirrorRangeHTTPRequestHandler.paths == [
+            "/flaky/blob.bin",
+            "/a/blob.bin",
+            "/a/blob.bin",
+            "/a/blob.bin",
+            "/a/blob.bin",
+        ]
+        fh.close()
+        with pytest.raises(ValueError):
+            HTTPFile(f"{base}/a/blob.bin", mirrors=[f"{base}/short.bin"])
+
+
+def test_instrumented_stats_and_trace(tmp_path):
+    buf = make_blob(tmp_path, 4 * BLKSZ)
+    trace = AccessTrace.open(str(tmp_path / "trace.txt"))
+    with http_server(tmp_path):
+        http_fh = HTTPFile(URL, blksz=BLKSZ)
+        fh = InstrumentedRawIOBase(http_fh, name="blob", trace=trace)
+        seg = OffsetRawIOBase(fh, off=100, sz=2 * BLKSZ)
+        assert seg.pread(0, 10) == buf[100:110]
+        with seg.seek_ctx(BLKSZ):
+            assert seg.read(BLKSZ + 5) == buf[100 + BLKSZ : 100 + 2 * BLKSZ]
+        assert fh.pread(3 * BLKSZ, 10) == buf[3 * BLKSZ : 3 * BLKSZ + 10]
+    trace.close()
+
+    assert (seg.io_stats.reads, seg.io_stats.seeks) == (2, 2)
+    assert seg.io_stats.bytes_requested == 10 + BLKSZ + 5
+    assert seg.io_stats.bytes_delivered == 10 + BLKSZ
+    assert fh.io_stats.reads == 3 and fh.io_stats.latency.count == 3
+    # HEAD, then one GET per read covering blocks 0, 1-2 and 3
+    assert http_fh.http_stats.requests == 4
+    assert http_fh.http_stats.bytes_received == 4 * BLKSZ
+    assert (http_fh.stats.hits, http_fh.stats.misses) == (0, 4)
+    assert [a[1:] for a in parse_trace(str(tmp_path / "trace.txt"))] == [
+        ("blob", 100, 10),
+        ("blob", 100 + BLKSZ, BLKSZ),
+        ("blob", 3 * BLKSZ, 10),
+    ]
+
+
+def test_mmap_file(tmp_path):
+    buf = make_blob(tmp_path, 3 * BLKSZ + 7)
+    fh = FancyRawIOBaseProxy(str(tmp_path / "blob.bin"))
+    assert isinstance(fh, MmapFile) and fh.sz == len(buf)
+    with fh[10:20] as v:
+        assert isinstance(v, memoryview) and v == buf[10:30]
+    sub = OffsetRawIOBase(fh, off=100, sz=2 * BLKSZ).subfile(10, BLKSZ)
+    with sub.view(5, 20) as v:
+        # a view of the mapping itself, not a copy
+        assert isinstance(v.obj, mmap.mmap) and v == buf[115:135]
+    out = bytearray(10)
+    assert (
+        sub.preadinto(BLKSZ - 5, out) == 5 and out[:5] == buf[105 + BLKSZ : 110 + BLKSZ]
+    )
+    dst = io.BytesIO()
+    assert sub.copy_to(dst, bufsz=1000) == BLKSZ
+    assert dst.getvalue() == buf[110 : 110 + BLKSZ]
+    assert os.pread(fh.fileno(), 4, 0) == buf[:4]
+    fh.close()
+    assert fh.closed
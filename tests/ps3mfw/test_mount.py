@@ -0,0 +1,112 @@
+import errno
+import io
+import os
+import stat
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from ps3mfw.io_extras import FancyRawIOBaseProxy
+from ps3mfw.mount import PUPFuseOps
+from ps3mfw.pup import PUPFS
+from ps3mfw.tar import TarFS
+from ps3mfw.testing import build_test_pup
+
+
+def test_fuse_ops(tmp_path):
+    vsh = os.urandom(300_000)
+    (tmp_path / "fw.pup").write_bytes(build_test_pup({0x100: b"4.90\n", 0x201: vsh}))
+    ops = PUPFuseOps(PUPFS(FancyRawIOBaseProxy(str(tmp_path / "fw.pup"))))
+
+    assert ops("readdir", "/", None) == [".", "..", "version.txt", "vsh.tar"]
+    assert stat.S_ISDIR(ops("getattr", "/")["st_mode"])
+    attrs = ops("getattr", "/vsh.tar")
+    assert stat.S_ISREG(attrs["st_mode"]) and attrs["st_size"] == len(vsh)
+    with pytest.raises(OSError) as e:
+        ops("getattr", "/missing")
+    assert e.value.errno == errno.ENOENT
+
+    fi = SimpleNamespace(flags=os.O_RDONLY, fh=0, keep_cache=0)
+    ops("open", "/vsh.tar", fi)
+    assert fi.keep_cache == 1
+    with ThreadPoolExecutor(8) as pool:
+        chunks = list(
+            pool.map(
+                lambda off: ops("read", "/vsh.tar", 4096, off, fi),
+                range(0, len(vsh), 4096),
+            )
+        )
+    assert b"".join(chunks) == vsh
+    ops("release", "/vsh.tar", fi)
+
+    with pytest.raises(OSError) as e:
+        ops("open", "/vsh.tar", SimpleNamespace(flags=os.O_RDWR, fh=0, keep_cache=0))
+    assert e.value.errno == errno.EROFS
+
+
+def test_fuse_ops_readlink(tmp_path):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tf:
+        ti = tarfile.TarInfo("dev_flash/vsh/a.sprx")
+        ti.size = 3
+        tf.addfile(ti, io.BytesIO(b"abc"))
+        ti = tarfile.TarInfo("dev_flash/sym")
+        ti.type, ti.linkname = tarfile.SYMTYPE, "vsh/a.sprx"
+        tf.addfile(ti)
+    (tmp_path / "seg.tar").write_bytes(buf.getvalue())
+    ops = PUPFuseOps(TarFS(FancyRawIOBaseProxy(str(tmp_path / "seg.tar"))))
+
+    assert stat.S_ISLNK(ops("getattr", "/dev_flash/sym")["st_mode"])
+    assert ops("readlink", "/dev_flash/sym") == "vsh/a.sprx"
+    with pytest.raises(OSError) as e:
+        ops("readlink", "/dev_flash/vsh/a.sprx")
+    assert e.value.errno == errno.EINVAL
+
+
+def test_mount_pup_nested_url(tmp_path, monkeypatch):
+    import ps3mfw.mount
+    from ps3mfw.tools.ps3mfw import mount_pup
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tf:
+        ti = tarfile.TarInfo("dev_flash/vsh/a.sprx")
+        ti.size = 3
+        tf.addfile(ti, io.BytesIO(b"abc"))
+    (tmp_path / "fw.pup").write_bytes(build_test_pup({0x300: buf.getvalue()}))
+    mounted = []
+    monkeypatch.setattr(
+        ps3mfw.mount,
+        "mount",
+        lambda fs, *args, **kwargs: mounted.append(fs.listdir("/")),
+    )
+    args = SimpleNamespace(
+        mountpoint=str(tmp_path / "mnt"),
+        background=False,
+        max_read=4096,
+        max_readahead=4096,
+        allow_other=False,
+        stats=False,
+        trace=None,
+    )
+    # the last layer is a directory inside the innermost container
+    for source, listing in (
+        (f"{tmp_path}/fw.pup", ["update_files.tar"]),
+        (f"pup://{tmp_path}/fw.pup!/update_files.tar!/", ["dev_flash"]),
+        (f"{tmp_path}/fw.pup!/update_files.tar!/dev_flash", ["vsh"]),
+    ):
+        assert mount_pup(SimpleNamespace(source=source, **vars(args))) == 0
+        assert mounted.pop() == listing
+    with pytest.raises(SystemExit):
+        mount_pup(
+            SimpleNamespace(source=f"{tmp_path}/fw.pup!/update_files.tar", **vars(args))
+        )
+    # the reads of a mount are not instrumented, so the flags are refused
+    with pytest.raises(SystemExit, match="--stats"):
+        mount_pup(
+            SimpleNamespace(
+                source=f"{tmp_path}/fw.pup", **{**vars(args), "stats": True}
+            )
+        )
+    assert not mounted
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+import fs
+import fs.opener
+
+import ps3mfw.pup
+from ps3mfw.pup import ContainerCache, PUPFSOpener, container_cache, open_nested
+from ps3mfw.tar import TarFS
+from ps3mfw.testing import build_test_pup, http_server
+
+from .test_tar import FILES, build_test_tar
+
+
+def test_nested_pup_tar_url(tmp_path):
+    build_test_tar(tmp_path / "seg.bin", FILES)
+    tar_buf = (tmp_path / "seg.bin").read_bytes()
+    (tmp_path / "fw.pup").write_bytes(
+        build_test_pup({0x100: b"4.90\n", 0x300: tar_buf[3 * 1024 : -3 * 1024]})
+    )
+    fs.opener.registry.install(PUPFSOpener)
+    container_cache.clear()
+    misses = container_cache.misses
+    with http_server(directory=tmp_path):
+        base = "pup://http://localhost:38080/fw.pup!/update_files.tar"
+        for name, data in FILES.items():
+            tfs, path = open_nested(f"{base}!/{name}")
+            assert isinstance(tfs.delegate_fs(), TarFS) and path == f"/{name}"
+            assert tfs.readbytes(path) == data
+            tfs.close()
+        # the PUP and the tar were each parsed once
+        assert container_cache.misses - misses == 2
+
+        tfs = fs.open_fs(f"{base}!/")
+        assert tfs.listdir("/") == ["dev_flash"]
+        pupfs = fs.open_fs("pup://http://localhost:38080/fw.pup")
+        assert sorted(pupfs.listdir("/")) == ["update_files.tar", "version.txt"]
+
+    pupfs, path = open_nested("pup://fw.pup!/version.txt", cwd=str(tmp_path))
+    assert pupfs.readbytes(path) == b"4.90\n"
+
+
+def test_container_cache_handles(tmp_path):
+    fs.opener.registry.install(PUPFSOpener)
+    container_cache.clear()
+    (tmp_path / "fw.pup").write_bytes(build_test_pup({0x100: b"1\n"}))
+    url = f"pup://{tmp_path / 'fw.pup'}"
+    with fs.open_fs(url) as pupfs:
+        shared = pupfs.delegate_fs()
+        assert pupfs.readbytes("version.txt") == b"1\n"
+    # closing one handle leaves the cached container open for the next
+    with fs.open_fs(url) as pupfs:
+        assert not pupfs.isclosed() and pupfs.delegate_fs() is shared
+        assert pupfs.readbytes("version.txt") == b"1\n"
+    assert not shared.isclosed()
+
+    # a replaced PUP is opened afresh and the stale container closed
+    (tmp_path / "new.pup").write_bytes(build_test_pup({0x100: b"22\n"}))
+    os.replace(tmp_path / "new.pup", tmp_path / "fw.pup")
+    with fs.open_fs(url) as pupfs:
+        assert pupfs.readbytes("version.txt") == b"22\n"
+    assert shared.isclosed()
+
+    # unreferenced containers beyond maxsize are closed
+    cache = ContainerCache(maxsize=0)
+    pupfs = cache.open(str(tmp_path / "fw.pup"))
+    shared = pupfs.delegate_fs()
+    assert not shared.isclosed()
+    pupfs.close()
+    assert shared.isclosed() and shared.fh.closed
+
+
+def test_container_cache_opens_outside_lock(tmp_path, monkeypatch):
+    for name in ("slow.pup", "fast.pup"):
+        (tmp_path / name).write_bytes(build_test_pup({0x100: b"1\n"}))
+    open_path = ps3mfw.pup.open_path
+    started = threading.Event()
+
+    def slow_open_path(path, *args):
+        if path.endswith("slow.pup"):
+            started.set()
+            time.sleep(0.5)
+        return open_path(path, *args)
+
+    monkeypatch.setattr(ps3mfw.pup, "open_path", slow_open_path)
+    cache = ContainerCache()
+    cache.open(str(tmp_path / "fast.pup")).close()
+    handles = []
+
+    def open_slow():
+        handles.append(cache.open(str(tmp_path / "slow.pup")))
+
+    threads = [threading.Thread(target=open_slow) for _ in range(2)]
+    for t in threads:
+        t.start()
+    started.wait()
+    # a hit on another container does not wait for the slow one
+    t0 = time.perf_counter()
+    cache.open(str(tmp_path / "fast.pup")).close()
+    assert time.perf_counter() - t0 < 0.25
+    for t in threads:
+        t.join()
+    # the two callers shared one open of the slow container
+    assert cache.misses == 2
+    assert handles[0].delegate_fs() is handles[1].delegate_fs()
+    for h in handles:
+        h.close()
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 import importlib.resources
+import os
 from contextlib import nullcontext
 from pathlib import Path
 
-from ps3mfw.io_extras import HTTPFile
-from ps3mfw.pup import PUP, PUPFile
-
-from .http_ranges_server import http_server
+from ps3mfw.io_extras import FancyRawIOBaseProxy, HTTPFile
+from ps3mfw.pup import PUP, PUPFile, PUPWriter, get_seg_id
+from ps3mfw.testing import (
+    TEST_HMAC_KEY,
+    CountingRangeHTTPRequestHandler,
+    build_test_pup,
+    http_server,
+)
 
 CWD = Path(__file__).parent
 
@@ -38,5 +43,65 @@ def test_pupfile():
         pupf.rootfs.dump()
 
 
+def test_pupfile_verify(tmp_path):
+    segments = {
+        0x100: b"3.55\n",
+        0x200: os.urandom(300 * 1024),
+        0x300: os.urandom(1024 * 1024 + 17),
+    }
+    pup_path = tmp_path / "test.pup"
+    pup_path.write_bytes(build_test_pup(segments))
+    pupf = PUPFile(FancyRawIOBaseProxy(str(pup_path)))
+    results = pupf.verify(TEST_HMAC_KEY, chunk_sz=64 * 1024)
+    assert [r.name for r in results] == [
+        "header",
+        "version.txt",
+        "ps3swu.self",
+        "update_files.tar",
+    ]
+    assert all(r.ok for r in results)
+
+    with http_server(directory=tmp_path):
+        pupf = PUPFile(HTTPFile("http://localhost:38080/test.pup", blksz=64 * 1024))
+        assert all(r.ok for r in pupf.verify(TEST_HMAC_KEY))
+
+    buf = bytearray(pup_path.read_bytes())
+    buf[-1] ^= 1
+    pup_path.write_bytes(buf)
+    pupf = PUPFile(FancyRawIOBaseProxy(str(pup_path)))
+    assert [r.ok for r in pupf.verify(TEST_HMAC_KEY)] == [True, True, True, False]
+
+
+def test_pupfile_remote_open_round_trips(tmp_path):
+    # 48 + 20 * 64 + 32 bytes of header and tables span two 1 KiB blocks
+    segments = {0x1000 + i: os.urandom(100) for i in range(20)}
+    (tmp_path / "test.pup").write_bytes(build_test_pup(segments))
+    CountingRangeHTTPRequestHandler.requests = []
+    with http_server(directory=tmp_path, handler_class=CountingRangeHTTPRequestHandler):
+        pupf = PUPFile(HTTPFile("http://localhost:38080/test.pup", blksz=1024))
+    assert len(pupf.pup.segment_table) == 20
+    assert len(CountingRangeHTTPRequestHandler.gets()) == 1
+
+
+def test_pupwriter_replace(tmp_path):
+    segments = {
+        0x100: b"3.55\n",
+        0x201: os.urandom(200 * 1024),
+        0x300: os.urandom(700 * 1024 + 3),
+    }
+    (tmp_path / "in.pup").write_bytes(build_test_pup(segments))
+    new_vsh = os.urandom(123 * 1024 + 1)
+    (tmp_path / "vsh.tar").write_bytes(new_vsh)
+    src = PUPFile(FancyRawIOBaseProxy(str(tmp_path / "in.pup")))
+    writer = PUPWriter(src, TEST_HMAC_KEY)
+    writer.replace(get_seg_id("vsh.tar"), str(tmp_path / "vsh.tar"))
+    writer.write(str(tmp_path / "out.pup"))
+
+    segments[0x201] = new_vsh
+    assert (tmp_path / "out.pup").read_bytes() == build_test_pup(segments)
+    out = PUPFile(FancyRawIOBaseProxy(str(tmp_path / "out.pup")))
+    assert all(r.ok for r in out.verify(TEST_HMAC_KEY))
+
+
 if __name__ == "__main__":
     test_pupfile()
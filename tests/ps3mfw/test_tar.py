@@ -0,0 +1,89 @@
+import io
+import os
+import tarfile
+
+from ps3mfw.io_extras import Advice, FancyRawIOBaseProxy, HTTPFile, OffsetRawIOBase
+from ps3mfw.tar import TarFS, scan_tar
+from ps3mfw.testing import http_server
+
+PAD = 3 * 1024
+
+
+def build_test_tar(path, files):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tf:
+        for name, data in files.items():
+            ti = tarfile.TarInfo(name)
+            ti.size = len(data)
+            tf.addfile(ti, io.BytesIO(data))
+        ti = tarfile.TarInfo("dev_flash/vsh/module/link.sprx")
+        ti.type, ti.linkname = tarfile.LNKTYPE, "dev_flash/vsh/module/a.sprx"
+        tf.addfile(ti)
+        ti = tarfile.TarInfo("dev_flash/sym")
+        ti.type, ti.linkname = tarfile.SYMTYPE, "vsh"
+        tf.addfile(ti)
+    # embed at an offset, as inside a PUP segment
+    path.write_bytes(os.urandom(PAD) + buf.getvalue() + os.urandom(PAD))
+    return len(buf.getvalue())
+
+
+FILES = {
+    "dev_flash/vsh/module/a.sprx": os.urandom(70 * 1024),
+    "dev_flash/vsh/module/b.sprx": os.urandom(90 * 1024 + 5),
+    "dev_flash/" + "x" * 120 + "/long.txt": b"long name\n",
+}
+
+
+def test_tarfs_local(tmp_path):
+    tar_sz = build_test_tar(tmp_path / "seg.bin", FILES)
+    seg = OffsetRawIOBase(
+        FancyRawIOBaseProxy(str(tmp_path / "seg.bin")), off=PAD, sz=tar_sz
+    )
+    tfs = TarFS(seg)
+    assert sorted(tfs.listdir("/dev_flash")) == ["sym", "vsh", "x" * 120]
+    assert sorted(tfs.listdir("/dev_flash/vsh/module")) == [
+        "a.sprx",
+        "b.sprx",
+        "link.sprx",
+    ]
+    for name, data in FILES.items():
+        assert tfs.getinfo("/" + name).size == len(data)
+        with tfs.openbin("/" + name) as f:
+            assert f.read() == data
+    assert (
+        tfs.readbytes("/dev_flash/vsh/module/link.sprx")
+        == FILES["dev_flash/vsh/module/a.sprx"]
+    )
+
+
+def test_tarfs_http_headers_only(tmp_path):
+    tar_sz = build_test_tar(tmp_path / "seg.bin", FILES)
+    index_path = str(tmp_path / "seg.idx")
+    with http_server(directory=tmp_path):
+        fh = HTTPFile("http://localhost:38080/seg.bin", blksz=4096)
+        tfs = TarFS(OffsetRawIOBase(fh, off=PAD, sz=tar_sz), index_path=index_path)
+        fetched = fh.stats.misses * fh.blksz
+        # member bodies were skipped over
+        assert fetched < sum(len(d) for d in FILES.values()) // 4
+        assert (
+            tfs.readbytes("/dev_flash/vsh/module/b.sprx")
+            == FILES["dev_flash/vsh/module/b.sprx"]
+        )
+
+        # the saved index makes reopening read just the first header
+        fh = HTTPFile("http://localhost:38080/seg.bin", blksz=4096)
+        tfs = TarFS(OffsetRawIOBase(fh, off=PAD, sz=tar_sz), index_path=index_path)
+        assert fh.stats.misses <= 2
+        assert sorted(tfs.listdir("/dev_flash/vsh/module"))[0] == "a.sprx"
+
+
+def test_scan_tar_restores_advice(tmp_path):
+    tar_sz = build_test_tar(tmp_path / "seg.bin", FILES)
+    fh = FancyRawIOBaseProxy(str(tmp_path / "seg.bin"))
+    advice = []
+    fh.advise = lambda offset, length, hint=Advice.WILLNEED: advice.append(
+        (offset, length, hint)
+    )
+    assert len(scan_tar(OffsetRawIOBase(fh, off=PAD, sz=tar_sz))) == len(FILES) + 2
+    assert advice[0] == (PAD, tar_sz, Advice.RANDOM)
+    assert advice[-1] == (PAD, tar_sz, Advice.NORMAL)